@@ -1,8 +1,19 @@
+import time
+script_started = time.perf_counter()
+
 import streamlit as st
-import pandas as pd
-import os
-import json
-from src.utils import configure_genai, get_gemini_response, process_csv_file, generate_data_profile_summary
+import base64
+# Loads environment variables, so it comes before the other src modules
+from src.settings import get_api_key_error
+from src.response_cache import get_cache_stats
+from src.metrics import get_metrics, record_startup, stage_timer
+from src.history import HISTORY_PAGE_SIZE, ConversationHistory
+from src.retrieval import RetrievalIndex
+from src.checkpoints import get_checkpoint_store, new_project_id
+
+# pandas, the Gemini SDK and the modules built on them are imported where they
+# are first needed, so the setup screen renders without loading them
+imports_finished = time.perf_counter()
 
 # Page configuration
 st.set_page_config(
@@ -12,8 +23,11 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Configure Gemini API
-configure_genai()
+# Check the API key now; the Gemini SDK itself is configured on the first request
+api_key_error = get_api_key_error()
+if api_key_error:
+    st.error(api_key_error)
+    st.stop()
 
 # Initialize session state variables if they don't exist
 if 'project_initialized' not in st.session_state:
@@ -37,13 +51,37 @@ if 'analysis_results' not in st.session_state:
 if 'final_report' not in st.session_state:
     st.session_state.final_report = None
 if 'conversation_history' not in st.session_state:
-    st.session_state.conversation_history = []
+    st.session_state.conversation_history = ConversationHistory()
+if 'context_index' not in st.session_state:
+    st.session_state.context_index = RetrievalIndex()
+if 'own_projects' not in st.session_state:
+    st.session_state.own_projects = set()
+# The history pager's widget state; Streamlit drops it on runs without the pager
+if 'history_page' not in st.session_state:
+    st.session_state.history_page = 1
+
+# The signed-in user when Streamlit authentication is configured, else None
+def current_owner():
+    return st.user.get("email") if st.user.get("is_logged_in") else None
+
+# Hand this session's datasets back to the shared registry
+def release_datasets():
+    # Before any upload this is still a plain dict
+    if hasattr(st.session_state.dataframes, "release"):
+        st.session_state.dataframes.release()
+
+# Discard any prefetched results; there is no prefetcher until the first prefetch,
+# e.g. after resuming a project that already has its guidance
+def invalidate_prefetch():
+    if 'prefetcher' in st.session_state:
+        st.session_state.prefetcher.invalidate()
 
 # Function to reset the session state
 def reset_session():
     st.session_state.project_initialized = False
     st.session_state.current_step = 0
     st.session_state.data_uploaded = False
+    release_datasets()
     st.session_state.dataframes = {}
     st.session_state.data_profiles = {}
     st.session_state.manager_plan = None
@@ -51,17 +89,269 @@ def reset_session():
     st.session_state.associate_guidance = None
     st.session_state.analysis_results = []
     st.session_state.final_report = None
-    st.session_state.conversation_history = []
+    st.session_state.conversation_history.clear()
+    st.session_state.context_index.clear()
+    invalidate_prefetch()
+    # The project stays saved and can be resumed from the setup screen
+    st.session_state.project_id = None
+    if "project" in st.query_params:
+        del st.query_params["project"]
 
 # Add a message to the conversation history
 def add_to_conversation(role, content):
-    st.session_state.conversation_history.append({
-        "role": role,
-        "content": content
-    })
+    st.session_state.conversation_history.append(role, content)
+
+# Discard a generated result so it is regenerated without the response cache
+def request_regeneration(state_key):
+    st.session_state[state_key] = None
+    st.session_state.regenerate = state_key
+
+# Check (once) whether the result being generated should bypass the cache
+def consume_regeneration(state_key):
+    if st.session_state.get("regenerate") == state_key:
+        st.session_state.regenerate = None
+        return True
+    return False
+
+# The project's progress in the format of AnalysisProject.to_state, with datasets by reference
+def project_state():
+    return {
+        "name": st.session_state.project_name,
+        "problem_statement": st.session_state.problem_statement,
+        "data_context": st.session_state.data_context,
+        "dataset_keys": st.session_state.dataframes.dataset_keys(),
+        "manager_plan": st.session_state.manager_plan,
+        "analyst_summary": st.session_state.analyst_summary,
+        "associate_guidance": st.session_state.associate_guidance,
+        "analysis_results": st.session_state.analysis_results,
+        "final_report": st.session_state.final_report,
+        "conversation_history": list(st.session_state.conversation_history),
+        "current_step": st.session_state.current_step
+    }
+
+# What a checkpoint depends on, cheap enough to check on every rerun: the
+# generated texts are the stored objects themselves (compared by identity
+# first), and results and messages are only ever appended, so they are counted
+def checkpoint_version():
+    return (st.session_state.project_id, st.session_state.current_step, st.session_state.manager_plan,
+            st.session_state.analyst_summary, st.session_state.associate_guidance, st.session_state.final_report,
+            len(st.session_state.analysis_results), len(st.session_state.conversation_history),
+            tuple(sorted(st.session_state.dataframes.dataset_keys().items())))
+
+# Save a checkpoint of the project when its step or an artifact changed since the last save
+def save_checkpoint():
+    if not (st.session_state.project_initialized and st.session_state.get("project_id")):
+        return
+    version = checkpoint_version()
+    if st.session_state.get("checkpoint_version") == version:
+        return
+    get_checkpoint_store().save(st.session_state.project_id, project_state(), step=st.session_state.current_step,
+                                owner=current_owner())
+    st.session_state.checkpoint_version = version
+
+# Reopen a saved project without any LLM calls, returning an error message if it cannot be restored
+def resume_project(project_id):
+    from src.dataset_registry import SessionDatasets
+    
+    state = get_checkpoint_store().load(project_id, owner=current_owner())
+    if state is None:
+        return "The saved project could not be found."
+    
+    # The datasets are memory-mapped from the dataset cache by their content hash
+    dataframes = SessionDatasets()
+    data_profiles = {}
+    for name, key in state.get("dataset_keys", {}).items():
+        df, profile = dataframes.acquire(name, key) if key else (None, None)
+        if df is None:
+            dataframes.release()
+            return f"The data of {name} is no longer cached; please start a new project and upload it again."
+        data_profiles[name] = profile
+    
+    reset_session()
+    st.session_state.dataframes = dataframes
+    st.session_state.data_profiles = data_profiles
+    for key in ("manager_plan", "analyst_summary", "associate_guidance", "final_report"):
+        st.session_state[key] = state.get(key)
+    st.session_state.analysis_results = state.get("analysis_results", [])
+    for message in state.get("conversation_history", []):
+        add_to_conversation(message["role"], message["content"])
+    st.session_state.project_name = state["name"]
+    st.session_state.problem_statement = state["problem_statement"]
+    st.session_state.data_context = state.get("data_context", "")
+    st.session_state.current_step = state.get("current_step", 1)
+    st.session_state.data_uploaded = True
+    st.session_state.project_initialized = True
+    st.session_state.project_id = project_id
+    st.session_state.own_projects.add(project_id)
+    st.query_params["project"] = project_id
+    # The restored project is its own checkpoint
+    st.session_state.checkpoint_version = checkpoint_version()
+    return None
+
+# Get the context shared by the prompts after the data summary
+def project_context():
+    from src.prompts import build_project_context
+    
+    return build_project_context(st.session_state.problem_statement, st.session_state.data_profiles,
+                                 st.session_state.manager_plan, st.session_state.analyst_summary)
+
+# Start generating the upcoming steps in the background as soon as their inputs exist
+def prefetch_next_steps():
+    from src.prefetch import Prefetcher
+    from src.prompts import build_analyst_prompt, build_associate_prompt, build_project_context
+    from src.stats import STATS_SUMMARY_ITEMS, describe_dataset_statistics
+    
+    if st.session_state.associate_guidance is not None or not st.session_state.manager_plan:
+        return
+    if 'prefetcher' not in st.session_state:
+        st.session_state.prefetcher = Prefetcher()
+    prefetcher = st.session_state.prefetcher
+    problem_statement = st.session_state.problem_statement
+    manager_plan = st.session_state.manager_plan
+    data_profiles = st.session_state.data_profiles
+    
+    # Runs in a background thread, so it only uses the values captured above
+    def prefetch_guidance(analyst_summary):
+        context = build_project_context(problem_statement, data_profiles, manager_plan, analyst_summary)
+        associate_prompt, _ = build_associate_prompt(problem_statement, manager_plan, analyst_summary,
+                                                     context=context)
+        prefetcher.schedule("guidance", associate_prompt, persona="associate")
+    
+    if st.session_state.analyst_summary:
+        prefetch_guidance(st.session_state.analyst_summary)
+    else:
+        statistics = describe_dataset_statistics(st.session_state.dataframes, st.session_state.data_profiles,
+                                                 limit=STATS_SUMMARY_ITEMS)
+        analyst_prompt, _ = build_analyst_prompt(problem_statement, manager_plan, st.session_state.data_profiles,
+                                                 statistics=statistics)
+        prefetcher.schedule("summary", analyst_prompt, persona="analyst", then=prefetch_guidance)
+
+# Render a response progressively while it is generated and return the full text
+def stream_gemini_response(prompt, persona, keep=False, **kwargs):
+    from src.utils import StreamInterruptedError, get_gemini_response
+    
+    placeholder = st.empty()
+    try:
+        with placeholder.container():
+            text = st.write_stream(get_gemini_response(prompt, persona=persona, stream=True, **kwargs))
+    except StreamInterruptedError as e:
+        # A partial answer is neither displayed nor stored; the error shown with it is
+        # cleared together with the preview, so it is shown again outside of it
+        placeholder.empty()
+        st.error(f"Error generating response: {e.__cause__ or e}")
+        return None
+    # Unless asked to keep it, clear the streamed preview so the step renders the stored text as usual
+    if not keep:
+        placeholder.empty()
+    return text if isinstance(text, str) and text else None
+
+# Run the code from an Analyst response on the full data and have the Analyst interpret the output
+def execute_analysis_response(task, analysis_response, file_name):
+    from src.pipeline import execute_analysis_task
+    
+    return execute_analysis_task(st.session_state.problem_statement, task, analysis_response,
+                                 st.session_state.dataframes, st.session_state.data_profiles, file_name,
+                                 generate=stream_gemini_response, context=project_context())
+
+# Run several analysis tasks at the same time, adding each result as soon as it is ready
+def run_analysis_tasks_concurrently(tasks):
+    import asyncio
+    from src.pipeline import run_analysis_tasks
+    
+    previous_tasks = [r['task'] for r in st.session_state.analysis_results]
+    status = st.status(f"AI Analyst is executing {len(tasks)} tasks at once...", expanded=True)
+    
+    # Called on this thread as each task finishes, so it can update the page
+    def add_result(task, entry, error):
+        if error is not None:
+            status.write(f"❌ {task}")
+            st.error(f"Error executing \"{task}\": {str(error)}")
+            return
+        st.session_state.analysis_results.append(entry)
+        add_to_conversation("analyst", f"Task: {task}\n\n{entry['result']}")
+        status.write(f"✅ {task}")
+    
+    with stage_timer("execution", tasks=len(tasks)):
+        entries = asyncio.run(run_analysis_tasks(st.session_state.problem_statement, tasks,
+                                                 st.session_state.dataframes, st.session_state.data_profiles,
+                                                 previous_tasks=previous_tasks, on_result=add_result,
+                                                 context=project_context()))
+    status.update(label=f"Completed {len(entries)} of {len(tasks)} analysis tasks",
+                  state="complete" if len(entries) == len(tasks) else "error", expanded=False)
+    return entries
+
+# Show the tables, values and figures captured when analysis code was executed
+def show_execution_output(execution):
+    import pandas as pd
+    
+    if execution["error"]:
+        st.warning(f"Code execution failed:\n\n{execution['error']}")
+    if execution["stdout"].strip():
+        st.code(execution["stdout"], language="text")
+    if execution["scalars"]:
+        st.json(execution["scalars"])
+    for table in execution["tables"]:
+        st.caption(f"{table['name']} ({table['shape'][0]} × {table['shape'][1]})")
+        st.dataframe(pd.DataFrame(table["data"], columns=table["columns"], index=table["index"]))
+    for figure in execution["figures"]:
+        st.image(base64.b64decode(figure))
+
+# Show timing, token and cache metrics for profiling a session
+def show_diagnostics():
+    summary = get_metrics().summary()
+    llm = summary["llm"]
+    cache_stats = get_cache_stats()
+    cache_hits = cache_stats["memory_hits"] + cache_stats["disk_hits"]
+    
+    with st.expander("Diagnostics"):
+        st.markdown("**LLM calls**")
+        st.write(f"{llm['calls']} calls ({llm['cached']} cached, {llm['coalesced']} coalesced, {llm['errors']} errors, {llm['retries']} retries)")
+        if llm["latency_p50"] is not None:
+            st.write(f"Latency: p50 {llm['latency_p50']:.2f}s, p95 {llm['latency_p95']:.2f}s")
+        st.write(f"Tokens: {llm['prompt_tokens']} prompt, {llm['output_tokens']} output")
+        st.write(f"Response cache: {cache_hits} hits, {cache_stats['misses']} misses, "
+                 f"~{cache_stats['saved_seconds']:.0f}s saved")
+        
+        from src.context_cache import get_context_cache
+        context_stats = get_context_cache().stats()
+        if context_stats["contexts"] or llm["context_tokens"]:
+            st.write(f"Context cache: {context_stats['contexts']} project contexts cached "
+                     f"({context_stats['tokens']} tokens), {context_stats['hits']} reuses, "
+                     f"{llm['context_tokens']} prompt tokens read from cache")
+        
+        prefetch_status = st.session_state.prefetcher.status() if 'prefetcher' in st.session_state else {}
+        if prefetch_status:
+            st.markdown("**Background prefetch**")
+            st.write(", ".join(f"{name}: {state}" for name, state in prefetch_status.items()))
+        
+        if st.session_state.data_uploaded:
+            from src.dataset_registry import get_dataset_registry
+            registry = get_dataset_registry().stats()
+            st.markdown("**Shared datasets**")
+            st.write(f"{registry['datasets']} datasets ({registry['mapped']} memory-mapped, {registry['idle']} idle), "
+                     f"{registry['references']} session references, "
+                     f"{registry['heap_bytes'] / 1024 ** 2:.1f} MB in memory")
+        
+        if summary["startup"]:
+            startup = summary["startup"]
+            st.write(f"Startup: {startup['import_seconds']:.2f}s imports, "
+                     f"{startup['render_seconds']:.2f}s to first render")
+        
+        if summary["stages"]:
+            import pandas as pd
+            st.markdown("**Stages**")
+            st.dataframe(pd.DataFrame.from_dict(summary["stages"], orient="index"))
+        st.caption(f"All events are logged to {get_metrics().log_path}")
 
 # Main application
 def main():
+    # A refreshed page reopens the project named in its URL
+    if not st.session_state.project_initialized and "project" in st.query_params:
+        error = resume_project(st.query_params["project"])
+        if error:
+            st.warning(error)
+            del st.query_params["project"]
+    
     # Sidebar
     with st.sidebar:
         st.title("AI Data Analysis Assistant")
@@ -85,18 +375,48 @@ def main():
             if st.button("Reset Project"):
                 reset_session()
                 st.experimental_rerun()
+            
+            # Files that could not be cached are analyzed from their first rows only
+            for file_name, profile in st.session_state.data_profiles.items():
+                if profile.get("preview_rows") is not None:
+                    st.warning(f"{file_name} could not be stored in the dataset cache, so only its first "
+                               f"{profile['preview_rows']} of {profile['shape'][0]} rows are loaded. "
+                               f"Statistics, analyses and samples use those rows only.")
         
         st.markdown("---")
         st.markdown("### AI Team")
         st.markdown("🧠 **Manager**: Creates analysis plan")
         st.markdown("📊 **Analyst**: Examines data details")
         st.markdown("🔍 **Associate**: Guides analysis execution")
+
     
     # Main content area
     if not st.session_state.project_initialized:
         # Step 1: Project Setup
         st.title("🚀 Start a New Data Analysis Project")
         
+        # Saved projects reopen with their data and every answer, without LLM calls
+        # Only the signed-in user's projects, or anonymously the ones opened in this session
+        saved_projects = get_checkpoint_store().list(owner=current_owner(),
+                                                     project_ids=st.session_state.own_projects)
+        if saved_projects:
+            with st.expander("Resume a saved project"):
+                labels = {meta["project_id"]: f"{meta['name']} (step {(meta['step'] or 0) + 1}, "
+                                              f"{', '.join(meta['files'])}, saved "
+                                              f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(meta['updated']))})"
+                          for meta in saved_projects}
+                chosen_project = st.selectbox("Saved projects", list(labels), format_func=labels.get)
+                resume_column, delete_column = st.columns(2)
+                if resume_column.button("Resume Project"):
+                    error = resume_project(chosen_project)
+                    if error:
+                        st.error(error)
+                    else:
+                        st.experimental_rerun()
+                if delete_column.button("Delete Saved Project"):
+                    get_checkpoint_store().delete(chosen_project)
+                    st.experimental_rerun()
+        
         with st.form("project_setup_form"):
             st.subheader("Project Details")
             project_name = st.text_input("Project Name")
@@ -114,12 +434,29 @@ def main():
                 if not project_name or not problem_statement or not uploaded_files:
                     st.error("Please provide a project name, problem statement, and at least one CSV file.")
                 else:
+                    from src.utils import process_csv_files
+                    from src.dataset_registry import SessionDatasets
+                    
                     # Process uploaded files
-                    with st.spinner("Processing data files..."):
+                    with st.spinner("Processing data files..."), stage_timer("ingest"):
+                        progress = st.progress(0.0)
+                        
+                        def report_progress(file_name, done, total, error):
+                            status = "failed" if error else "processed"
+                            progress.progress(done / total, text=f"{file_name} {status} ({done}/{total})")
+                        
+                        results, errors = process_csv_files(uploaded_files, progress_callback=report_progress)
+                        for file_name, error in errors.items():
+                            st.error(f"Error processing {file_name}: {error}")
+                        
+                        # Keep the upload order; the frames are shared with other sessions
+                        # that loaded the same files
+                        release_datasets()
+                        st.session_state.dataframes = SessionDatasets()
                         for uploaded_file in uploaded_files:
-                            df, profile = process_csv_file(uploaded_file)
-                            if df is not None:
-                                st.session_state.dataframes[uploaded_file.name] = df
+                            if uploaded_file.name in results:
+                                df, profile = st.session_state.dataframes.add(uploaded_file.name,
+                                                                              *results[uploaded_file.name])
                                 st.session_state.data_profiles[uploaded_file.name] = profile
                         
                         if st.session_state.dataframes:
@@ -135,9 +472,28 @@ def main():
                             st.session_state.problem_statement = problem_statement
                             st.session_state.data_context = data_context
                             
+                            # Saved after every step, and reopened from the URL after a page refresh
+                            st.session_state.project_id = new_project_id()
+                            st.session_state.own_projects.add(st.session_state.project_id)
+                            st.query_params["project"] = st.session_state.project_id
+                            
                             st.success("Project initialized successfully!")
                             st.experimental_rerun()
     else:
+        # The workflow steps need pandas and the LLM modules
+        import pandas as pd
+        from src.utils import set_error_handler
+        from src.prompts import (build_analyst_prompt, build_associate_prompt, build_feedback_prompt,
+                                 build_manager_prompt, build_question_prompt, build_report_prompt,
+                                 build_review_prompt)
+        from src.pipeline import parse_analysis_tasks, prepare_task_prompt
+        from src.report import REPORT_EMBED_CHARTS, render_report_html, report_file_name, report_figures
+        from src.sketches import describe_join_graph, get_join_graph
+        from src.stats import STATS_SUMMARY_ITEMS, describe_dataset_statistics
+        
+        # Show errors from the helper modules on the page
+        set_error_handler(st.error)
+        
         # Display the current step based on navigation
         if st.session_state.current_step == 0:
             # Project Setup (already completed)
@@ -161,29 +517,15 @@ def main():
             st.title("👨‍💼 AI Manager - Analysis Planning")
             
             if st.session_state.manager_plan is None:
-                with st.spinner("AI Manager is creating an analysis plan..."):
+                with st.spinner("AI Manager is creating an analysis plan..."), stage_timer("plan"):
                     # Prepare the prompt for the Manager
-                    file_info = ""
-                    for file_name, profile in st.session_state.data_profiles.items():
-                        file_info += f"\nFile: {file_name}\n"
-                        file_info += f"- Columns: {', '.join(profile['columns'])}\n"
-                        file_info += f"- Dimensions: {profile['shape'][0]} rows × {profile['shape'][1]} columns\n"
-                    
-                    manager_prompt = f"""
-                    Problem Statement: {st.session_state.problem_statement}
-                    
-                    Data Context: {st.session_state.data_context}
-                    
-                    Available Data Files: {file_info}
-                    
-                    Based on this information, create a structured, step-by-step analytical plan. 
-                    The plan should cover data understanding, cleaning (if likely needed), 
-                    exploratory analysis, specific analyses relevant to the goal, and final synthesis. 
-                    Output this plan as a numbered list.
-                    """
+                    manager_prompt, _ = build_manager_prompt(st.session_state.problem_statement,
+                                                             st.session_state.data_context,
+                                                             st.session_state.data_profiles)
                     
                     # Get response from Gemini API
-                    manager_response = get_gemini_response(manager_prompt, persona="manager")
+                    manager_response = stream_gemini_response(manager_prompt, persona="manager",
+                                                              bypass_cache=consume_regeneration("manager_plan"))
                     
                     if manager_response:
                         st.session_state.manager_plan = manager_response
@@ -192,6 +534,7 @@ def main():
             if st.session_state.manager_plan:
                 st.markdown("### Analysis Plan")
                 st.markdown(st.session_state.manager_plan)
+                prefetch_next_steps()
                 
                 # Allow user to provide feedback
                 with st.expander("Provide feedback to the Manager"):
@@ -201,25 +544,24 @@ def main():
                             add_to_conversation("user", f"Feedback on plan: {manager_feedback}")
                             
                             # Process the feedback with Gemini
-                            feedback_prompt = f"""
-                            Original Analysis Plan: 
-                            {st.session_state.manager_plan}
-                            
-                            User Feedback: 
-                            {manager_feedback}
-                            
-                            Please revise the analysis plan based on this feedback. 
-                            Keep the same structured format with numbered steps.
-                            """
+                            feedback_prompt, _ = build_feedback_prompt("plan", st.session_state.manager_plan,
+                                                                       manager_feedback)
                             
-                            with st.spinner("AI Manager is revising the plan..."):
-                                revised_plan = get_gemini_response(feedback_prompt, persona="manager")
+                            # The prefetched summary and guidance were based on the old plan
+                            invalidate_prefetch()
+                            with st.spinner("AI Manager is revising the plan..."), stage_timer("plan"):
+                                revised_plan = stream_gemini_response(feedback_prompt, persona="manager")
                                 if revised_plan:
                                     st.session_state.manager_plan = revised_plan
                                     add_to_conversation("manager", revised_plan)
                                     st.success("Plan updated based on your feedback!")
                                     st.experimental_rerun()
                 
+                if st.button("Regenerate Plan"):
+                    request_regeneration("manager_plan")
+                    invalidate_prefetch()
+                    st.experimental_rerun()
+                
                 if st.button("Continue to Data Understanding"):
                     st.session_state.current_step = 2
                     st.experimental_rerun()
@@ -229,31 +571,18 @@ def main():
             st.title("📊 AI Analyst - Data Understanding")
             
             if st.session_state.analyst_summary is None:
-                with st.spinner("AI Analyst is examining the data..."):
-                    # Generate data profile summaries
-                    all_profiles_summary = ""
-                    for file_name, profile in st.session_state.data_profiles.items():
-                        profile_summary = generate_data_profile_summary(profile)
-                        all_profiles_summary += f"\n## {file_name}\n{profile_summary}\n"
-                    
+                with st.spinner("AI Analyst is examining the data..."), stage_timer("summary"):
                     # Prepare the prompt for the Analyst
-                    analyst_prompt = f"""
-                    Problem Statement: {st.session_state.problem_statement}
-                    
-                    Manager's Analysis Plan: 
-                    {st.session_state.manager_plan}
-                    
-                    Data Profile Summary:
-                    {all_profiles_summary}
-                    
-                    Based on this information, provide a comprehensive summary of the data. 
-                    Explain the key characteristics, potential challenges, and initial observations 
-                    that might be relevant to the analysis plan. Focus on data quality, completeness, 
-                    and how well it aligns with the problem statement.
-                    """
+                    statistics = describe_dataset_statistics(st.session_state.dataframes,
+                                                             st.session_state.data_profiles,
+                                                             limit=STATS_SUMMARY_ITEMS)
+                    analyst_prompt, _ = build_analyst_prompt(st.session_state.problem_statement,
+                                                             st.session_state.manager_plan,
+                                                             st.session_state.data_profiles,
+                                                             statistics=statistics)
                     
                     # Get response from Gemini API
-                    analyst_response = get_gemini_response(analyst_prompt, persona="analyst")
+                    analyst_response = stream_gemini_response(analyst_prompt, persona="analyst")
                     
                     if analyst_response:
                         st.session_state.analyst_summary = analyst_response
@@ -278,37 +607,30 @@ def main():
                 # Display analyst summary
                 st.markdown("### Data Summary")
                 st.markdown(st.session_state.analyst_summary)
+                prefetch_next_steps()
                 
                 # Allow user to ask questions
                 with st.expander("Ask the Analyst about the data"):
                     analyst_question = st.text_area("Your question:", key="analyst_question")
                     if st.button("Ask Question"):
                         if analyst_question:
+                            # Process the question with Gemini, with the relevant parts of the
+                            # conversation before the question itself is added to it
+                            question_prompt, _ = build_question_prompt(st.session_state.problem_statement,
+                                                                       st.session_state.data_profiles,
+                                                                       st.session_state.analyst_summary,
+                                                                       analyst_question,
+                                                                       conversation=st.session_state.conversation_history,
+                                                                       index=st.session_state.context_index,
+                                                                       context=project_context())
                             add_to_conversation("user", f"Question about data: {analyst_question}")
                             
-                            # Process the question with Gemini
-                            question_prompt = f"""
-                            Problem Statement: {st.session_state.problem_statement}
-                            
-                            Data Profile Summary:
-                            {all_profiles_summary}
-                            
-                            Previous Analysis:
-                            {st.session_state.analyst_summary}
-                            
-                            User Question: 
-                            {analyst_question}
-                            
-                            Please provide a detailed answer to the user's question about the data.
-                            """
-                            
-                            with st.spinner("AI Analyst is thinking..."):
-                                analyst_answer = get_gemini_response(question_prompt, persona="analyst")
+                            with st.spinner("AI Analyst is thinking..."), stage_timer("question"):
+                                st.markdown("### Answer")
+                                analyst_answer = stream_gemini_response(question_prompt, persona="analyst", keep=True)
                                 if analyst_answer:
                                     add_to_conversation("analyst", analyst_answer)
                                     st.success("Question answered!")
-                                    st.markdown("### Answer")
-                                    st.markdown(analyst_answer)
                 
                 if st.button("Continue to Analysis Guidance"):
                     st.session_state.current_step = 3
@@ -319,28 +641,15 @@ def main():
             st.title("🔍 AI Associate - Hypothesis & Guidance")
             
             if st.session_state.associate_guidance is None:
-                with st.spinner("AI Associate is formulating analysis guidance..."):
+                with st.spinner("AI Associate is formulating analysis guidance..."), stage_timer("guidance"):
                     # Prepare the prompt for the Associate
-                    associate_prompt = f"""
-                    Problem Statement: {st.session_state.problem_statement}
-                    
-                    Manager's Analysis Plan: 
-                    {st.session_state.manager_plan}
-                    
-                    Analyst's Data Summary:
-                    {st.session_state.analyst_summary}
-                    
-                    Based on this information, refine the initial steps of the plan. Define specific 
-                    hypotheses to test, identify potential edge cases or data quality issues to check 
-                    based on the summary, and formulate a clear storyline for the initial exploration. 
-                    
-                    Outline the exact next 2-3 analysis tasks for the Analyst (e.g., 'Calculate correlation 
-                    matrix for numerical columns', 'Generate frequency counts for categorical columns X and Y', 
-                    'Visualize distribution of column Z').
-                    """
+                    associate_prompt, _ = build_associate_prompt(st.session_state.problem_statement,
+                                                                 st.session_state.manager_plan,
+                                                                 st.session_state.analyst_summary,
+                                                                 context=project_context())
                     
                     # Get response from Gemini API
-                    associate_response = get_gemini_response(associate_prompt, persona="associate")
+                    associate_response = stream_gemini_response(associate_prompt, persona="associate")
                     
                     if associate_response:
                         st.session_state.associate_guidance = associate_response
@@ -358,19 +667,11 @@ def main():
                             add_to_conversation("user", f"Feedback on guidance: {associate_feedback}")
                             
                             # Process the feedback with Gemini
-                            feedback_prompt = f"""
-                            Original Analysis Guidance: 
-                            {st.session_state.associate_guidance}
-                            
-                            User Feedback: 
-                            {associate_feedback}
+                            feedback_prompt, _ = build_feedback_prompt("guidance", st.session_state.associate_guidance,
+                                                                       associate_feedback)
                             
-                            Please revise the analysis guidance based on this feedback. 
-                            Keep the same structured format with specific tasks and hypotheses.
-                            """
-                            
-                            with st.spinner("AI Associate is revising the guidance..."):
-                                revised_guidance = get_gemini_response(feedback_prompt, persona="associate")
+                            with st.spinner("AI Associate is revising the guidance..."), stage_timer("guidance"):
+                                revised_guidance = stream_gemini_response(feedback_prompt, persona="associate")
                                 if revised_guidance:
                                     st.session_state.associate_guidance = revised_guidance
                                     add_to_conversation("associate", revised_guidance)
@@ -385,6 +686,27 @@ def main():
             # Step 5: Analysis Execution
             st.title("📈 AI Analyst - Analysis Execution")
             
+            # Likely join keys, found by comparing the column sketches of the files
+            if len(st.session_state.data_profiles) > 1:
+                with st.expander("Relationships between files"):
+                    join_edges = get_join_graph(st.session_state.dataframes, st.session_state.data_profiles)
+                    if join_edges:
+                        st.markdown(describe_join_graph(join_edges))
+                    else:
+                        st.write("No likely join keys were found between the uploaded files.")
+            
+            # The Associate's suggested tasks not run yet, which can all run at the same time
+            done_tasks = {r['task'] for r in st.session_state.analysis_results}
+            suggested_tasks = [task for task in parse_analysis_tasks(st.session_state.associate_guidance)
+                               if task not in done_tasks]
+            if suggested_tasks:
+                st.subheader("Suggested Tasks")
+                for task in suggested_tasks:
+                    st.write(f"- {task}")
+                if st.button(f"Execute All {len(suggested_tasks)} Suggested Tasks"):
+                    if run_analysis_tasks_concurrently(suggested_tasks):
+                        st.experimental_rerun()
+            
             # Extract tasks from associate guidance
             if not st.session_state.analysis_results:
                 # This is a simplified extraction - in a real app, you might want more sophisticated parsing
@@ -405,46 +727,22 @@ def main():
                 
                 if st.button("Execute Task"):
                     if task_to_execute:
-                        with st.spinner("AI Analyst is executing the task..."):
-                            # Prepare data snippet for the task
-                            # For simplicity, we'll just use the first dataframe
-                            file_name = list(st.session_state.dataframes.keys())[0]
-                            df = st.session_state.dataframes[file_name]
-                            
-                            # Convert a small sample to JSON for the prompt
-                            data_sample = df.head(5).to_json(orient="records")
-                            
+                        with st.spinner("AI Analyst is executing the task..."), stage_timer("execution"):
                             # Prepare the prompt for the Analyst
-                            task_prompt = f"""
-                            Problem Statement: {st.session_state.problem_statement}
-                            
-                            Analysis Task: {task_to_execute}
-                            
-                            Data Sample (first 5 rows from {file_name}): 
-                            {data_sample}
-                            
-                            Available Columns: {', '.join(df.columns)}
-                            
-                            Please execute this analysis task. Provide:
-                            1. A clear explanation of the approach
-                            2. The Python code you would use (using pandas)
-                            3. The results of the analysis
-                            4. Key insights derived from the results
-                            
-                            If the task requires visualization, describe what the visualization would show.
-                            """
+                            task_prompt, file_name = prepare_task_prompt(st.session_state.problem_statement,
+                                                                         task_to_execute,
+                                                                         st.session_state.dataframes,
+                                                                         st.session_state.data_profiles,
+                                                                         context=project_context())
                             
                             # Get response from Gemini API
-                            analysis_result = get_gemini_response(task_prompt, persona="analyst")
+                            analysis_result = stream_gemini_response(task_prompt, persona="analyst")
                             
                             if analysis_result:
-                                # Store the result
-                                result_entry = {
-                                    "task": task_to_execute,
-                                    "result": analysis_result
-                                }
+                                # Run the code on the full data and store the result
+                                result_entry = execute_analysis_response(task_to_execute, analysis_result, file_name)
                                 st.session_state.analysis_results.append(result_entry)
-                                add_to_conversation("analyst", f"Task: {task_to_execute}\n\n{analysis_result}")
+                                add_to_conversation("analyst", f"Task: {task_to_execute}\n\n{result_entry['result']}")
                                 
                                 st.success("Analysis task completed!")
                                 st.experimental_rerun()
@@ -456,6 +754,8 @@ def main():
                 for i, result in enumerate(st.session_state.analysis_results):
                     with st.expander(f"Analysis {i+1}: {result['task']}", expanded=(i == len(st.session_state.analysis_results)-1)):
                         st.markdown(result['result'])
+                        if result.get('execution'):
+                            show_execution_output(result['execution'])
                 
                 # Option to execute another task
                 st.markdown("---")
@@ -466,45 +766,24 @@ def main():
                 
                 if st.button("Execute New Task"):
                     if new_task:
-                        with st.spinner("AI Analyst is executing the task..."):
-                            # Similar to above, prepare data and prompt
-                            file_name = list(st.session_state.dataframes.keys())[0]
-                            df = st.session_state.dataframes[file_name]
-                            data_sample = df.head(5).to_json(orient="records")
-                            
-                            task_prompt = f"""
-                            Problem Statement: {st.session_state.problem_statement}
-                            
-                            Previous Analysis Results:
-                            {json.dumps([r['task'] for r in st.session_state.analysis_results])}
-                            
-                            New Analysis Task: {new_task}
-                            
-                            Data Sample (first 5 rows from {file_name}): 
-                            {data_sample}
-                            
-                            Available Columns: {', '.join(df.columns)}
-                            
-                            Please execute this analysis task. Provide:
-                            1. A clear explanation of the approach
-                            2. The Python code you would use (using pandas)
-                            3. The results of the analysis
-                            4. Key insights derived from the results
-                            
-                            If the task requires visualization, describe what the visualization would show.
-                            """
+                        with st.spinner("AI Analyst is executing the task..."), stage_timer("execution"):
+                            # Similar to above, with the earlier tasks as context
+                            previous_tasks = [r['task'] for r in st.session_state.analysis_results]
+                            task_prompt, file_name = prepare_task_prompt(st.session_state.problem_statement,
+                                                                         new_task,
+                                                                         st.session_state.dataframes,
+                                                                         st.session_state.data_profiles,
+                                                                         previous_tasks=previous_tasks,
+                                                                         context=project_context())
                             
                             # Get response from Gemini API
-                            analysis_result = get_gemini_response(task_prompt, persona="analyst")
+                            analysis_result = stream_gemini_response(task_prompt, persona="analyst")
                             
                             if analysis_result:
-                                # Store the result
-                                result_entry = {
-                                    "task": new_task,
-                                    "result": analysis_result
-                                }
+                                # Run the code on the full data and store the result
+                                result_entry = execute_analysis_response(new_task, analysis_result, file_name)
                                 st.session_state.analysis_results.append(result_entry)
-                                add_to_conversation("analyst", f"Task: {new_task}\n\n{analysis_result}")
+                                add_to_conversation("analyst", f"Task: {new_task}\n\n{result_entry['result']}")
                                 
                                 st.success("Analysis task completed!")
                                 st.experimental_rerun()
@@ -515,41 +794,20 @@ def main():
                     st.subheader("AI Associate Review")
                     
                     if st.button("Get Associate's Review of Results"):
-                        with st.spinner("AI Associate is reviewing the results..."):
+                        with st.spinner("AI Associate is reviewing the results..."), stage_timer("review"):
                             # Prepare the prompt for the Associate
-                            results_summary = ""
-                            for i, result in enumerate(st.session_state.analysis_results):
-                                results_summary += f"\nAnalysis {i+1}: {result['task']}\n"
-                                # Truncate very long results
-                                if len(result['result']) > 1000:
-                                    results_summary += result['result'][:1000] + "...\n"
-                                else:
-                                    results_summary += result['result'] + "\n"
-                            
-                            review_prompt = f"""
-                            Problem Statement: {st.session_state.problem_statement}
-                            
-                            Original Analysis Guidance:
-                            {st.session_state.associate_guidance}
-                            
-                            Analysis Results:
-                            {results_summary}
-                            
-                            Please review these analysis results. Provide:
-                            1. An assessment of how well the analyses address the problem statement
-                            2. Key insights derived from the combined results
-                            3. Recommendations for next steps or additional analyses
-                            4. Any potential issues or limitations in the current analyses
-                            """
+                            review_prompt, _ = build_review_prompt(st.session_state.problem_statement,
+                                                                   st.session_state.associate_guidance,
+                                                                   st.session_state.analysis_results,
+                                                                   index=st.session_state.context_index,
+                                                                   context=project_context())
                             
                             # Get response from Gemini API
-                            associate_review = get_gemini_response(review_prompt, persona="associate")
+                            with st.expander("Associate's Review", expanded=True):
+                                associate_review = stream_gemini_response(review_prompt, persona="associate", keep=True)
                             
                             if associate_review:
                                 add_to_conversation("associate", associate_review)
-                                
-                                with st.expander("Associate's Review", expanded=True):
-                                    st.markdown(associate_review)
                 
                 if st.button("Generate Final Report"):
                     st.session_state.current_step = 5
@@ -560,45 +818,19 @@ def main():
             st.title("📑 AI Manager - Final Report")
             
             if st.session_state.final_report is None:
-                with st.spinner("AI Manager is generating the final report..."):
+                with st.spinner("AI Manager is generating the final report..."), stage_timer("report"):
                     # Prepare the prompt for the Manager
-                    results_summary = ""
-                    for i, result in enumerate(st.session_state.analysis_results):
-                        results_summary += f"\nAnalysis {i+1}: {result['task']}\n"
-                        # Truncate very long results
-                        if len(result['result']) > 500:
-                            results_summary += result['result'][:500] + "...\n"
-                        else:
-                            results_summary += result['result'] + "\n"
-                    
-                    report_prompt = f"""
-                    Project Name: {st.session_state.project_name}
-                    
-                    Problem Statement: {st.session_state.problem_statement}
-                    
-                    Original Analysis Plan:
-                    {st.session_state.manager_plan}
-                    
-                    Data Summary:
-                    {st.session_state.analyst_summary}
-                    
-                    Analysis Results:
-                    {results_summary}
-                    
-                    Synthesize this information into a coherent final report for a business audience. 
-                    The report should be structured with:
-                    1. Executive Summary
-                    2. Key Findings/Takeaways (bullet points)
-                    3. Overview of Analysis Performed
-                    4. Detailed Findings (referencing specific analyses)
-                    5. Limitations (if any observed)
-                    6. Recommendations/Next Steps (if applicable based on findings)
-                    
-                    Format the output in Markdown suitable for direct rendering in HTML.
-                    """
+                    report_prompt, _ = build_report_prompt(st.session_state.project_name,
+                                                           st.session_state.problem_statement,
+                                                           st.session_state.manager_plan,
+                                                           st.session_state.analyst_summary,
+                                                           st.session_state.analysis_results,
+                                                           index=st.session_state.context_index,
+                                                           context=project_context())
                     
                     # Get response from Gemini API
-                    final_report = get_gemini_response(report_prompt, persona="manager")
+                    final_report = stream_gemini_response(report_prompt, persona="manager",
+                                                          bypass_cache=consume_regeneration("final_report"))
                     
                     if final_report:
                         st.session_state.final_report = final_report
@@ -615,71 +847,44 @@ def main():
                             add_to_conversation("user", f"Feedback on report: {report_feedback}")
                             
                             # Process the feedback with Gemini
-                            feedback_prompt = f"""
-                            Original Report: 
-                            {st.session_state.final_report}
-                            
-                            User Feedback: 
-                            {report_feedback}
+                            feedback_prompt, _ = build_feedback_prompt("report", st.session_state.final_report,
+                                                                       report_feedback)
                             
-                            Please revise the report based on this feedback. 
-                            Keep the same structured format with all the required sections.
-                            """
-                            
-                            with st.spinner("AI Manager is revising the report..."):
-                                revised_report = get_gemini_response(feedback_prompt, persona="manager")
+                            with st.spinner("AI Manager is revising the report..."), stage_timer("report"):
+                                revised_report = stream_gemini_response(feedback_prompt, persona="manager")
                                 if revised_report:
                                     st.session_state.final_report = revised_report
                                     add_to_conversation("manager", revised_report)
                                     st.success("Report updated based on your feedback!")
                                     st.experimental_rerun()
                 
-                # Download report as HTML
-                if st.button("Download Report as HTML"):
-                    # Convert markdown to HTML
-                    import markdown
-                    html_content = markdown.markdown(st.session_state.final_report)
-                    
-                    # Create a styled HTML document
-                    styled_html = f"""
-                    <!DOCTYPE html>
-                    <html>
-                    <head>
-                        <title>{st.session_state.project_name} - Analysis Report</title>
-                        <style>
-                            body {{ font-family: Arial, sans-serif; line-height: 1.6; max-width: 800px; margin: 0 auto; padding: 20px; }}
-                            h1 {{ color: #2c3e50; }}
-                            h2 {{ color: #3498db; border-bottom: 1px solid #eee; padding-bottom: 5px; }}
-                            h3 {{ color: #2980b9; }}
-                            li {{ margin-bottom: 5px; }}
-                            .footer {{ margin-top: 30px; border-top: 1px solid #eee; padding-top: 10px; font-size: 0.8em; color: #7f8c8d; }}
-                        </style>
-                    </head>
-                    <body>
-                        <h1>{st.session_state.project_name} - Analysis Report</h1>
-                        {html_content}
-                        <div class="footer">
-                            <p>Generated by AI Data Analysis Assistant</p>
-                        </div>
-                    </body>
-                    </html>
-                    """
-                    
-                    # Save the HTML file
-                    report_path = os.path.join(os.getcwd(), "report.html")
-                    with open(report_path, "w") as f:
-                        f.write(styled_html)
-                    
-                    # Provide download link
-                    st.success(f"Report saved as {report_path}")
-                    
-                    # In a real deployment, you would provide a download link here
-                    st.markdown(f"Report is ready for download at: `{report_path}`")
+                if st.button("Regenerate Report"):
+                    request_regeneration("final_report")
+                    st.experimental_rerun()
+                
+                # Download report as HTML, rendered in memory and cached per report
+                figures = report_figures(st.session_state.analysis_results)
+                include_charts = bool(figures) and st.checkbox("Include charts from the analyses",
+                                                               value=REPORT_EMBED_CHARTS)
+                styled_html = render_report_html(st.session_state.project_name, st.session_state.final_report,
+                                                 figures if include_charts else None)
+                st.download_button("Download Report as HTML", styled_html.encode("utf-8"),
+                                   file_name=report_file_name(st.session_state.project_name), mime="text/html")
     
     # Display conversation history in a sidebar expander
     with st.sidebar:
         with st.expander("Conversation History"):
-            for message in st.session_state.conversation_history:
+            # Only one page of messages is read and rendered per run, newest first
+            history = st.session_state.conversation_history
+            page_count = history.page_count()
+            page = 1
+            if page_count > 1:
+                if st.session_state.history_page > page_count:
+                    st.session_state.history_page = page_count
+                page = st.number_input("Page", min_value=1, max_value=page_count, key="history_page")
+                st.caption(f"Page {page} of {page_count} ({len(history)} messages, newest first)")
+            
+            for _, message in history.page(page, HISTORY_PAGE_SIZE):
                 role = message["role"]
                 content = message["content"]
                 
@@ -693,6 +898,11 @@ def main():
                     st.markdown(f"**AI Associate:** {content[:100]}...")
                 
                 st.markdown("---")
+        
+        show_diagnostics()
+    
+    save_checkpoint()
 
 if __name__ == "__main__":
     main()
+    record_startup(imports_finished - script_started, time.perf_counter() - script_started)
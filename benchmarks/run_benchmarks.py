@@ -0,0 +1,258 @@
+"""
+Benchmarks for startup imports, ingestion, profiling and prompt assembly
+
+Runs entirely offline: datasets are generated locally and LLM calls go to the
+fake backend. Results are written as JSON so runs from different versions can
+be compared with --baseline.
+
+Usage:
+    python -m benchmarks.run_benchmarks [--quick] [--output FILE] [--baseline FILE]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import tracemalloc
+
+QUICK_CASES = [(10_000, 20), (2_000, 500)]
+FULL_CASES = QUICK_CASES + [(200_000, 20), (20_000, 500), (1_000_000, 8)]
+
+# Function to time a callable and measure its peak traced memory
+def measure(fn, repeat=3):
+    """
+    Time a function and measure the peak memory it allocates
+
+    The timed runs and the memory run are separate, so tracing does not
+    distort the timings.
+
+    Args:
+        fn (callable): The function to measure, called without arguments
+        repeat (int): The number of timed runs
+
+    Returns:
+        dict: seconds_min, seconds_median and peak_mb
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds_min": min(timings), "seconds_median": statistics.median(timings),
+            "peak_mb": peak / (1024 * 1024)}
+
+# Function to describe the environment a run was made in
+def run_metadata():
+    import numpy as np
+    import pandas as pd
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "timestamp": time.time(), "python": platform.python_version(),
+            "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "numpy": np.__version__, "pandas": pd.__version__}
+
+# Function to run every benchmark for one dataset shape
+def run_case(rows, cols, work_dir, repeat, llm_calls):
+    from benchmarks.synthetic import write_csv
+    from src import dataset_store
+    from src.utils import (generate_data_profile_summary, get_gemini_response, load_csv_file,
+                           profile_dataframe)
+    from src.prompt_builder import compact_profile_summary
+    from src.prompts import build_analyst_prompt, build_manager_prompt
+
+    case = f"{rows}x{cols}"
+    path = os.path.join(work_dir, f"{case}.csv")
+    size = write_csv(path, rows, cols)
+    results = []
+
+    def record(name, measurement, **extra):
+        entry = {"benchmark": name, "case": case, "rows": rows, "cols": cols, **measurement, **extra}
+        results.append(entry)
+        print(f"{name:<24} {case:>14} {entry['seconds_median'] * 1000:10.1f} ms {entry['peak_mb']:9.1f} MB")
+
+    # Every cold run gets an empty dataset cache; the other modules find the
+    # cache through dataset_store, so patching it there is enough
+    def ingest(chunked):
+        dataset_store.DATASET_CACHE_DIR = tempfile.mkdtemp(dir=work_dir)
+        with open(path, "rb") as f:
+            return load_csv_file(f, chunked=chunked)
+
+    for name, chunked in (("ingest_cold", False), ("ingest_cold_chunked", True)):
+        measurement = measure(lambda: ingest(chunked), repeat)
+        record(name, measurement, bytes=size, rows_per_second=rows / measurement["seconds_median"],
+               mb_per_second=size / (1024 * 1024) / measurement["seconds_median"])
+
+    # Warm: the dataset is already cached and only memory-mapped
+    df, profile = ingest(False)
+    with open(path, "rb") as f:
+        record("ingest_warm", measure(lambda: (f.seek(0), load_csv_file(f)), repeat))
+
+    import pandas as pd
+    parsed = pd.read_csv(path)
+    record("profile_dataframe", measure(lambda: profile_dataframe(parsed), repeat))
+    record("profile_summary", measure(lambda: generate_data_profile_summary(profile), repeat))
+    record("profile_summary_compact", measure(lambda: compact_profile_summary(profile), repeat))
+
+    profiles = {f"{case}.csv": profile}
+    plan = "\n".join(f"{i}. Step {i}" for i in range(1, 11))
+    prompt, usage = build_analyst_prompt("Find the drivers of the outcome.", plan, profiles)
+    record("build_manager_prompt",
+           measure(lambda: build_manager_prompt("Find the drivers of the outcome.", "", profiles), repeat))
+    record("build_analyst_prompt",
+           measure(lambda: build_analyst_prompt("Find the drivers of the outcome.", plan, profiles), repeat),
+           prompt_tokens=usage["total"], compacted=usage["compacted"])
+
+    def call_llm(bypass_cache):
+        for i in range(llm_calls):
+            get_gemini_response(f"{prompt}\n{i}", persona="analyst", bypass_cache=bypass_cache)
+
+    record("llm_uncached", measure(lambda: call_llm(True), 1), calls=llm_calls)
+    record("llm_cached", measure(lambda: call_llm(False), 1), calls=llm_calls)
+    return results
+
+# Modules the app imports before the setup screen renders, and the ones the
+# workflow steps import once a project exists
+STARTUP_IMPORTS = {
+    "import_setup_screen": (["streamlit"], ["src.settings", "src.response_cache", "src.metrics"]),
+    "import_workflow": (["streamlit", "src.settings", "src.response_cache", "src.metrics"],
+                        ["src.utils", "src.prompts", "src.pipeline", "src.prefetch", "src.report"])
+}
+
+# Imports modules in a fresh interpreter and reports the time (or traced memory) they took
+_IMPORT_PROBE = """
+import sys, json, time, importlib, tracemalloc
+preload, timed, trace = sys.argv[1].split(","), sys.argv[2].split(","), sys.argv[3] == "1"
+for name in filter(None, preload):
+    importlib.import_module(name)
+if trace:
+    tracemalloc.start()
+started = time.perf_counter()
+for name in timed:
+    importlib.import_module(name)
+seconds = time.perf_counter() - started
+peak = tracemalloc.get_traced_memory()[1] if trace else 0
+heavy = [name for name in ("pandas", "numpy", "pyarrow", "google.generativeai") if name in sys.modules]
+print(json.dumps({"seconds": seconds, "peak": peak, "heavy_modules": heavy}))
+"""
+
+# Function to measure the import cost of the app's startup path
+def run_startup(repeat):
+    """
+    Time cold imports of the setup screen and workflow modules
+
+    Every run uses a fresh interpreter, so nothing is already imported.
+
+    Args:
+        repeat (int): The number of timed runs per benchmark
+
+    Returns:
+        list: The benchmark entries
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def probe(preload, timed, trace):
+        output = subprocess.run([sys.executable, "-c", _IMPORT_PROBE, ",".join(preload), ",".join(timed),
+                                 "1" if trace else "0"], cwd=root, capture_output=True, text=True, check=True)
+        return json.loads(output.stdout.strip().splitlines()[-1])
+
+    results = []
+    for name, (preload, timed) in STARTUP_IMPORTS.items():
+        timings = [probe(preload, timed, False) for _ in range(repeat)]
+        traced = probe(preload, timed, True)
+        seconds = [timing["seconds"] for timing in timings]
+        entry = {"benchmark": name, "case": "cold", "rows": 0, "cols": 0, "seconds_min": min(seconds),
+                 "seconds_median": statistics.median(seconds), "peak_mb": traced["peak"] / (1024 * 1024),
+                 "heavy_modules": timings[-1]["heavy_modules"]}
+        results.append(entry)
+        print(f"{name:<24} {'cold':>14} {entry['seconds_median'] * 1000:10.1f} ms {entry['peak_mb']:9.1f} MB "
+              f"(loads: {', '.join(entry['heavy_modules']) or 'none'})")
+    return results
+
+# Increases smaller than these are treated as noise when comparing runs
+MIN_REGRESSION = {"seconds_median": 0.01, "peak_mb": 1.0}
+
+# Function to compare a run against a baseline run
+def compare(results, baseline, tolerance):
+    """
+    Find benchmarks that got slower or used more memory than in a baseline
+
+    Args:
+        results (list): The benchmark entries of this run
+        baseline (list): The benchmark entries of the baseline run
+        tolerance (float): Allowed relative increase, e.g. 0.2 for 20%
+
+    Returns:
+        list: Human-readable descriptions of the regressions
+    """
+    previous = {(entry["benchmark"], entry["case"]): entry for entry in baseline}
+    regressions = []
+    for entry in results:
+        old = previous.get((entry["benchmark"], entry["case"]))
+        if old is None:
+            continue
+        for metric, floor in MIN_REGRESSION.items():
+            if entry[metric] > old[metric] * (1 + tolerance) and entry[metric] - old[metric] > floor:
+                regressions.append(f"{entry['benchmark']} {entry['case']}: {metric} "
+                                   f"{old[metric]:.4g} -> {entry[metric]:.4g}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run offline benchmarks and save the results as JSON")
+    parser.add_argument("--quick", action="store_true", help="Only run the small dataset shapes")
+    parser.add_argument("--output", default=os.path.join("benchmarks", "results", "latest.json"),
+                        help="Where to write the JSON results")
+    parser.add_argument("--baseline", help="A previous results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative slowdown or memory growth against the baseline")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds per fake LLM call")
+    parser.add_argument("--llm-calls", type=int, default=5, help="Fake LLM calls per case")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="benchmarks-") as work_dir:
+        # Configure the fake backend and keep every cache and log in the work
+        # directory before importing src, so a run leaves nothing in .cache
+        os.environ["LLM_BACKEND"] = "fake"
+        os.environ["FAKE_LLM_LATENCY_SECONDS"] = str(args.llm_latency)
+        os.environ["RESPONSE_CACHE_PATH"] = os.path.join(work_dir, "responses.sqlite3")
+        os.environ["DATASET_CACHE_DIR"] = os.path.join(work_dir, "datasets")
+        os.environ["METRICS_LOG_PATH"] = os.path.join(work_dir, "metrics.jsonl")
+        # The fake backend has no quota, so only its simulated latency is measured
+        os.environ["GEMINI_REQUESTS_PER_MINUTE"] = "0"
+
+        results = run_startup(args.repeat)
+        for rows, cols in (QUICK_CASES if args.quick else FULL_CASES):
+            results.extend(run_case(rows, cols, work_dir, args.repeat, args.llm_calls))
+
+    report = {"meta": run_metadata(), "results": results}
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+# Default share of each column type in generated datasets
+DEFAULT_DTYPE_MIX = {"float": 0.5, "int": 0.25, "category": 0.15, "text": 0.1}
+
+# Function to generate a synthetic DataFrame
+def generate_dataframe(rows, cols, dtype_mix=None, missing_rate=0.05, seed=0):
+    """
+    Generate a synthetic dataset with a controlled shape and column mix
+
+    Args:
+        rows (int): The number of rows
+        cols (int): The number of columns
+        dtype_mix (dict): Share of "float", "int", "category" and "text" columns
+            (defaults to DEFAULT_DTYPE_MIX)
+        missing_rate (float): Share of missing values in float, category and text columns
+        seed (int): The random seed
+
+    Returns:
+        DataFrame: The generated data
+    """
+    rng = np.random.default_rng(seed)
+    dtype_mix = dtype_mix or DEFAULT_DTYPE_MIX
+    kinds = list(dtype_mix)
+    weights = np.array([dtype_mix[kind] for kind in kinds], dtype=float)
+    column_kinds = rng.choice(kinds, size=cols, p=weights / weights.sum())
+
+    columns = {}
+    for i, kind in enumerate(column_kinds):
+        name = f"{kind}_{i}"
+        if kind == "float":
+            values = rng.normal(loc=rng.uniform(-100, 100), scale=rng.uniform(1, 50), size=rows)
+        elif kind == "int":
+            values = rng.integers(0, rng.choice([10, 1000, 1_000_000]), size=rows)
+        elif kind == "category":
+            levels = np.array([f"level_{j}" for j in range(rng.integers(2, 20))], dtype=object)
+            values = rng.choice(levels, size=rows)
+        else:
+            values = np.array([f"text_{j}" for j in rng.integers(0, rows * 10, size=rows)], dtype=object)
+
+        if missing_rate and kind != "int":
+            values = values.astype(object) if kind != "float" else values
+            values[rng.random(rows) < missing_rate] = np.nan if kind == "float" else None
+        columns[name] = values
+    return pd.DataFrame(columns)
+
+# Function to write a synthetic CSV file
+def write_csv(path, rows, cols, dtype_mix=None, missing_rate=0.05, seed=0):
+    """
+    Generate a synthetic dataset and save it as CSV
+
+    Args:
+        path (str): The file to write
+        rows (int): The number of rows
+        cols (int): The number of columns
+        dtype_mix (dict): Share of each column type (see generate_dataframe)
+        missing_rate (float): Share of missing values
+        seed (int): The random seed
+
+    Returns:
+        int: The size of the written file in bytes
+    """
+    df = generate_dataframe(rows, cols, dtype_mix=dtype_mix, missing_rate=missing_rate, seed=seed)
+    df.to_csv(path, index=False)
+    with open(path, "rb") as f:
+        f.seek(0, 2)
+        return f.tell()
@@ -0,0 +1,183 @@
+import os
+import re
+import gzip
+import json
+import time
+import secrets
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Where project checkpoints are kept and how long an untouched one is kept
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", os.path.join(".cache", "checkpoints"))
+CHECKPOINT_MAX_AGE_SECONDS = int(os.getenv("CHECKPOINT_MAX_AGE_SECONDS", 30 * 24 * 60 * 60))
+# List every saved project to every visitor; only for single-user installs
+CHECKPOINT_SHARED = os.getenv("CHECKPOINT_SHARED", "false").lower() in ("1", "true", "yes")
+
+# Project ids are random 128-bit hex strings, so knowing one is what grants
+# access to an anonymous project; anything else could also name a path
+# outside the directory
+_PROJECT_ID = re.compile(r"[0-9a-f]{32}")
+
+# Function to generate an unguessable project id
+def new_project_id():
+    return secrets.token_hex(16)
+
+# Saved project states, one pair of files per project
+class CheckpointStore:
+    """
+    Local store of project checkpoints
+
+    A checkpoint is the state of a project as written by
+    AnalysisProject.to_state (plus the current step): every LLM answer and
+    analysis result, with datasets held by reference to their dataset_key in
+    the dataset cache rather than copied. States are stored as gzipped JSON
+    next to a small metadata file, so listing projects does not read them.
+    Saving a state identical to the last one saved is skipped.
+
+    A checkpoint saved with an owner only loads for that owner; one saved
+    without an owner loads for anyone who knows its id.
+    """
+
+    def __init__(self, directory=CHECKPOINT_DIR, max_age=CHECKPOINT_MAX_AGE_SECONDS):
+        self.directory = directory
+        self.max_age = max_age
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def _path(self, project_id, suffix):
+        if not _PROJECT_ID.fullmatch(project_id or ""):
+            raise ValueError(f"Invalid project id {project_id!r}")
+        return os.path.join(self.directory, f"{project_id}{suffix}")
+
+    def _write(self, path, data):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def save(self, project_id, state, step=None, owner=None):
+        """
+        Save a project's state unless it is unchanged since the last save
+
+        Args:
+            project_id (str): The project id
+            state (dict): The JSON-serializable project state
+            step (int): The step the project is at, shown when listing projects
+            owner (str): The signed-in user the project belongs to, if any
+
+        Returns:
+            bool: True if the checkpoint was written
+        """
+        data = json.dumps(state, default=str, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if self._digests.get(project_id) == digest:
+                return False
+        meta = {"project_id": project_id, "name": state.get("name"), "step": step, "updated": time.time(),
+                "files": sorted(state.get("dataset_keys", {})), "owner": owner}
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Fast compression: checkpoints are written after every step
+            self._write(self._path(project_id, ".json.gz"), gzip.compress(data, compresslevel=1))
+            self._write(self._path(project_id, ".meta.json"), json.dumps(meta).encode("utf-8"))
+        except OSError as e:
+            logger.warning("Could not save the checkpoint of project %s: %s", project_id, e)
+            return False
+        with self._lock:
+            self._digests[project_id] = digest
+        return True
+
+    def _meta(self, project_id):
+        try:
+            with open(self._path(project_id, ".meta.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load(self, project_id, owner=None):
+        """
+        Load a project's saved state
+
+        Args:
+            project_id (str): The project id
+            owner (str): The signed-in user asking for it, if any
+
+        Returns:
+            dict: The project state, or None if there is no valid checkpoint this owner may open
+        """
+        meta = self._meta(project_id)
+        if meta is None or (meta.get("owner") is not None and meta["owner"] != owner):
+            return None
+        try:
+            with open(self._path(project_id, ".json.gz"), "rb") as f:
+                data = gzip.decompress(f.read())
+        except (OSError, ValueError, EOFError):
+            return None
+        try:
+            state = json.loads(data)
+        except ValueError:
+            logger.warning("Ignoring the corrupt checkpoint of project %s", project_id)
+            return None
+        # Saving the same state again right after resuming is a no-op
+        with self._lock:
+            self._digests[project_id] = hashlib.sha256(data).hexdigest()
+        return state
+
+    def list(self, owner=None, project_ids=(), shared=CHECKPOINT_SHARED):
+        """
+        List saved projects, deleting checkpoints older than max_age
+
+        Only the projects of the given owner and the given project ids are
+        listed, unless shared is set.
+
+        Args:
+            owner (str): The signed-in user whose projects are listed, if any
+            project_ids (iterable): Other projects to list, e.g. the ones opened in this session
+            shared (bool): List every project
+
+        Returns:
+            list: Metadata dicts (project_id, name, step, updated, files, owner), most recently saved first
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        cutoff = time.time() - self.max_age
+        projects = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".meta.json"):
+                continue
+            try:
+                with open(entry.path) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if meta.get("updated", 0) < cutoff:
+                self.delete(meta.get("project_id"))
+                continue
+            if shared or (owner is not None and meta.get("owner") == owner) or meta.get("project_id") in project_ids:
+                projects.append(meta)
+        return sorted(projects, key=lambda meta: meta.get("updated", 0), reverse=True)
+
+    def delete(self, project_id):
+        """
+        Delete a project's checkpoint
+
+        Args:
+            project_id (str): The project id
+        """
+        for suffix in (".json.gz", ".meta.json"):
+            try:
+                os.remove(self._path(project_id, suffix))
+            except (OSError, ValueError):
+                pass
+        with self._lock:
+            self._digests.pop(project_id, None)
+
+# Process-wide store shared by all sessions
+_store = CheckpointStore()
+
+# Function to get the shared checkpoint store
+def get_checkpoint_store():
+    return _store
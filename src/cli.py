@@ -0,0 +1,60 @@
+"""
+Run the analysis workflow headlessly over a directory of projects
+
+Every subdirectory of INPUT_DIR that contains CSV files is one project, with
+its problem statement in problem.txt and optional data context in
+context.txt. A CSV file directly in INPUT_DIR is a single-file project whose
+problem statement is in a .txt file with the same name. Reports and progress
+are written to OUTPUT_DIR/<project>/; running the command again resumes
+failed or interrupted projects and skips completed ones.
+
+Usage:
+    python -m src.cli INPUT_DIR [--output-dir DIR] [--workers N] [--max-tasks N] [--problem TEXT] [--force]
+"""
+import sys
+import logging
+import argparse
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the analysis workflow over a directory of CSV projects")
+    parser.add_argument("input_dir", help="Directory of projects (subdirectories or CSV files)")
+    parser.add_argument("--output-dir", default="batch_output", help="Where reports and progress are written")
+    parser.add_argument("--workers", type=int, default=None, help="Projects run at the same time")
+    parser.add_argument("--max-tasks", type=int, default=None,
+                        help="Analysis tasks from the Associate's guidance executed per project")
+    parser.add_argument("--problem", help="Problem statement for projects without one")
+    parser.add_argument("--force", action="store_true", help="Rerun projects that were already completed")
+    parser.add_argument("--verbose", action="store_true", help="Log every step")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    # Imported here so --help works without loading pandas and the LLM SDK
+    from src.utils import configure_genai
+    from src.pipeline import BATCH_MAX_TASKS, BATCH_MAX_WORKERS, discover_projects, run_batch
+
+    if not configure_genai():
+        return 2
+
+    projects = discover_projects(args.input_dir, default_problem=args.problem)
+    if not projects:
+        print(f"No projects found in {args.input_dir}")
+        return 1
+
+    def report_progress(status, done, total):
+        line = f"[{done}/{total}] {status['name']}: {status['status']}"
+        if status["error"]:
+            line += f" ({status['error']})"
+        print(line, flush=True)
+
+    summary = run_batch(projects, args.output_dir,
+                        max_workers=BATCH_MAX_WORKERS if args.workers is None else args.workers,
+                        max_tasks=BATCH_MAX_TASKS if args.max_tasks is None else args.max_tasks,
+                        force=args.force, progress_callback=report_progress)
+    failed = [status for status in summary if status["status"] == "failed"]
+    print(f"{len(summary) - len(failed)} of {len(summary)} projects completed; summary in {args.output_dir}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import datetime
+import threading
+from types import SimpleNamespace
+from src.settings import LLM_BACKEND
+from src.prompt_builder import count_tokens
+from src.rate_limit import call_with_retries, get_coalescer
+
+logger = logging.getLogger(__name__)
+
+# Context caching settings. The project context (problem statement, data
+# profiles, plan and data summary) starts most prompts once the data summary
+# exists; it is registered with the provider once per project state and
+# per persona, and later requests only send what follows it. Gemini only
+# caches contexts above a minimum size (32768 tokens for gemini-1.5 models);
+# smaller contexts are sent inline as usual.
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", 32_768))
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("CONTEXT_CACHE_TTL_SECONDS", 3600))
+# Token budget of the project context, separate from PROMPT_TOKEN_BUDGET
+CONTEXT_PREFIX_TOKENS = int(os.getenv("CONTEXT_PREFIX_TOKENS", 60_000))
+# Cached content needs an explicitly versioned model; defaults to "models/<model>-001"
+CONTEXT_CACHE_MODEL = os.getenv("CONTEXT_CACHE_MODEL", "")
+
+# Creates cached contexts with the Gemini API
+class GeminiContextBackend:
+    min_tokens = CONTEXT_CACHE_MIN_TOKENS
+
+    def create(self, context, model, config, ttl):
+        """
+        Register a context with the Gemini API
+
+        Args:
+            context (str): The context text
+            model (str): The model the requests use
+            config (dict): The persona config with its system instruction and generation config
+            ttl (int): Seconds the context is kept
+
+        Returns:
+            CachedContent: The registered context
+            GenerativeModel: A model that answers with the context in front of every request
+        """
+        import google.generativeai as genai
+        from google.generativeai import caching
+        cached = caching.CachedContent.create(model=CONTEXT_CACHE_MODEL or f"models/{model}-001",
+                                              system_instruction=config["system_instruction"],
+                                              contents=[context], ttl=datetime.timedelta(seconds=ttl))
+        return cached, genai.GenerativeModel.from_cached_content(cached_content=cached,
+                                                                 generation_config=config["generation_config"])
+
+# Stand-in for the Gemini context cache used with the fake backend
+class LocalContextBackend:
+    """
+    Keeps contexts in memory and answers with FakeGenerativeModel
+
+    Any context is cached, however small, so caching can be exercised
+    without an API key.
+    """
+
+    min_tokens = 0
+
+    def __init__(self):
+        self.created = 0
+
+    def create(self, context, model, config, ttl):
+        from src.fake_llm import FakeGenerativeModel
+        self.created += 1
+        cached = SimpleNamespace(name=f"cachedContents/local-{self.created}", model=model,
+                                 system_instruction=config["system_instruction"], contents=[context],
+                                 expire_time=time.time() + ttl)
+        return cached, FakeGenerativeModel.from_cached_content(cached, generation_config=config["generation_config"])
+
+# Registered contexts shared by every session in the process
+class ContextCache:
+    """
+    Registry of contexts cached with the LLM provider
+
+    Contexts are keyed by a hash of the persona config, model and text, so
+    each project state is registered once per persona; every session and
+    thread asking for the same context while it is being registered waits
+    for that one registration. Contexts below the backend's minimum size,
+    and contexts the provider refused, are remembered as not cached until
+    the TTL passes, so they are sent inline without asking again.
+    """
+
+    def __init__(self, backend, ttl=CONTEXT_CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    def model_for(self, context, persona, model, config):
+        """
+        Get a model that answers with a context in front of every request
+
+        Args:
+            context (str): The shared context
+            persona (str): The persona the requests use
+            model (str): The model the requests use
+            config (dict): The persona config with its system instruction and generation config
+
+        Returns:
+            GenerativeModel: The model bound to the cached context, or None to send the context inline
+        """
+        key = hashlib.sha256(json.dumps([persona, model, config, context], sort_keys=True).encode("utf-8")).hexdigest()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires"] > now:
+                if entry["model"] is not None:
+                    self.hits += 1
+                return entry["model"]
+
+        tokens = count_tokens(context)
+        cached, cached_model = None, None
+        if tokens >= self.backend.min_tokens:
+            try:
+                # Registering a context is an API call, so it shares the rate limit
+                (cached, cached_model), _ = get_coalescer().run(
+                    f"context:{key}", lambda: call_with_retries(
+                        lambda: self.backend.create(context, model, config, self.ttl))[0])
+            except Exception as e:
+                logger.warning("Could not cache the %s context (%d tokens); sending it inline: %s",
+                               persona, tokens, e)
+        with self._lock:
+            # Stop using a context a minute before the provider expires it
+            self._entries[key] = {"model": cached_model, "name": getattr(cached, "name", None), "tokens": tokens,
+                                  "expires": now + max(self.ttl - 60, 1)}
+            for stale in [k for k, e in self._entries.items() if e["expires"] <= now]:
+                del self._entries[stale]
+        return cached_model
+
+    def stats(self):
+        """
+        Describe the cached contexts
+
+        Returns:
+            dict: contexts (currently cached), tokens (their total size) and hits
+                (requests that used a cached context)
+        """
+        now = time.time()
+        with self._lock:
+            live = [e for e in self._entries.values() if e["model"] is not None and e["expires"] > now]
+            return {"contexts": len(live), "tokens": sum(e["tokens"] for e in live), "hits": self.hits}
+
+# Process-wide context cache, using the Gemini API or the local stand-in
+_cache = ContextCache(LocalContextBackend() if LLM_BACKEND == "fake" else GeminiContextBackend())
+
+# Function to get the shared context cache
+def get_context_cache():
+    return _cache
@@ -0,0 +1,255 @@
+import os
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+from collections.abc import Mapping
+from src.dataset_store import dataset_path, open_dataset, save_dataset
+
+logger = logging.getLogger(__name__)
+
+# Limits of the process-wide dataset registry. Only frames held on the Python
+# heap count towards the memory limit; memory-mapped frames are backed by the
+# dataset cache files and shared through the OS page cache.
+DATASET_MEMORY_LIMIT_BYTES = int(os.getenv("DATASET_MEMORY_LIMIT_BYTES", 2 * 1024 ** 3))
+DATASET_REGISTRY_MAX_IDLE = int(os.getenv("DATASET_REGISTRY_MAX_IDLE", 16))
+
+# Function to check whether a dataset is backed by a file in the dataset cache
+def _is_mapped(key):
+    return os.path.exists(dataset_path(key))
+
+# Datasets shared by every session in the process
+class DatasetRegistry:
+    """
+    Reference-counted registry of loaded datasets, keyed by content hash
+
+    Sessions that load the same file share one DataFrame. When the heap
+    frames exceed the memory limit, the least recently used ones are moved
+    to the dataset cache on disk: unreferenced frames are dropped, and
+    referenced frames are replaced by a memory-mapped copy. Frames that are
+    only a preview of a larger file are never written to the cache, since
+    the cache must hold the full data. Unreferenced memory-mapped frames are
+    kept for quick reuse up to a maximum count.
+    """
+
+    def __init__(self, memory_limit=DATASET_MEMORY_LIMIT_BYTES, max_idle=DATASET_REGISTRY_MAX_IDLE):
+        self.memory_limit = memory_limit
+        self.max_idle = max_idle
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key, df, profile):
+        """
+        Register a loaded dataset and take a reference to it
+
+        If the dataset is already registered, the existing frame is shared and
+        the given one is discarded.
+
+        Args:
+            key (str): The content hash of the source file
+            df (DataFrame): The loaded data
+            profile (dict): The data profile
+
+        Returns:
+            DataFrame: The shared frame
+            dict: The shared profile
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                mapped = _is_mapped(key)
+                entry = {"df": df, "profile": profile, "refs": 0, "mapped": mapped,
+                         "heap_bytes": 0 if mapped else int(df.memory_usage(deep=True).sum())}
+                self._entries[key] = entry
+            entry["refs"] += 1
+            self._entries.move_to_end(key)
+            self._enforce_limits()
+            return entry["df"], entry["profile"]
+
+    def acquire(self, key):
+        """
+        Take a reference to a dataset, opening it from the dataset cache if needed
+
+        Args:
+            key (str): The content hash of the source file
+
+        Returns:
+            DataFrame: The shared frame, or None if it is neither registered nor cached
+            dict: The shared profile, or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["refs"] += 1
+                self._entries.move_to_end(key)
+                return entry["df"], entry["profile"]
+        df, profile = open_dataset(key)
+        if df is None:
+            return None, None
+        return self.add(key, df, profile)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return (entry["df"], entry["profile"]) if entry is not None else (None, None)
+
+    def release(self, key):
+        """
+        Drop a reference to a dataset
+
+        Args:
+            key (str): The content hash of the source file
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry["refs"] = max(entry["refs"] - 1, 0)
+            self._enforce_limits()
+
+    def _heap_bytes(self):
+        return sum(entry["heap_bytes"] for entry in self._entries.values())
+
+    def _spill(self, key, entry):
+        # Write a heap frame to the dataset cache and swap in its memory-mapped copy
+        if entry["profile"].get("preview_rows") is not None:
+            return False
+        if not _is_mapped(key) and not save_dataset(key, entry["df"], entry["profile"]):
+            return False
+        df, profile = open_dataset(key)
+        if df is None:
+            return False
+        entry.update(df=df, profile=profile, mapped=True, heap_bytes=0)
+        return True
+
+    def _enforce_limits(self):
+        # Oldest first; the caller holds the lock
+        for key, entry in list(self._entries.items()):
+            if self._heap_bytes() <= self.memory_limit:
+                break
+            if entry["heap_bytes"] == 0:
+                continue
+            if entry["refs"] == 0:
+                # Keep a copy on disk so the next session can memory-map it
+                if entry["profile"].get("preview_rows") is None and not _is_mapped(key):
+                    save_dataset(key, entry["df"], entry["profile"])
+                del self._entries[key]
+            elif not self._spill(key, entry):
+                logger.warning("Dataset %s could not be moved to disk; memory limit exceeded", key)
+
+        idle = [key for key, entry in self._entries.items() if entry["refs"] == 0]
+        for key in idle[:max(len(idle) - self.max_idle, 0)]:
+            del self._entries[key]
+
+    def stats(self):
+        """
+        Describe the registry
+
+        Returns:
+            dict: datasets, references, heap_bytes, mapped (memory-mapped datasets)
+                and idle (unreferenced datasets)
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+        return {
+            "datasets": len(entries),
+            "references": sum(entry["refs"] for entry in entries),
+            "heap_bytes": sum(entry["heap_bytes"] for entry in entries),
+            "mapped": sum(1 for entry in entries if entry["mapped"]),
+            "idle": sum(1 for entry in entries if entry["refs"] == 0)
+        }
+
+# Process-wide registry shared by all sessions
+_registry = DatasetRegistry()
+
+# Function to get the shared dataset registry
+def get_dataset_registry():
+    return _registry
+
+# Function to drop a set of references, used when a SessionDatasets is garbage collected
+def _release_all(registry, keys):
+    for key in keys:
+        registry.release(key)
+
+# The datasets of one session, as references into the shared registry
+class SessionDatasets(Mapping):
+    """
+    Read-only mapping of file names to DataFrames held by reference
+
+    The frames live in the process-wide registry; this mapping only records
+    which dataset key each file name refers to. References are released by
+    release() or, if the session simply ends, when the mapping is garbage
+    collected.
+    """
+
+    def __init__(self, registry=None):
+        self._registry = registry or _registry
+        self._keys = {}
+        # Every reference taken, kept outside the object so the finalizer can release them
+        self._held = []
+        weakref.finalize(self, _release_all, self._registry, self._held)
+
+    def add(self, name, df, profile):
+        """
+        Add a file's data, sharing the frame with other sessions that loaded the same file
+
+        Args:
+            name (str): The file name
+            df (DataFrame): The loaded data
+            profile (dict): The data profile (its dataset_key identifies the data)
+
+        Returns:
+            DataFrame: The shared frame
+            dict: The shared profile
+        """
+        if name in self._keys:
+            self._release(name)
+        key = profile["dataset_key"]
+        df, profile = self._registry.add(key, df, profile)
+        self._keys[name] = key
+        self._held.append(key)
+        return df, profile
+
+    def acquire(self, name, key):
+        """
+        Add a file's data by its dataset key, opening it from the dataset cache if needed
+
+        Args:
+            name (str): The file name
+            key (str): The content hash of the file
+
+        Returns:
+            DataFrame: The shared frame, or None if the dataset is neither loaded nor cached
+            dict: The shared profile, or None
+        """
+        if name in self._keys:
+            self._release(name)
+        df, profile = self._registry.acquire(key)
+        if df is None:
+            return None, None
+        self._keys[name] = key
+        self._held.append(key)
+        return df, profile
+
+    def _release(self, name):
+        key = self._keys.pop(name)
+        self._held.remove(key)
+        self._registry.release(key)
+
+    def release(self):
+        """Release every reference held by this session"""
+        for name in list(self._keys):
+            self._release(name)
+
+    def dataset_keys(self):
+        return dict(self._keys)
+
+    def __getitem__(self, name):
+        # Referenced datasets are never dropped from the registry, only moved to disk
+        return self._registry.get(self._keys[name])[0]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
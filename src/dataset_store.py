@@ -0,0 +1,283 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+# Location and size limit of the on-disk dataset cache
+DATASET_CACHE_DIR = os.getenv("DATASET_CACHE_DIR", os.path.join(".cache", "datasets"))
+DATASET_CACHE_MAX_BYTES = int(os.getenv("DATASET_CACHE_MAX_BYTES", 10 * 1024 * 1024 * 1024))
+_HASH_BLOCK_BYTES = 1024 * 1024
+
+# Function to compute a content hash of an uploaded file
+def compute_content_hash(uploaded_file):
+    """
+    Compute a SHA-256 hash of the bytes of an uploaded file
+
+    Args:
+        uploaded_file: The uploaded file object from Streamlit (or any binary file object)
+
+    Returns:
+        str: The hex digest, used as the key of the dataset in the cache
+    """
+    digest = hashlib.sha256()
+    if hasattr(uploaded_file, "getbuffer"):
+        # Streamlit uploads are held in memory, so hash them without copying
+        digest.update(uploaded_file.getbuffer())
+        return digest.hexdigest()
+
+    position = uploaded_file.tell()
+    uploaded_file.seek(0)
+    for block in iter(lambda: uploaded_file.read(_HASH_BLOCK_BYTES), b""):
+        digest.update(block)
+    uploaded_file.seek(position)
+    return digest.hexdigest()
+
+# Function to get the path of a cached dataset file
+def dataset_path(key):
+    return os.path.join(DATASET_CACHE_DIR, f"{key}.arrow")
+
+def _profile_path(key):
+    return os.path.join(DATASET_CACHE_DIR, f"{key}.json")
+
+# Function to get the path of a file derived from a dataset (e.g. its row sample);
+# sidecar files are deleted together with the dataset
+def sidecar_path(key, name):
+    return os.path.join(DATASET_CACHE_DIR, f"{key}.{name}")
+
+# Convert numpy scalars in a profile to plain Python values for JSON
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+# Function to get a type that holds the values of two Arrow types, mirroring
+# what pd.read_csv infers when it sees both kinds of values in one column
+def _widen_type(current, new):
+    if current == new or pa.types.is_null(new):
+        return current
+    if pa.types.is_null(current):
+        return new
+    if pa.types.is_integer(current) and pa.types.is_integer(new):
+        return pa.int64()
+    if (pa.types.is_integer(current) or pa.types.is_floating(current)) \
+            and (pa.types.is_integer(new) or pa.types.is_floating(new)):
+        return pa.float64()
+    # Mixed values are kept as text, with 64-bit offsets like pandas' own string columns
+    return pa.large_string()
+
+# Function to get a schema that holds the data of two schemas with the same columns
+def _widen_schema(current, new):
+    if current.names != new.names:
+        raise ValueError(f"Columns changed between chunks: {current.names} != {new.names}")
+    return pa.schema([pa.field(field.name, _widen_type(field.type, other.type))
+                      for field, other in zip(current, new)])
+
+# Writes a dataset to the cache one batch at a time
+class DatasetWriter:
+    """
+    Stream DataFrame chunks into an Arrow IPC file in the dataset cache
+
+    The file is written under a temporary name and only becomes visible to
+    open_dataset once finish() is called, so readers never see partial files.
+    The schema follows the chunks: when a later chunk needs a wider type
+    (e.g. floats in an integer column, or text in a column that was empty so
+    far), the batches written so far are rewritten once with the wider
+    schema. If a chunk still cannot be stored, the write is abandoned and the
+    dataset is not cached.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.schema = None
+        self.failed = False
+        self._writer = None
+        self._sink = None
+        self._tmp_path = f"{dataset_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def _open(self, schema):
+        self.schema = schema
+        self._sink = pa.OSFile(self._tmp_path, "wb")
+        self._writer = pa.ipc.new_file(self._sink, schema)
+
+    def _widen(self, schema):
+        # Copy the batches written so far into a new file with the wider schema
+        self._writer.close()
+        self._sink.close()
+        old_path = f"{self._tmp_path}.old"
+        os.replace(self._tmp_path, old_path)
+        try:
+            self._open(schema)
+            with pa.memory_map(old_path, "r") as source:
+                reader = pa.ipc.open_file(source)
+                for i in range(reader.num_record_batches):
+                    self._writer.write_batch(reader.get_batch(i).cast(schema))
+        finally:
+            os.remove(old_path)
+        logger.info("Widened the schema of dataset %s to %s", self.key, schema)
+
+    def write(self, df):
+        if self.failed:
+            return
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            schema = table.schema.remove_metadata()
+            if self._writer is None:
+                os.makedirs(DATASET_CACHE_DIR, exist_ok=True)
+                self._open(schema)
+            elif schema != self.schema:
+                widened = _widen_schema(self.schema, schema)
+                if widened != self.schema:
+                    self._widen(widened)
+            self._writer.write_table(table.cast(self.schema))
+        except (pa.ArrowException, ValueError, TypeError, OSError) as e:
+            logger.warning("Not caching dataset %s: %s", self.key, e)
+            self.abort()
+
+    def finish(self, profile):
+        """
+        Close the file and publish it together with its profile
+
+        Args:
+            profile (dict): The data profile to store next to the data
+
+        Returns:
+            bool: True if the dataset was written to the cache
+        """
+        if self.failed or self._writer is None:
+            self.abort()
+            return False
+        try:
+            self._writer.close()
+            self._sink.close()
+            with open(_profile_path(self.key), "w") as f:
+                json.dump(profile, f, default=_json_default)
+            os.replace(self._tmp_path, dataset_path(self.key))
+        except OSError as e:
+            logger.warning("Not caching dataset %s: %s", self.key, e)
+            self.abort()
+            return False
+        evict_datasets()
+        return True
+
+    def abort(self):
+        self.failed = True
+        try:
+            if self._writer is not None:
+                self._writer.close()
+            if self._sink is not None:
+                self._sink.close()
+        except (pa.ArrowException, OSError):
+            pass
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+# Function to save a complete DataFrame to the cache
+def save_dataset(key, df, profile):
+    """
+    Save a DataFrame and its profile to the dataset cache
+
+    Args:
+        key (str): The content hash of the source file
+        df (DataFrame): The data to cache
+        profile (dict): The data profile
+
+    Returns:
+        bool: True if the dataset was written to the cache
+    """
+    writer = DatasetWriter(key)
+    writer.write(df)
+    return writer.finish(profile)
+
+# Function to pick the pandas dtype of an Arrow column when opening a dataset
+def _pandas_type(arrow_type):
+    # Dictionary columns become categoricals so the .cat accessor works; the
+    # rest stay ArrowDtype columns backed by the memory-mapped buffers
+    return None if pa.types.is_dictionary(arrow_type) else pd.ArrowDtype(arrow_type)
+
+# Function to open a cached dataset without copying it into memory
+def open_dataset(key):
+    """
+    Memory-map a cached dataset
+
+    The returned DataFrame is backed by Arrow buffers that point into the
+    memory-mapped file, so opening it does not parse or copy the data. Only
+    categorical columns are converted (their codes are copied). The profile's
+    dtypes describe the returned frame, which is what analysis code sees.
+
+    Args:
+        key (str): The content hash of the source file
+
+    Returns:
+        DataFrame: The cached data, or None if the dataset is not cached
+        dict: The cached data profile, or None if the dataset is not cached
+    """
+    path = dataset_path(key)
+    try:
+        with open(_profile_path(key)) as f:
+            profile = json.load(f)
+        source = pa.memory_map(path, "r")
+        table = pa.ipc.open_file(source).read_all()
+    except (OSError, ValueError, pa.ArrowException):
+        return None, None
+
+    # Mark the dataset as recently used for LRU eviction
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+    df = table.to_pandas(types_mapper=_pandas_type)
+    profile["shape"] = tuple(profile["shape"])
+    profile["dtypes"] = {col: str(dtype) for col, dtype in df.dtypes.items()}
+    return df, profile
+
+# Function to keep the cache directory under its size limit
+def evict_datasets(max_bytes=None):
+    """
+    Delete least recently used datasets until the cache fits its size limit
+
+    Args:
+        max_bytes (int): The size limit (defaults to DATASET_CACHE_MAX_BYTES)
+
+    Returns:
+        list: The keys of the evicted datasets
+    """
+    max_bytes = DATASET_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    if not os.path.isdir(DATASET_CACHE_DIR):
+        return []
+
+    entries = []
+    for name in os.listdir(DATASET_CACHE_DIR):
+        if not name.endswith(".arrow"):
+            continue
+        try:
+            stat = os.stat(os.path.join(DATASET_CACHE_DIR, name))
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name[:-len(".arrow")]))
+
+    total = sum(size for _, size, _ in entries)
+    evicted = []
+    for _, size, key in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(dataset_path(key))
+        except OSError:
+            # Still memory-mapped on platforms that forbid deleting open files
+            continue
+        for name in os.listdir(DATASET_CACHE_DIR):
+            if name.startswith(f"{key}.") and not name.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(DATASET_CACHE_DIR, name))
+                except OSError:
+                    pass
+        total -= size
+        evicted.append(key)
+    return evicted
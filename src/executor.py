@@ -0,0 +1,240 @@
+import os
+import re
+import sys
+import json
+import time
+import tempfile
+import subprocess
+import pyarrow as pa
+import pyarrow.feather as feather
+from src.dataset_store import dataset_path
+
+# Resource limits for executing analysis code
+EXECUTION_CPU_SECONDS = int(os.getenv("EXECUTION_CPU_SECONDS", 60))
+EXECUTION_WALL_SECONDS = int(os.getenv("EXECUTION_WALL_SECONDS", 120))
+EXECUTION_MEMORY_MB = int(os.getenv("EXECUTION_MEMORY_MB", 4096))
+EXECUTION_MAX_TABLE_ROWS = int(os.getenv("EXECUTION_MAX_TABLE_ROWS", 50))
+
+# Environment variables passed to the child process. The code it runs is
+# written by the LLM, so secrets in the environment are not passed on; the
+# child still runs as the app's user and can read any file that user can.
+_CHILD_ENV_NAMES = ("PATH", "HOME", "LANG", "LC_ALL", "LC_CTYPE", "SYSTEMROOT")
+
+# Script run in the child process. It limits its own resources, maps the
+# datasets from Arrow files as they are first used, runs the code and writes
+# whatever it produced to a JSON result file.
+_RUNNER = r'''
+import io, sys, json, base64, contextlib, traceback
+from collections.abc import Mapping
+
+with open(sys.argv[1]) as f:
+    spec = json.load(f)
+
+# Set here rather than with preexec_fn, which is unsafe in a process with threads
+try:
+    import resource
+    resource.setrlimit(resource.RLIMIT_CPU, (spec["cpu_seconds"], spec["cpu_seconds"]))
+    # RLIMIT_DATA counts heap allocations but not the read-only memory-mapped datasets
+    resource.setrlimit(resource.RLIMIT_DATA, (spec["memory_bytes"], spec["memory_bytes"]))
+except ImportError:  # Windows: only the wall-clock limit applies
+    pass
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Datasets opened on first use as in dataset_store.open_dataset: ArrowDtype
+# columns stay in the memory-mapped Arrow buffers instead of being copied onto
+# the heap, and dictionary columns become categoricals
+def pandas_type(arrow_type):
+    return None if pa.types.is_dictionary(arrow_type) else pd.ArrowDtype(arrow_type)
+
+class Datasets(Mapping):
+    def __init__(self, paths):
+        self.paths = paths
+        self.frames = {}
+
+    def __getitem__(self, name):
+        if name not in self.frames:
+            source = pa.memory_map(self.paths[name], "r")
+            self.frames[name] = pa.ipc.open_file(source).read_all().to_pandas(types_mapper=pandas_type)
+        return self.frames[name]
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+dfs = Datasets(spec["datasets"])
+namespace = {"pd": pd, "np": np, "dfs": dfs, "df": dfs[spec["primary"]]}
+try:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    namespace["plt"] = plt
+except ImportError:
+    plt = None
+initial = set(namespace)
+
+stdout = io.StringIO()
+error = None
+try:
+    with contextlib.redirect_stdout(stdout):
+        exec(compile(spec["code"], "<analysis>", "exec"), namespace)
+except BaseException:
+    error = traceback.format_exc(limit=3)
+
+max_rows = spec["max_rows"]
+tables, scalars, figures = [], {}, []
+for name, value in namespace.items():
+    if name in initial or name.startswith("_"):
+        continue
+    if isinstance(value, pd.Series):
+        value = value.to_frame()
+    if isinstance(value, pd.DataFrame):
+        head = value.head(max_rows)
+        tables.append({
+            "name": name,
+            "shape": list(value.shape),
+            "columns": [str(c) for c in head.columns],
+            "index": [str(i) for i in head.index],
+            "data": json.loads(head.to_json(orient="values", date_format="iso", default_handler=str))
+        })
+    elif isinstance(value, (bool, int, float, str, np.generic)):
+        scalars[name] = value.item() if isinstance(value, np.generic) else value
+if plt is not None:
+    for number in plt.get_fignums():
+        buffer = io.BytesIO()
+        plt.figure(number).savefig(buffer, format="png", bbox_inches="tight")
+        figures.append(base64.b64encode(buffer.getvalue()).decode("ascii"))
+
+with open(spec["result_path"], "w") as f:
+    json.dump({"stdout": stdout.getvalue()[-20000:], "error": error, "tables": tables,
+               "scalars": scalars, "figures": figures}, f, default=str)
+'''
+
+# Function to extract Python code from an LLM response
+def extract_python_code(response):
+    """
+    Extract the Python code blocks from a Markdown response
+
+    Args:
+        response (str): The response text
+
+    Returns:
+        str: The code blocks joined together, or None if there are none
+    """
+    blocks = re.findall(r"```(?:python|py)[^\n]*\n(.*?)```", response or "", flags=re.DOTALL | re.IGNORECASE)
+    if not blocks:
+        return None
+    return "\n\n".join(block.strip() for block in blocks)
+
+# Function to build the child process environment without the parent's secrets
+def _child_env():
+    return {name: os.environ[name] for name in _CHILD_ENV_NAMES if name in os.environ}
+
+# Function to run analysis code against the full datasets in a subprocess
+def execute_analysis_code(code, dataframes, profiles, primary=None):
+    """
+    Run analysis code in a separate Python process with resource limits
+
+    The code sees every dataset in the mapping `dfs` (keyed by file name) and
+    the primary one as `df`. Cached datasets are memory-mapped from the
+    dataset cache; others are written to a temporary Arrow file first. Each
+    is opened on first use with the same dtypes as in the app. The
+    process gets only PATH, HOME and the locale from the environment and no
+    stdin. It is not isolated from the file system: it can read whatever the
+    app's user can, including a `.env` file.
+    DataFrames, Series and scalars the code assigns, anything it prints and
+    any matplotlib figures it draws are returned.
+
+    Args:
+        code (str): The Python code to run
+        dataframes (dict): Maps file names to DataFrames
+        profiles (dict): Maps file names to data profiles
+        primary (str): The file name bound to `df` (defaults to the first file)
+
+    Returns:
+        dict: The captured stdout, error, tables, scalars and base64 PNG figures,
+            plus the wall time in seconds
+    """
+    primary = primary or next(iter(dataframes))
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="analysis-") as work_dir:
+        datasets = {}
+        for i, (name, df) in enumerate(dataframes.items()):
+            key = profiles.get(name, {}).get("dataset_key")
+            if key and os.path.exists(dataset_path(key)):
+                datasets[name] = os.path.abspath(dataset_path(key))
+            else:
+                datasets[name] = os.path.join(work_dir, f"{i}.arrow")
+                feather.write_feather(pa.Table.from_pandas(df, preserve_index=False), datasets[name],
+                                      compression="uncompressed")
+
+        spec_path = os.path.join(work_dir, "spec.json")
+        result_path = os.path.join(work_dir, "result.json")
+        with open(spec_path, "w") as f:
+            json.dump({"code": code, "datasets": datasets, "primary": primary,
+                       "result_path": result_path, "max_rows": EXECUTION_MAX_TABLE_ROWS,
+                       "cpu_seconds": EXECUTION_CPU_SECONDS, "memory_bytes": EXECUTION_MEMORY_MB * 1024 * 1024}, f)
+
+        try:
+            process = subprocess.run(
+                [sys.executable, "-c", _RUNNER, spec_path],
+                cwd=work_dir,
+                stdin=subprocess.DEVNULL,
+                capture_output=True,
+                text=True,
+                timeout=EXECUTION_WALL_SECONDS,
+                env=_child_env()
+            )
+        except subprocess.TimeoutExpired:
+            return _failed(f"Execution exceeded the {EXECUTION_WALL_SECONDS}s time limit", started)
+
+        if not os.path.exists(result_path):
+            # The process died before writing results (CPU or memory limit, crash)
+            if process.returncode < 0:
+                return _failed(f"Execution was stopped by signal {-process.returncode} "
+                               f"(CPU limit of {EXECUTION_CPU_SECONDS}s or memory limit exceeded)", started)
+            message = process.stderr.strip().splitlines()[-1:] or [f"exit code {process.returncode}"]
+            return _failed(f"Execution failed: {message[0]}", started)
+        with open(result_path) as f:
+            result = json.load(f)
+
+    result["duration"] = time.perf_counter() - started
+    return result
+
+def _failed(message, started):
+    return {"stdout": "", "error": message, "tables": [], "scalars": {}, "figures": [],
+            "duration": time.perf_counter() - started}
+
+# Function to describe execution results in text for a prompt
+def format_execution_result(result, max_chars=6000):
+    """
+    Render execution results as compact text for the Analyst
+
+    Args:
+        result (dict): The result from execute_analysis_code
+        max_chars (int): The maximum length of the text
+
+    Returns:
+        str: The printed output, scalars and tables as text
+    """
+    parts = []
+    if result["error"]:
+        parts.append(f"Error:\n{result['error']}")
+    if result["stdout"].strip():
+        parts.append(f"Printed output:\n{result['stdout'].strip()}")
+    if result["scalars"]:
+        parts.append("Values:\n" + "\n".join(f"- {name} = {value}" for name, value in result["scalars"].items()))
+    for table in result["tables"]:
+        header = " | ".join([""] + table["columns"])
+        rows = [" | ".join([index] + [str(v) for v in row]) for index, row in zip(table["index"], table["data"])]
+        shown = f" (first {len(rows)} rows)" if len(rows) < table["shape"][0] else ""
+        parts.append(f"Table `{table['name']}` {table['shape'][0]}×{table['shape'][1]}{shown}:\n"
+                     + "\n".join([header] + rows))
+    if result["figures"]:
+        parts.append(f"{len(result['figures'])} figure(s) were produced.")
+    text = "\n\n".join(parts) or "The code ran but produced no output."
+    return text if len(text) <= max_chars else text[:max_chars] + "\n... (truncated)"
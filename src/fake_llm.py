@@ -0,0 +1,110 @@
+import os
+import time
+import hashlib
+from types import SimpleNamespace
+from src.prompt_builder import count_tokens
+
+# Simulated latency of the fake backend
+FAKE_LLM_LATENCY_SECONDS = float(os.getenv("FAKE_LLM_LATENCY_SECONDS", 0.0))
+FAKE_LLM_STREAM_CHUNKS = int(os.getenv("FAKE_LLM_STREAM_CHUNKS", 8))
+
+# Canned response bodies per persona, shaped like what the real personas return
+_BODIES = {
+    "manager": (
+        "1. Review the data profiles and confirm the columns needed for the goal\n"
+        "2. Clean missing values and check data types\n"
+        "3. Explore distributions and relationships between key columns\n"
+        "4. Run the analyses that answer the problem statement\n"
+        "5. Synthesize the findings into recommendations\n"
+    ),
+    "analyst": (
+        "The approach is to compute summary statistics on the full data.\n\n"
+        "```python\nsummary = df.describe()\nrows = len(df)\n```\n"
+    ),
+    "associate": (
+        "Hypothesis: the key numeric columns are related to the goal.\n\n"
+        "Next tasks:\n"
+        "1. Calculate correlation matrix for numerical columns\n"
+        "2. Generate frequency counts for categorical columns\n"
+        "3. Visualize distribution of the main numeric column\n"
+    ),
+}
+
+# Stand-in for google.generativeai.GenerativeModel that never touches the network
+class FakeGenerativeModel:
+    """
+    Deterministic local replacement for GenerativeModel
+
+    Responses depend only on the persona (recognized from the system
+    instruction) and a hash of the prompt, so repeated runs produce the same
+    output. Each call sleeps for FAKE_LLM_LATENCY_SECONDS to simulate network
+    and generation time; streamed calls spread that over their chunks.
+    Token counts are reported in usage_metadata like the real API.
+    """
+
+    def __init__(self, model_name, system_instruction=None, generation_config=None, latency=None):
+        self.model_name = model_name
+        self.system_instruction = system_instruction or ""
+        self.generation_config = generation_config or {}
+        self.latency = FAKE_LLM_LATENCY_SECONDS if latency is None else latency
+        self.cached_context = None
+        self.calls = 0
+
+    @classmethod
+    def from_cached_content(cls, cached_content, generation_config=None):
+        """
+        Build a model that answers with a cached context in front of every prompt
+
+        Mirrors GenerativeModel.from_cached_content: the response to the
+        request text alone is the same as the response to the context and
+        request sent together.
+
+        Args:
+            cached_content: An object with model, system_instruction and contents
+            generation_config (dict): The generation settings
+
+        Returns:
+            FakeGenerativeModel: The model bound to the context
+        """
+        model = cls(cached_content.model, system_instruction=cached_content.system_instruction,
+                    generation_config=generation_config)
+        model.cached_context = "\n".join(cached_content.contents)
+        return model
+
+    def _persona(self):
+        instruction = self.system_instruction.lower()
+        for persona in _BODIES:
+            if persona in instruction:
+                return persona
+        return None
+
+    def _text(self, prompt):
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+        body = _BODIES.get(self._persona(), "Here is a response to your request.\n")
+        return f"{body}\n_Fake response {digest} for a {count_tokens(prompt)}-token prompt._\n"
+
+    def _usage(self, prompt, text):
+        prompt_tokens = count_tokens(self.system_instruction) + count_tokens(prompt)
+        output_tokens = count_tokens(text)
+        return SimpleNamespace(prompt_token_count=prompt_tokens, candidates_token_count=output_tokens,
+                               total_token_count=prompt_tokens + output_tokens,
+                               cached_content_token_count=count_tokens(self.cached_context))
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        self.calls += 1
+        prompt = contents if isinstance(contents, str) else "\n".join(map(str, contents))
+        if self.cached_context:
+            prompt = f"{self.cached_context}\n\n{prompt}"
+        text = self._text(prompt)
+        usage = self._usage(prompt, text)
+        if stream:
+            return self._stream(text, usage)
+        time.sleep(self.latency)
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+    def _stream(self, text, usage):
+        size = max(len(text) // FAKE_LLM_STREAM_CHUNKS, 1)
+        pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        for piece in pieces:
+            time.sleep(self.latency / len(pieces))
+            yield SimpleNamespace(text=piece, usage_metadata=usage)
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# How much conversation history is kept in memory, where older messages are
+# spilled to, and how many messages the sidebar shows per page
+HISTORY_MEMORY_ENTRIES = int(os.getenv("HISTORY_MEMORY_ENTRIES", 50))
+HISTORY_DIR = os.getenv("HISTORY_DIR", os.path.join(".cache", "history"))
+HISTORY_MAX_AGE_SECONDS = int(os.getenv("HISTORY_MAX_AGE_SECONDS", 7 * 24 * 60 * 60))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 10))
+
+_pruned = False
+
+# Function to delete history files left behind by old sessions, once per process
+def _prune_history_files(directory, max_age):
+    global _pruned
+    if _pruned or not os.path.isdir(directory):
+        return
+    _pruned = True
+    cutoff = time.time() - max_age
+    for entry in os.scandir(directory):
+        try:
+            if entry.name.endswith(".jsonl") and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+# Conversation history of one session
+class ConversationHistory:
+    """
+    Conversation history with a bounded in-memory window
+
+    The newest `window` messages are kept in memory; older ones are appended
+    to a per-session JSON-lines file and read back by byte offset only when
+    a page that contains them is shown. Messages are dicts with "role" and
+    "content", numbered from 0 (oldest).
+    """
+
+    def __init__(self, path=None, window=HISTORY_MEMORY_ENTRIES, directory=HISTORY_DIR):
+        _prune_history_files(directory, HISTORY_MAX_AGE_SECONDS)
+        self.path = path or os.path.join(directory, f"{uuid.uuid4().hex}.jsonl")
+        self.window = max(window, 1)
+        self._recent = deque()
+        self._offsets = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._offsets) + len(self._recent)
+
+    def append(self, role, content):
+        """
+        Add a message, spilling the oldest in-memory message to disk if the window is full
+
+        Args:
+            role (str): Who wrote the message (user, manager, analyst, associate)
+            content (str): The message text
+        """
+        with self._lock:
+            self._recent.append({"role": role, "content": content})
+            if len(self._recent) > self.window:
+                self._spill(self._recent.popleft())
+
+    def _spill(self, message):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "ab") as f:
+            self._offsets.append(f.tell())
+            f.write(json.dumps(message).encode("utf-8") + b"\n")
+
+    def _read_spilled(self, start, stop):
+        if start >= stop:
+            return []
+        with open(self.path, "rb") as f:
+            f.seek(self._offsets[start])
+            return [json.loads(f.readline()) for _ in range(start, stop)]
+
+    def slice(self, start, stop):
+        """
+        Get messages start to stop (exclusive), oldest first
+
+        Args:
+            start (int): The index of the first message
+            stop (int): The index after the last message
+
+        Returns:
+            list: The messages
+        """
+        with self._lock:
+            spilled = len(self._offsets)
+            start, stop = max(start, 0), min(stop, spilled + len(self._recent))
+            messages = self._read_spilled(start, min(stop, spilled))
+            recent = list(self._recent)
+            messages.extend(recent[max(start - spilled, 0):max(stop - spilled, 0)])
+        return messages
+
+    def page(self, number, page_size=HISTORY_PAGE_SIZE):
+        """
+        Get one page of messages, newest first
+
+        Args:
+            number (int): The page number, starting at 1 for the newest messages
+            page_size (int): Messages per page
+
+        Returns:
+            list: (index, message) pairs for the page
+        """
+        stop = len(self) - (number - 1) * page_size
+        start = max(stop - page_size, 0)
+        return list(reversed(list(enumerate(self.slice(start, stop), start=start))))
+
+    def page_count(self, page_size=HISTORY_PAGE_SIZE):
+        return max((len(self) + page_size - 1) // page_size, 1)
+
+    def __iter__(self):
+        return iter(self.slice(0, len(self)))
+
+    def clear(self):
+        """Forget every message and delete the spill file"""
+        with self._lock:
+            self._recent.clear()
+            self._offsets = []
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning("Could not delete conversation history file: %s", e)
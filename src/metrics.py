@@ -0,0 +1,281 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import statistics
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is not available
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Where metrics are logged and how much detail is kept
+METRICS_LOG_PATH = os.getenv("METRICS_LOG_PATH", os.path.join(".cache", "metrics.jsonl"))
+METRICS_TRACE_MEMORY = os.getenv("METRICS_TRACE_MEMORY", "false").lower() in ("1", "true", "yes")
+METRICS_HISTORY = int(os.getenv("METRICS_HISTORY", 1000))
+# Size at which the log is moved to "<path>.1" (replacing the previous one) and restarted; 0 never rotates
+METRICS_LOG_MAX_BYTES = int(os.getenv("METRICS_LOG_MAX_BYTES", 10 * 1024 * 1024))
+
+# Function to get the highest resident memory this process has used since it started
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux and the BSDs kilobytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)]
+
+# Collects timing, token and memory events for the whole process
+class MetricsRecorder:
+    """
+    Record LLM calls and workflow stage timings
+
+    Every event is appended as one JSON line to the metrics log and kept in
+    a bounded in-memory history for the diagnostics panel. The log stays
+    open between events and is rotated once it reaches max_bytes, keeping
+    one previous file. When
+    METRICS_TRACE_MEMORY is enabled, stages also report the peak Python
+    allocation measured with tracemalloc (which slows the app down). Every
+    stage also reports process_peak_rss_mb, the highest RSS of the process
+    since it started (not of the stage), so it only grows when a stage
+    needed more memory than anything before it.
+    """
+
+    def __init__(self, log_path=METRICS_LOG_PATH, history=METRICS_HISTORY, trace_memory=METRICS_TRACE_MEMORY,
+                 max_bytes=METRICS_LOG_MAX_BYTES):
+        self.log_path = log_path
+        self.max_bytes = max_bytes
+        self._log = None
+        self.events = deque(maxlen=history)
+        self.trace_memory = trace_memory
+        # Kept apart from the bounded history so it is never evicted
+        self.startup = None
+        self._lock = threading.Lock()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def record(self, kind, **fields):
+        """
+        Record an event
+
+        Args:
+            kind (str): The event type, e.g. "llm_call" or "stage"
+            **fields: The event data (must be JSON serializable)
+
+        Returns:
+            dict: The recorded event
+        """
+        event = {"kind": kind, "timestamp": time.time(), "pid": os.getpid(), **fields}
+        with self._lock:
+            self.events.append(event)
+            if self.log_path:
+                try:
+                    self._write(json.dumps(event, default=str) + "\n")
+                except OSError as e:
+                    logger.warning("Could not write metrics log: %s", e)
+                    self._close()
+        return event
+
+    # Append a line to the log, opening or rotating it first; called with the lock held
+    def _write(self, line):
+        if self._log is None:
+            directory = os.path.dirname(self.log_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._log = open(self.log_path, "a", encoding="utf-8", buffering=1)
+        if self.max_bytes and 0 < self._log.tell() and self._log.tell() + len(line) > self.max_bytes:
+            self._close()
+            os.replace(self.log_path, f"{self.log_path}.1")
+            self._log = open(self.log_path, "a", encoding="utf-8", buffering=1)
+        self._log.write(line)
+
+    def _close(self):
+        if self._log is not None:
+            try:
+                self._log.close()
+            except OSError:
+                pass
+            self._log = None
+
+    @contextmanager
+    def stage(self, name, **fields):
+        """
+        Time a workflow stage
+
+        Args:
+            name (str): The stage name, e.g. "ingest" or "plan"
+            **fields: Extra data stored with the event
+
+        Yields:
+            dict: The extra fields, which the stage may add to
+        """
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        error = None
+        try:
+            yield fields
+        except Exception as e:
+            # Control-flow exceptions such as Streamlit reruns are not errors
+            error = type(e).__name__
+            raise
+        finally:
+            memory = {}
+            if self.trace_memory:
+                memory["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            memory["process_peak_rss_mb"] = _peak_rss_mb()
+            self.record("stage", stage=name, seconds=time.perf_counter() - started, error=error,
+                        **memory, **fields)
+
+    def summary(self):
+        """
+        Aggregate the recorded events
+
+        Returns:
+            dict: "stages" maps stage names to count, mean/max seconds and the
+                process's lifetime peak RSS after the stage's last run; "llm"
+                holds call counts, latency percentiles, token totals
+                (context_tokens are prompt tokens read from a cached context),
+                retries, cache hits and coalesced calls; "startup" is the
+                startup event of this process, if recorded
+        """
+        with self._lock:
+            events = list(self.events)
+
+        stages = {}
+        for event in (e for e in events if e["kind"] == "stage"):
+            entry = stages.setdefault(event["stage"], {"count": 0, "seconds": [], "process_peak_rss_mb": None})
+            entry["count"] += 1
+            entry["seconds"].append(event["seconds"])
+            entry["process_peak_rss_mb"] = event.get("process_peak_rss_mb")
+        for entry in stages.values():
+            seconds = entry.pop("seconds")
+            entry["mean_seconds"] = statistics.mean(seconds)
+            entry["max_seconds"] = max(seconds)
+
+        calls = [e for e in events if e["kind"] == "llm_call"]
+        network = [e for e in calls if not e.get("cached") and not e.get("coalesced")]
+        latencies = [e["latency"] for e in network if e.get("latency") is not None]
+        by_persona = {}
+        for event in calls:
+            entry = by_persona.setdefault(event.get("persona"), {"calls": 0, "cached": 0, "prompt_tokens": 0,
+                                                                  "output_tokens": 0})
+            entry["calls"] += 1
+            entry["cached"] += 1 if event.get("cached") else 0
+            entry["prompt_tokens"] += event.get("prompt_tokens") or 0
+            entry["output_tokens"] += event.get("output_tokens") or 0
+        llm = {
+            "calls": len(calls),
+            "cached": sum(1 for e in calls if e.get("cached")),
+            "coalesced": sum(1 for e in calls if e.get("coalesced")),
+            "errors": sum(1 for e in calls if e.get("error")),
+            "retries": sum(e.get("retries") or 0 for e in calls),
+            "prompt_tokens": sum(e.get("prompt_tokens") or 0 for e in network),
+            "output_tokens": sum(e.get("output_tokens") or 0 for e in network),
+            "context_tokens": sum(e.get("context_tokens") or 0 for e in network),
+            "latency_p50": _percentile(latencies, 50),
+            "latency_p95": _percentile(latencies, 95),
+            "by_persona": by_persona
+        }
+        return {"stages": stages, "llm": llm, "startup": self.startup}
+
+    def recent(self, kind=None, limit=20):
+        with self._lock:
+            events = [e for e in self.events if kind is None or e["kind"] == kind]
+        return events[-limit:]
+
+# Process-wide recorder shared by all sessions
+_recorder = MetricsRecorder()
+
+# Function to get the shared metrics recorder
+def get_metrics():
+    return _recorder
+
+# Function to time a workflow stage with the shared recorder
+def stage_timer(name, **fields):
+    return _recorder.stage(name, **fields)
+
+# Modules that dominate import time; startup events note which ones were loaded
+HEAVY_MODULES = ("pandas", "numpy", "pyarrow", "google.generativeai")
+
+# Function to record how long the app took to load and render, once per process
+def record_startup(import_seconds, render_seconds):
+    """
+    Record the cost of the app's first run in this process
+
+    Later runs (Streamlit reruns) reuse the imported modules and are not
+    recorded.
+
+    Args:
+        import_seconds (float): Seconds spent importing the app's modules
+        render_seconds (float): Seconds from the start of the script to the end of the first render
+
+    Returns:
+        dict: The recorded event, or None if startup was already recorded
+    """
+    if _recorder.startup is not None:
+        return None
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    _recorder.startup = _recorder.record("startup", import_seconds=import_seconds, render_seconds=render_seconds,
+                                         heavy_modules=loaded)
+    return _recorder.startup
+
+# Function to record one LLM call with the shared recorder
+def record_llm_call(persona, model, latency, prompt_tokens=None, output_tokens=None, retries=0,
+                    cached=False, stream=False, error=None, first_token_latency=None, coalesced=False,
+                    context_tokens=None):
+    """
+    Record an LLM call
+
+    Args:
+        persona (str): The persona used
+        model (str): The model name
+        latency (float): Seconds until the full response was available
+        prompt_tokens (int): Input tokens reported by the API
+        output_tokens (int): Output tokens reported by the API
+        retries (int): How many times the request was retried
+        cached (bool): Whether the response came from the response cache
+        stream (bool): Whether the response was streamed
+        error (str): The error message if the call failed
+        first_token_latency (float): Seconds until the first streamed chunk arrived
+        coalesced (bool): Whether the call waited for an identical request already in flight
+        context_tokens (int): Prompt tokens read from a cached context, as reported by the API
+    """
+    return _recorder.record("llm_call", persona=persona, model=model, latency=latency,
+                            prompt_tokens=prompt_tokens, output_tokens=output_tokens, retries=retries,
+                            cached=cached, stream=stream, error=error, first_token_latency=first_token_latency,
+                            coalesced=coalesced, context_tokens=context_tokens)
+
+# Function to read token counts from a Gemini response
+def usage_tokens(response):
+    """
+    Get the token counts from a response's usage_metadata
+
+    Args:
+        response: A Gemini response or stream chunk
+
+    Returns:
+        int: Prompt tokens, or None if not reported
+        int: Output tokens, or None if not reported
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None, None
+    return getattr(usage, "prompt_token_count", None), getattr(usage, "candidates_token_count", None)
+
+# Function to read the cached context token count from a Gemini response
+def cached_context_tokens(response):
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "cached_content_token_count", None) or None
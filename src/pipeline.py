@@ -0,0 +1,600 @@
+import os
+import re
+import json
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from src.utils import generate_gemini_response, generate_gemini_response_async, load_csv_file
+from src.metrics import stage_timer
+from src.executor import execute_analysis_code, extract_python_code, format_execution_result
+from src.prompts import (build_analyst_prompt, build_associate_prompt, build_interpretation_prompt,
+                         build_manager_prompt, build_project_context, build_report_prompt, build_review_prompt,
+                         build_task_prompt)
+from src.report import REPORT_EMBED_CHARTS, render_report_html, report_figures
+from src.dataset_registry import SessionDatasets
+from src.sampling import get_prompt_sample
+from src.sketches import describe_join_graph, get_join_graph
+from src.stats import STATS_SUMMARY_ITEMS, describe_dataset_statistics
+from src.retrieval import RetrievalIndex
+
+logger = logging.getLogger(__name__)
+
+# Batch run settings
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", 4))
+BATCH_MAX_TASKS = int(os.getenv("BATCH_MAX_TASKS", 3))
+# Most analysis tasks in progress at once when several are run together
+ANALYSIS_MAX_CONCURRENCY = int(os.getenv("ANALYSIS_MAX_CONCURRENCY", 3))
+
+# A numbered or bulleted list item, e.g. "2. Compute ..." or "- Compute ..."
+_LIST_ITEM = re.compile(r"^\s*(?:\d+[.)]|[-*•])\s+(.+)$")
+
+# Function to pick out the analysis tasks listed in the Associate's guidance
+def parse_analysis_tasks(guidance, max_tasks=BATCH_MAX_TASKS):
+    """
+    Extract the next analysis tasks from the Associate's guidance
+
+    The guidance usually ends with a list of tasks for the Analyst, so the
+    list items after the last line mentioning tasks are preferred; if there
+    are none, every list item in the guidance is used.
+
+    Args:
+        guidance (str): The Associate's guidance
+        max_tasks (int): The most tasks to return
+
+    Returns:
+        list: The task descriptions
+    """
+    lines = (guidance or "").splitlines()
+    start = 0
+    for i, line in enumerate(lines):
+        if "task" in line.lower() and not _LIST_ITEM.match(line):
+            start = i + 1
+    tasks = []
+    for candidates in (lines[start:], lines):
+        matches = (_LIST_ITEM.match(line) for line in candidates)
+        tasks = [match.group(1).replace("**", "").strip(" '\"") for match in matches if match]
+        # Skip very short items such as bare labels
+        tasks = [task for task in tasks if len(task) > 10]
+        if tasks:
+            break
+    return tasks[:max_tasks]
+
+# Function to pick the file a task is mainly about: the one whose name and
+# columns the task mentions most, or the first file
+def pick_primary_file(task, data_profiles):
+    text = task.lower()
+    best, best_score = None, -1
+    for file_name, profile in data_profiles.items():
+        score = sum(1 for col in profile["columns"] if len(str(col)) >= 3 and str(col).lower() in text)
+        if os.path.splitext(file_name)[0].lower() in text:
+            score += 2
+        if score > best_score:
+            best, best_score = file_name, score
+    return best
+
+# Function to build the Analyst's prompt for a task on the uploaded data
+def prepare_task_prompt(problem_statement, task, dataframes, data_profiles, previous_tasks=None, context=None):
+    """
+    Build the prompt for an analysis task
+
+    The task runs with the file it mentions most as `df`; every other file is
+    described too, with the likely join keys between files, so tasks can
+    combine them.
+
+    Args:
+        problem_statement (str): The user's problem statement
+        task (str): The analysis task
+        dataframes (dict): Maps file names to DataFrames
+        data_profiles (dict): Maps file names to data profiles
+        previous_tasks (list): The tasks already performed, if any
+        context (str): The project context from build_project_context, if any
+
+    Returns:
+        str: The prompt
+        str: The file the task runs on
+    """
+    file_name = pick_primary_file(task, data_profiles)
+    df = dataframes[file_name]
+    # Drawn from the sample stored at ingestion and cached, so this costs nothing per task
+    data_sample, sample_description = get_prompt_sample(df, data_profiles[file_name])
+    other_files = []
+    for name, profile in data_profiles.items():
+        if name != file_name:
+            sample, description = get_prompt_sample(dataframes[name], profile)
+            other_files.append({"name": name, "rows": profile["shape"][0], "profile": profile,
+                                "sample": sample, "sample_description": description})
+    # Compares the column sketches stored at ingestion, never the data
+    join_graph = describe_join_graph(get_join_graph(dataframes, data_profiles))
+    # Computed once per dataset on the full data, then kept with the dataset cache
+    statistics = describe_dataset_statistics({file_name: df}, {file_name: data_profiles[file_name]}, task)
+    prompt, _ = build_task_prompt(problem_statement, task, file_name, data_sample, len(df),
+                                  data_profiles[file_name], previous_tasks=previous_tasks,
+                                  sample_description=sample_description, other_files=other_files,
+                                  join_graph=join_graph, statistics=statistics.get(file_name), context=context)
+    return prompt, file_name
+
+# Function to run the code from an Analyst response and have the Analyst interpret the output
+def execute_analysis_task(problem_statement, task, analysis_response, dataframes, data_profiles, file_name,
+                          generate=generate_gemini_response, context=None):
+    """
+    Run the code in an Analyst response on the full data and interpret the output
+
+    Args:
+        problem_statement (str): The user's problem statement
+        task (str): The analysis task
+        analysis_response (str): The Analyst's response with a ```python block
+        dataframes (dict): Maps file names to DataFrames
+        data_profiles (dict): Maps file names to data profiles
+        file_name (str): The file bound to `df`
+        generate (callable): Called as generate(prompt, persona=...) to get the interpretation
+        context (str): The project context from build_project_context, if any
+
+    Returns:
+        dict: The analysis result entry with "task", "result", "code" and "execution"
+    """
+    code = extract_python_code(analysis_response)
+    if code is None:
+        return {"task": task, "result": analysis_response, "code": None, "execution": None}
+
+    execution = execute_analysis_code(code, dataframes, data_profiles, primary=file_name)
+    interpretation_prompt, _ = build_interpretation_prompt(problem_statement, task, analysis_response,
+                                                           format_execution_result(execution), context=context)
+    interpretation = generate(interpretation_prompt, persona="analyst")
+    result = analysis_response
+    if interpretation:
+        result += f"\n\n### Results (computed on the full data)\n\n{interpretation}"
+    return {"task": task, "result": result, "code": code, "execution": execution}
+
+# Function to run several analysis tasks at the same time
+async def run_analysis_tasks(problem_statement, tasks, dataframes, data_profiles, previous_tasks=None,
+                             on_result=None, max_concurrency=ANALYSIS_MAX_CONCURRENCY,
+                             generate=generate_gemini_response, generate_async=generate_gemini_response_async,
+                             context=None):
+    """
+    Run analysis tasks concurrently, handing over each result as soon as it is ready
+
+    Every task builds its prompt, gets the Analyst's code, runs it and has the
+    output interpreted; blocking steps run on worker threads, and at most
+    max_concurrency tasks are in progress at once. Requests still share the
+    process-wide rate limit and response cache, so a batch takes about as
+    long as its slowest task when the quota allows.
+
+    Args:
+        problem_statement (str): The user's problem statement
+        tasks (list): The analysis tasks
+        dataframes (dict): Maps file names to DataFrames
+        data_profiles (dict): Maps file names to data profiles
+        previous_tasks (list): The tasks performed before this batch, if any
+        on_result (callable): Called as on_result(task, entry, error) on the event
+            loop's thread as each task finishes, with either the analysis result
+            entry or the exception that stopped the task
+        max_concurrency (int): The most tasks in progress at once
+        generate (callable): Called as generate(prompt, persona=...) on a worker
+            thread to get the interpretation of the executed code
+        generate_async (callable): Awaited as generate_async(prompt, persona=...)
+            to get the Analyst's approach and code
+        context (str): The project context from build_project_context, if any
+
+    Returns:
+        list: The result entries of the tasks that succeeded, in the order they finished
+    """
+    semaphore = asyncio.Semaphore(max(max_concurrency, 1))
+
+    async def run(task):
+        try:
+            async with semaphore:
+                prompt, file_name = await asyncio.to_thread(prepare_task_prompt, problem_statement, task,
+                                                            dataframes, data_profiles, previous_tasks, context)
+                analysis_response = await generate_async(prompt, persona="analyst")
+                entry = await asyncio.to_thread(execute_analysis_task, problem_statement, task, analysis_response,
+                                                dataframes, data_profiles, file_name, generate, context)
+            return task, entry, None
+        except Exception as e:
+            return task, None, e
+
+    entries = []
+    for finished in asyncio.as_completed([run(task) for task in tasks]):
+        task, entry, error = await finished
+        if entry is not None:
+            entries.append(entry)
+        if on_result is not None:
+            on_result(task, entry, error)
+    return entries
+
+# The Manager -> Analyst -> Associate -> execution -> report workflow without a UI
+class AnalysisProject:
+    """
+    One analysis project run end to end without Streamlit
+
+    Each step stores its output on the project and is skipped when that
+    output already exists, so a project restored with from_state continues
+    where it stopped. LLM errors are raised rather than shown.
+    """
+
+    def __init__(self, name, problem_statement, data_context="", dataframes=None, data_profiles=None,
+                 generate=generate_gemini_response):
+        self.name = name
+        self.problem_statement = problem_statement
+        self.data_context = data_context or ""
+        self.dataframes = dataframes or {}
+        self.data_profiles = data_profiles or {}
+        self.generate = generate
+        self.manager_plan = None
+        self.analyst_summary = None
+        self.associate_guidance = None
+        self.analysis_results = []
+        self.associate_review = None
+        self.final_report = None
+        self.conversation_history = []
+        self.context_index = RetrievalIndex()
+
+    def add_to_conversation(self, role, content):
+        self.conversation_history.append({"role": role, "content": content})
+
+    def plan(self):
+        if self.manager_plan is None:
+            prompt, _ = build_manager_prompt(self.problem_statement, self.data_context, self.data_profiles)
+            self.manager_plan = self.generate(prompt, persona="manager")
+            self.add_to_conversation("manager", self.manager_plan)
+        return self.manager_plan
+
+    def summarize(self):
+        if self.analyst_summary is None:
+            statistics = describe_dataset_statistics(self.dataframes, self.data_profiles,
+                                                     limit=STATS_SUMMARY_ITEMS)
+            prompt, _ = build_analyst_prompt(self.problem_statement, self.manager_plan, self.data_profiles,
+                                             statistics=statistics)
+            self.analyst_summary = self.generate(prompt, persona="analyst")
+            self.add_to_conversation("analyst", self.analyst_summary)
+        return self.analyst_summary
+
+    def project_context(self):
+        """
+        Get the context shared by the prompts after the data summary
+
+        Returns:
+            str: The project context, or None before the data summary or when context caching is disabled
+        """
+        return build_project_context(self.problem_statement, self.data_profiles, self.manager_plan,
+                                     self.analyst_summary)
+
+    def guide(self):
+        if self.associate_guidance is None:
+            prompt, _ = build_associate_prompt(self.problem_statement, self.manager_plan, self.analyst_summary,
+                                               context=self.project_context())
+            self.associate_guidance = self.generate(prompt, persona="associate")
+            self.add_to_conversation("associate", self.associate_guidance)
+        return self.associate_guidance
+
+    def run_task(self, task):
+        """
+        Have the Analyst write code for a task, run it and interpret the output
+
+        Args:
+            task (str): The analysis task
+
+        Returns:
+            dict: The analysis result entry
+        """
+        previous_tasks = [result["task"] for result in self.analysis_results]
+        context = self.project_context()
+        prompt, file_name = prepare_task_prompt(self.problem_statement, task, self.dataframes,
+                                                self.data_profiles, previous_tasks=previous_tasks, context=context)
+        analysis_response = self.generate(prompt, persona="analyst")
+        entry = execute_analysis_task(self.problem_statement, task, analysis_response, self.dataframes,
+                                      self.data_profiles, file_name, generate=self.generate, context=context)
+        self.analysis_results.append(entry)
+        self.add_to_conversation("analyst", f"Task: {task}\n\n{entry['result']}")
+        return entry
+
+    def run_tasks(self, tasks, max_concurrency=ANALYSIS_MAX_CONCURRENCY, on_result=None):
+        """
+        Run several analysis tasks at the same time
+
+        Results are added as the tasks finish. A failed task does not stop the
+        others; the first error is raised once they are all done.
+
+        Args:
+            tasks (list): The analysis tasks
+            max_concurrency (int): The most tasks in progress at once
+            on_result (callable): Called with each task's result entry as it is added
+
+        Returns:
+            list: The result entries, in the order they finished
+        """
+        previous_tasks = [result["task"] for result in self.analysis_results]
+        errors = []
+
+        def add_result(task, entry, error):
+            if error is not None:
+                logger.warning("Analysis task %r of project %s failed: %s", task, self.name, error)
+                errors.append(error)
+                return
+            self.analysis_results.append(entry)
+            self.add_to_conversation("analyst", f"Task: {task}\n\n{entry['result']}")
+            if on_result is not None:
+                on_result(entry)
+
+        async def generate_async(prompt, persona):
+            return await asyncio.to_thread(self.generate, prompt, persona=persona)
+
+        entries = asyncio.run(run_analysis_tasks(self.problem_statement, tasks, self.dataframes, self.data_profiles,
+                                                 previous_tasks, add_result, max_concurrency,
+                                                 generate=self.generate, generate_async=generate_async,
+                                                 context=self.project_context()))
+        if errors:
+            raise errors[0]
+        return entries
+
+    def review(self):
+        if self.associate_review is None:
+            prompt, _ = build_review_prompt(self.problem_statement, self.associate_guidance, self.analysis_results,
+                                            index=self.context_index, context=self.project_context())
+            self.associate_review = self.generate(prompt, persona="associate")
+            self.add_to_conversation("associate", self.associate_review)
+        return self.associate_review
+
+    def report(self):
+        if self.final_report is None:
+            prompt, _ = build_report_prompt(self.name, self.problem_statement, self.manager_plan,
+                                            self.analyst_summary, self.analysis_results, index=self.context_index,
+                                            context=self.project_context())
+            self.final_report = self.generate(prompt, persona="manager")
+            self.add_to_conversation("manager", self.final_report)
+        return self.final_report
+
+    def run(self, max_tasks=BATCH_MAX_TASKS, on_step=None):
+        """
+        Run every remaining step of the workflow
+
+        Args:
+            max_tasks (int): How many of the Associate's tasks to execute
+            on_step (callable): Called with the step name after each step, e.g. to save a checkpoint
+
+        Returns:
+            str: The final report
+        """
+        def step(name, fn, *args):
+            with stage_timer(name, project=self.name):
+                fn(*args)
+            if on_step is not None:
+                on_step(name)
+
+        step("plan", self.plan)
+        step("summary", self.summarize)
+        step("guidance", self.guide)
+        done = {result["task"] for result in self.analysis_results}
+        tasks = [task for task in parse_analysis_tasks(self.associate_guidance, max_tasks) if task not in done]
+        if tasks:
+            # Reported after every finished task, so a checkpoint keeps them if the batch is interrupted
+            on_result = (lambda entry: on_step("execution")) if on_step is not None else None
+            step("execution", self.run_tasks, tasks, ANALYSIS_MAX_CONCURRENCY, on_result)
+        # As in the app, the review needs at least two analyses to compare
+        if len(self.analysis_results) >= 2:
+            step("review", self.review)
+        step("report", self.report)
+        return self.final_report
+
+    def to_state(self):
+        """
+        Get the project's progress as JSON-serializable data
+
+        Datasets are not included; they are kept in the dataset cache.
+
+        Returns:
+            dict: The project state
+        """
+        return {
+            "name": self.name,
+            "problem_statement": self.problem_statement,
+            "data_context": self.data_context,
+            "dataset_keys": {name: profile.get("dataset_key") for name, profile in self.data_profiles.items()},
+            "manager_plan": self.manager_plan,
+            "analyst_summary": self.analyst_summary,
+            "associate_guidance": self.associate_guidance,
+            "analysis_results": self.analysis_results,
+            "associate_review": self.associate_review,
+            "final_report": self.final_report,
+            "conversation_history": self.conversation_history
+        }
+
+    @classmethod
+    def from_state(cls, state, dataframes, data_profiles, generate=generate_gemini_response):
+        """
+        Restore a project saved with to_state
+
+        Args:
+            state (dict): The saved state
+            dataframes (dict): Maps file names to DataFrames
+            data_profiles (dict): Maps file names to data profiles
+            generate (callable): The LLM call used for the remaining steps
+
+        Returns:
+            AnalysisProject: The restored project
+        """
+        project = cls(state["name"], state["problem_statement"], state.get("data_context", ""),
+                      dataframes, data_profiles, generate=generate)
+        for key in ("manager_plan", "analyst_summary", "associate_guidance", "associate_review", "final_report"):
+            setattr(project, key, state.get(key))
+        project.analysis_results = state.get("analysis_results", [])
+        project.conversation_history = state.get("conversation_history", [])
+        return project
+
+# Function to read an optional text file
+def _read_text(path):
+    if not os.path.isfile(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return f.read().strip() or None
+
+# Function to find the projects in a batch input directory
+def discover_projects(input_dir, default_problem=None):
+    """
+    Find the projects to run in a directory
+
+    Every subdirectory containing CSV files is a project named after it, with
+    its problem statement in problem.txt and optional data context in
+    context.txt. A CSV file directly in the directory is a single-file
+    project whose problem statement is in a .txt file with the same name.
+    Names must be unique because each project has its own output directory,
+    so when a directory and a file share one (e.g. sales/ and sales.csv),
+    the later one in name order gets a numbered suffix ("sales-2").
+
+    Args:
+        input_dir (str): The directory to scan
+        default_problem (str): The problem statement for projects without one
+
+    Returns:
+        list: Project specs (dicts with name, files, problem_statement, data_context)
+    """
+    projects = []
+    for entry in sorted(os.scandir(input_dir), key=lambda entry: entry.name):
+        if entry.is_dir():
+            files = sorted(os.path.join(entry.path, name) for name in os.listdir(entry.path)
+                           if name.lower().endswith(".csv"))
+            if not files:
+                continue
+            problem = _read_text(os.path.join(entry.path, "problem.txt"))
+            context = _read_text(os.path.join(entry.path, "context.txt"))
+            name = entry.name
+        elif entry.name.lower().endswith(".csv"):
+            files = [entry.path]
+            base = entry.path[:-len(".csv")]
+            problem = _read_text(base + ".txt")
+            context = None
+            name = os.path.basename(base)
+        else:
+            continue
+        projects.append({"name": name, "files": files, "problem_statement": problem or default_problem,
+                         "data_context": context or ""})
+
+    taken = {spec["name"] for spec in projects}
+    seen = set()
+    for spec in projects:
+        if spec["name"] in seen:
+            number = 2
+            while f"{spec['name']}-{number}" in taken:
+                number += 1
+            renamed = f"{spec['name']}-{number}"
+            logger.warning("Two projects are named %s; running %s as %s", spec["name"], spec["files"], renamed)
+            spec["name"] = renamed
+            taken.add(renamed)
+        seen.add(spec["name"])
+    return projects
+
+# Function to write a file so readers never see a partial version
+def _write_atomic(path, text):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+# Function to run one project of a batch, resuming from its saved state
+def run_project(spec, output_dir, max_tasks=BATCH_MAX_TASKS, force=False):
+    """
+    Run a project end to end and write its report
+
+    Progress is saved to state.json in the project's output directory after
+    every step, so a failed or interrupted project continues from its last
+    completed step when it is run again.
+
+    Args:
+        spec (dict): The project spec from discover_projects
+        output_dir (str): The batch output directory
+        max_tasks (int): How many of the Associate's tasks to execute
+        force (bool): Start over even if the project was completed before
+
+    Returns:
+        dict: The project status: name, status ("done", "skipped" or "failed"),
+            the report paths and the error message if it failed
+    """
+    project_dir = os.path.join(output_dir, spec["name"])
+    state_path = os.path.join(project_dir, "state.json")
+    status = {"name": spec["name"], "status": "done", "error": None,
+              "report_md": os.path.join(project_dir, "report.md"),
+              "report_html": os.path.join(project_dir, "report.html")}
+    dataframes = SessionDatasets()
+    try:
+        state = None
+        if os.path.exists(state_path) and not force:
+            with open(state_path, encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("final_report") and os.path.exists(status["report_md"]):
+                status["status"] = "skipped"
+                return status
+        if not spec.get("problem_statement"):
+            raise ValueError("No problem statement found")
+        os.makedirs(project_dir, exist_ok=True)
+
+        # Files parsed before are memory-mapped from the dataset cache, and projects
+        # that share a file share one frame
+        data_profiles = {}
+        with stage_timer("ingest", project=spec["name"]):
+            for path in spec["files"]:
+                with open(path, "rb") as f:
+                    df, profile = load_csv_file(f)
+                _, data_profiles[os.path.basename(path)] = dataframes.add(os.path.basename(path), df, profile)
+
+        if state is not None:
+            project = AnalysisProject.from_state(state, dataframes, data_profiles)
+        else:
+            project = AnalysisProject(spec["name"], spec["problem_statement"], spec.get("data_context"),
+                                      dataframes, data_profiles)
+
+        def save_state(step):
+            _write_atomic(state_path, json.dumps(project.to_state(), default=str))
+
+        report = project.run(max_tasks=max_tasks, on_step=save_state)
+        _write_atomic(status["report_md"], report)
+        figures = report_figures(project.analysis_results) if REPORT_EMBED_CHARTS else None
+        _write_atomic(status["report_html"], render_report_html(project.name, report, figures))
+    except Exception as e:
+        logger.exception("Project %s failed", spec["name"])
+        status.update(status="failed", error=str(e))
+    finally:
+        dataframes.release()
+    return status
+
+# Function to run many projects concurrently
+def run_batch(projects, output_dir, max_workers=BATCH_MAX_WORKERS, max_tasks=BATCH_MAX_TASKS, force=False,
+              progress_callback=None):
+    """
+    Run projects concurrently and write their reports and a summary
+
+    Projects run in threads of one process, so they share the response
+    cache, the API rate limit and request coalescing. The status of every
+    project is written to summary.json in the output directory.
+
+    Args:
+        projects (list): Project specs from discover_projects
+        output_dir (str): Where each project's state and reports are written
+        max_workers (int): The number of projects run at the same time
+        max_tasks (int): How many of the Associate's tasks to execute per project
+        force (bool): Rerun projects that were completed before
+        progress_callback (callable): Called as progress_callback(status, done, total)
+            after each project finishes
+
+    Returns:
+        list: The status of each project, in input order
+
+    Raises:
+        ValueError: If two projects have the same name, and so the same output directory
+    """
+    names = [spec["name"] for spec in projects]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Project names must be unique; duplicated: {', '.join(duplicates)}")
+    os.makedirs(output_dir, exist_ok=True)
+    statuses = {}
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1), thread_name_prefix="batch") as pool:
+        futures = {pool.submit(run_project, spec, output_dir, max_tasks, force): i for i, spec in enumerate(projects)}
+        for future in as_completed(futures):
+            status = future.result()
+            statuses[futures[future]] = status
+            if progress_callback is not None:
+                progress_callback(status, len(statuses), len(projects))
+
+    summary = [statuses[i] for i in range(len(projects))]
+    _write_atomic(os.path.join(output_dir, "summary.json"), json.dumps(summary, indent=2))
+    return summary
@@ -0,0 +1,122 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.utils import generate_gemini_response
+from src.metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Background generation settings. Prefetching spends API quota on steps the
+# user may never open, so it can be turned off.
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() in ("1", "true", "yes")
+PREFETCH_MAX_WORKERS = int(os.getenv("PREFETCH_MAX_WORKERS", 4))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Function to get the thread pool shared by all sessions' prefetches
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PREFETCH_MAX_WORKERS, thread_name_prefix="prefetch")
+        return _executor
+
+# Generates the next workflow steps of one session in the background
+class Prefetcher:
+    """
+    Speculatively generate upcoming persona responses
+
+    Each task is named after the step it prepares (e.g. "summary") and keyed
+    on its persona and prompt, which are built from the step's inputs.
+    Results land in the response cache, so when the user reaches the step,
+    get_gemini_response finds the response there or joins the request still
+    in flight. Scheduling a task with a different prompt under the same name
+    cancels the outdated one (a request already sent still completes, but
+    its follow-up tasks are not started).
+    """
+
+    def __init__(self, enabled=PREFETCH_ENABLED):
+        self.enabled = enabled
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def schedule(self, name, prompt, persona, then=None):
+        """
+        Start generating a response in the background unless it is already scheduled
+
+        Args:
+            name (str): The step the response is for
+            prompt (str): The prompt to send
+            persona (str): The persona to use
+            then (callable): Called with the response text when it is ready and
+                still current, e.g. to prefetch the following step
+
+        Returns:
+            Future: The task, or None if prefetching is disabled
+        """
+        if not self.enabled:
+            return None
+        key = (persona, prompt)
+        with self._lock:
+            current = self._tasks.get(name)
+            if current is not None and current[0] == key:
+                return current[1]
+            if current is not None:
+                current[1].cancel()
+            future = _get_executor().submit(self._run, name, key, then)
+            self._tasks[name] = (key, future)
+        return future
+
+    def _run(self, name, key, then):
+        persona, prompt = key
+        try:
+            with stage_timer("prefetch", step=name, persona=persona):
+                text = generate_gemini_response(prompt, persona=persona)
+        except Exception as e:
+            # The step generates the response itself (and reports the error) when the user reaches it
+            logger.warning("Prefetching %s failed: %s", name, e)
+            raise
+        if then is not None and self.is_current(name, key):
+            then(text)
+        return text
+
+    def is_current(self, name, key):
+        with self._lock:
+            current = self._tasks.get(name)
+            return current is not None and current[0] == key
+
+    def invalidate(self, *names):
+        """
+        Cancel and forget tasks whose inputs have changed
+
+        Args:
+            *names (str): The steps to invalidate (all of them if none are given)
+        """
+        with self._lock:
+            for name in names or list(self._tasks):
+                task = self._tasks.pop(name, None)
+                if task is not None:
+                    task[1].cancel()
+
+    def status(self):
+        """
+        Describe the scheduled tasks
+
+        Returns:
+            dict: Maps step names to "pending", "running", "done", "failed" or "cancelled"
+        """
+        with self._lock:
+            tasks = dict(self._tasks)
+        status = {}
+        for name, (_, future) in tasks.items():
+            if future.cancelled():
+                status[name] = "cancelled"
+            elif future.running():
+                status[name] = "running"
+            elif not future.done():
+                status[name] = "pending"
+            else:
+                status[name] = "failed" if future.exception() is not None else "done"
+        return status
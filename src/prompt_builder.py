@@ -0,0 +1,263 @@
+import os
+import re
+import math
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Default number of tokens a single prompt may use
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 30_000))
+# Column names listed per dtype group before the rest are summarized as "+N more"
+PROMPT_MAX_COLUMN_NAMES = int(os.getenv("PROMPT_MAX_COLUMN_NAMES", 40))
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Function to estimate the number of tokens in a text
+def count_tokens(text):
+    """
+    Estimate the number of LLM tokens in a text without calling the API
+
+    Words count as one token per four characters (at least one), and every
+    punctuation character counts as one token, which tracks SentencePiece
+    tokenizers closely enough for budgeting.
+
+    Args:
+        text (str): The text to measure
+
+    Returns:
+        int: The estimated token count
+    """
+    if not text:
+        return 0
+    return sum(max(1, math.ceil(len(piece) / 4)) for piece in _TOKEN_PATTERN.findall(text))
+
+# Raised when the required sections of a prompt cannot fit its token budget
+class PromptBudgetError(ValueError):
+    pass
+
+# Function to cut a text down to a token budget, keeping whole lines
+def truncate_to_tokens(text, max_tokens, min_lines=0):
+    """
+    Keep the leading lines of a text that fit in a token budget
+
+    Args:
+        text (str): The text to shorten
+        max_tokens (int): The token budget
+        min_lines (int): Leading lines kept even if they do not fit
+
+    Returns:
+        str: The shortened text, ending with a note when lines were dropped
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    note = "... (truncated to fit the prompt budget)"
+    budget = max_tokens - count_tokens(note)
+    kept, used = [], 0
+    for line in text.split("\n"):
+        tokens = count_tokens(line)
+        if used + tokens > budget and len(kept) >= min_lines:
+            break
+        kept.append(line)
+        used += tokens
+    return "\n".join(kept + [note]) if kept or budget > 0 else ""
+
+# Shorten a list of names to at most max_names, noting how many were left out
+def _name_list(names, max_names):
+    names = [str(name) for name in names]
+    if len(names) <= max_names:
+        return ", ".join(names)
+    return ", ".join(names[:max_names]) + f" (+{len(names) - max_names} more)"
+
+# Function to list columns compactly, grouped by dtype
+def compact_column_list(profile, max_names=PROMPT_MAX_COLUMN_NAMES):
+    """
+    Describe the columns of a profile grouped by dtype
+
+    Args:
+        profile (dict): The data profile
+        max_names (int): Column names listed per dtype before the rest are counted
+
+    Returns:
+        str: One line per dtype, e.g. "float64 (120): a, b, c (+117 more)"
+    """
+    groups = defaultdict(list)
+    for col in profile["columns"]:
+        groups[profile["dtypes"][col]].append(col)
+    return "\n".join(f"- {dtype} ({len(cols)}): {_name_list(cols, max_names)}"
+                     for dtype, cols in sorted(groups.items(), key=lambda item: -len(item[1])))
+
+# Bucket a value by sign and order of magnitude so similar columns share a key
+def _magnitude(value):
+    if value is None or value != value:
+        return "nan"
+    if value == 0:
+        return "0"
+    return f"{'-' if value < 0 else '+'}{math.floor(math.log10(abs(value)))}"
+
+# Function to summarize a data profile compactly for wide datasets
+def compact_profile_summary(profile, max_names=PROMPT_MAX_COLUMN_NAMES):
+    """
+    Summarize a data profile with similar columns collapsed into one line
+
+    Columns are grouped by dtype, share of missing values (rounded to 5%) and,
+    for numeric columns, the sign and order of magnitude of their min and max.
+    Each group is reported once with the range of its statistics, so the
+    summary grows with the number of distinct column shapes rather than with
+    the number of columns.
+
+    Args:
+        profile (dict): The data profile
+        max_names (int): Column names listed per group before the rest are counted
+
+    Returns:
+        str: A text summary of the data profile
+    """
+    if not profile:
+        return "No data profile available."
+
+    rows = profile["shape"][0]
+    groups = defaultdict(list)
+    for col in profile["columns"]:
+        missing_pct = (profile["missing_values"].get(col, 0) / rows * 100) if rows else 0.0
+        stats = profile["numeric_summary"].get(col)
+        shape = (_magnitude(stats["min"]), _magnitude(stats["max"])) if stats else ()
+        groups[(profile["dtypes"][col], round(missing_pct / 5) * 5, shape)].append((col, missing_pct, stats))
+
+    lines = [f"Dimensions: {rows} rows × {profile['shape'][1]} columns",
+             f"Column groups ({len(groups)} groups of similar columns):"]
+    for (dtype, _, _), members in sorted(groups.items(), key=lambda item: -len(item[1])):
+        names = _name_list([col for col, _, _ in members], max_names)
+        missing = [pct for _, pct, _ in members]
+        line = f"- {dtype} × {len(members)}: {names}"
+        if max(missing) > 0:
+            line += f"; missing {min(missing):.1f}–{max(missing):.1f}%" if len(members) > 1 \
+                else f"; missing {missing[0]:.1f}%"
+        stats = [s for _, _, s in members if s]
+        if stats:
+            parts = []
+            for name in ("mean", "median", "min", "max"):
+                values = [s[name] for s in stats if s[name] == s[name]]
+                if not values:
+                    continue
+                low, high = min(values), max(values)
+                parts.append(f"{name}={low:.3g}" if low == high else f"{name}={low:.3g}..{high:.3g}")
+            line += "; " + ", ".join(parts)
+        lines.append(line)
+    return "\n".join(lines)
+
+# A prompt made of a context shared by many prompts and the text of one request
+class SplitPrompt(str):
+    """
+    Prompt text that starts with a shared context
+
+    The value is the full prompt, so a SplitPrompt can be used anywhere a
+    prompt string is; the LLM layer can instead send `context` once as
+    cached content and only `suffix` with each request.
+    """
+
+    def __new__(cls, context, suffix):
+        prompt = super().__new__(cls, f"{context}\n\n{suffix}")
+        prompt.context = context
+        prompt.suffix = suffix
+        return prompt
+
+# Assembles a prompt from prioritized sections under a token budget
+class PromptBuilder:
+    """
+    Build a prompt that fits a token budget
+
+    Sections are kept in the order they were added. When the prompt is too
+    long, sections are shrunk starting from the lowest priority: first by
+    switching to their compact alternative (if one was given), then by
+    truncating them line by line, and finally by dropping them. Required
+    sections are never dropped: they keep at least their heading and first
+    line, and if that alone does not fit the budget, build raises
+    PromptBudgetError.
+    """
+
+    def __init__(self, budget=None):
+        self.budget = PROMPT_TOKEN_BUDGET if budget is None else budget
+        self.sections = []
+
+    def add(self, name, text, priority=0, compact=None, required=False, heading=None):
+        """
+        Add a section to the prompt
+
+        Args:
+            name (str): The section name used in the usage report
+            text (str): The section text
+            priority (int): Higher priorities are shrunk last
+            compact (str): A shorter alternative used when the budget is tight
+            required (bool): Never drop the section, only truncate it down to its first line
+            heading (str): A heading written above the section text
+
+        Returns:
+            PromptBuilder: The builder, for chaining
+        """
+        self.sections.append({"name": name, "text": text or "", "compact": compact, "priority": priority,
+                              "required": required, "heading": heading})
+        return self
+
+    def _render(self, section, text):
+        if not text:
+            return ""
+        return f"{section['heading']}\n{text}" if section["heading"] else text
+
+    def build(self, context=None):
+        """
+        Assemble the prompt
+
+        Args:
+            context (str): A shared context the prompt starts with; it does not
+                count towards the budget
+
+        Returns:
+            str: The prompt text (a SplitPrompt if a context was given)
+            dict: Token usage with per-section counts ("sections"), the "total",
+                the "budget", the "context" tokens and which sections were
+                "compacted", "truncated" or "dropped"
+
+        Raises:
+            PromptBudgetError: If the required sections do not fit the budget
+                even when cut down to their first line
+        """
+        texts = [section["text"] for section in self.sections]
+        tokens = [count_tokens(self._render(section, text)) for section, text in zip(self.sections, texts)]
+        usage = {"compacted": [], "truncated": [], "dropped": []}
+
+        order = sorted(range(len(self.sections)), key=lambda i: self.sections[i]["priority"])
+        for i in order:
+            overflow = sum(tokens) - self.budget
+            if overflow <= 0:
+                break
+            section = self.sections[i]
+            if section["compact"] is not None and count_tokens(section["compact"]) < count_tokens(texts[i]):
+                texts[i] = section["compact"]
+                tokens[i] = count_tokens(self._render(section, texts[i]))
+                usage["compacted"].append(section["name"])
+                overflow = sum(tokens) - self.budget
+                if overflow <= 0:
+                    break
+            allowed = tokens[i] - overflow - count_tokens(section["heading"] or "")
+            if allowed > 0 or section["required"]:
+                texts[i] = truncate_to_tokens(texts[i], max(allowed, 0), min_lines=1 if section["required"] else 0)
+                usage["truncated"].append(section["name"])
+            else:
+                texts[i] = ""
+                usage["dropped"].append(section["name"])
+            tokens[i] = count_tokens(self._render(section, texts[i]))
+
+        if sum(tokens) > self.budget:
+            required = [section["name"] for section in self.sections if section["required"]]
+            raise PromptBudgetError(f"The required prompt sections ({', '.join(required)}) need {sum(tokens)} "
+                                    f"tokens even when shortened, over the budget of {self.budget}")
+
+        parts = [self._render(section, text) for section, text in zip(self.sections, texts)]
+        prompt = "\n\n".join(part for part in parts if part)
+        usage["sections"] = {section["name"]: count for section, count in zip(self.sections, tokens)}
+        usage["total"] = count_tokens(prompt)
+        usage["budget"] = self.budget
+        usage["context"] = count_tokens(context)
+        logger.info("Prompt assembled: %s", usage)
+        return (SplitPrompt(context, prompt) if context else prompt), usage
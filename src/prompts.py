@@ -0,0 +1,405 @@
+import json
+from src.prompt_builder import PromptBuilder, compact_column_list, compact_profile_summary
+from src.utils import generate_data_profile_summary
+from src.retrieval import RETRIEVAL_CONVERSATION_TOKENS, RETRIEVAL_RESULTS_TOKENS, RetrievalIndex
+from src.context_cache import CONTEXT_CACHE_ENABLED, CONTEXT_PREFIX_TOKENS
+
+# Section priorities: higher priorities are shrunk last when a prompt is over budget
+PRIORITY_INSTRUCTIONS = 100
+PRIORITY_PROBLEM = 90
+PRIORITY_PLAN = 60
+PRIORITY_CONTEXT = 50
+PRIORITY_DATA = 40
+
+# Function to describe the uploaded files in full and in compact form
+def _profile_sections(data_profiles):
+    full = ""
+    compact = ""
+    for file_name, profile in data_profiles.items():
+        full += f"\n## {file_name}\n{generate_data_profile_summary(profile)}\n"
+        compact += f"\n## {file_name}\n{compact_profile_summary(profile)}\n"
+    return full, compact
+
+# Function to build the project context shared by the prompts that follow the data summary
+def build_project_context(problem_statement, data_profiles, manager_plan, analyst_summary,
+                          budget=CONTEXT_PREFIX_TOKENS):
+    """
+    Build the context the Associate, task, question, review and report prompts start with
+
+    The context only changes when the plan or data summary is regenerated,
+    so the LLM layer registers it once as cached content and later requests
+    send only their own sections.
+
+    Args:
+        problem_statement (str): The user's problem statement
+        data_profiles (dict): Maps file names to data profiles
+        manager_plan (str): The Manager's analysis plan
+        analyst_summary (str): The Analyst's data summary
+        budget (int): The token budget of the context (defaults to CONTEXT_PREFIX_TOKENS)
+
+    Returns:
+        str: The context, or None if context caching is disabled or there is no data summary yet
+    """
+    if not CONTEXT_CACHE_ENABLED or not analyst_summary:
+        return None
+    full, compact = _profile_sections(data_profiles)
+    builder = PromptBuilder(budget)
+    builder.add("problem_statement", f"Problem Statement: {problem_statement}", PRIORITY_PROBLEM, required=True)
+    builder.add("manager_plan", manager_plan, PRIORITY_PLAN, heading="Manager's Analysis Plan:")
+    builder.add("analyst_summary", analyst_summary, PRIORITY_PLAN, heading="Analyst's Data Summary:")
+    builder.add("data_profiles", full, PRIORITY_DATA, compact=compact, heading="Data Profile Summary:")
+    return builder.build()[0]
+
+# Function to build the Manager's planning prompt
+def build_manager_prompt(problem_statement, data_context, data_profiles, budget=None):
+    """
+    Build the prompt for the Manager's analysis plan
+
+    Args:
+        problem_statement (str): The user's problem statement
+        data_context (str): The optional background on the data
+        data_profiles (dict): Maps file names to data profiles
+        budget (int): The token budget (defaults to PROMPT_TOKEN_BUDGET)
+
+    Returns:
+        str: The prompt
+        dict: The token usage report from PromptBuilder.build
+    """
+    file_info = ""
+    compact_info = ""
+    for file_name, profile in data_profiles.items():
+        dimensions = f"- Dimensions: {profile['shape'][0]} rows × {profile['shape'][1]} columns\n"
+        file_info += f"\nFile: {file_name}\n- Columns: {', '.join(map(str, profile['columns']))}\n{dimensions}"
+        compact_info += f"\nFile: {file_name}\n{dimensions}- Columns by type:\n{compact_column_list(profile)}\n"
+
+    builder = PromptBuilder(budget)
+    builder.add("problem_statement", f"Problem Statement: {problem_statement}", PRIORITY_PROBLEM, required=True)
+    builder.add("data_context", f"Data Context: {data_context}", PRIORITY_CONTEXT)
+    builder.add("data_files", file_info, PRIORITY_DATA, compact=compact_info, heading="Available Data Files:")
+    builder.add("instructions", """Based on this information, create a structured, step-by-step analytical plan.
+The plan should cover data understanding, cleaning (if likely needed),
+exploratory analysis, specific analyses relevant to the goal, and final synthesis.
+Output this plan as a numbered list.""", PRIORITY_INSTRUCTIONS, required=True)
+    return builder.build()
+
+# Function to build the Analyst's data understanding prompt
+def build_analyst_prompt(problem_statement, manager_plan, data_profiles, budget=None, statistics=None):
+    """
+    Build the prompt for the Analyst's data summary
+
+    Args:
+        problem_statement (str): The user's problem statement
+        manager_plan (str): The Manager's analysis plan
+        data_profiles (dict): Maps file names to data profiles
+        budget (int): The token budget (defaults to PROMPT_TOKEN_BUDGET)
+        statistics (dict): Maps file names to descriptions of their precomputed statistics
+
+    Returns:
+        str: The prompt
+        dict: The token usage report from PromptBuilder.build
+    """
+    full, compact = _profile_sections(data_profiles)
+    builder = PromptBuilder(budget)
+    builder.add("problem_statement", f"Problem Statement: {problem_statement}", PRIORITY_PROBLEM, required=True)
+    builder.add("manager_plan", manager_plan, PRIORITY_PLAN, heading="Manager's Analysis Plan:")
+    builder.add("data_profiles", full, PRIORITY_DATA, compact=compact, required=True,
+                heading="Data Profile Summary:")
+    if statistics:
+        builder.add("statistics", "".join(f"\n## {name}\n{text}\n" for name, text in statistics.items()),
+                    PRIORITY_DATA, heading="Precomputed Statistics (exact, from the full data):")
+    builder.add("instructions", """Based on this information, provide a comprehensive summary of the data.
+Explain the key characteristics, potential challenges, and initial observations
+that might be relevant to the analysis plan. Focus on data quality, completeness,
+and how well it aligns with the problem statement.""", PRIORITY_INSTRUCTIONS, required=True)
+    return builder.build()
+
+# Function to build the prompt for a user question about the data
+def build_question_prompt(problem_statement, data_profiles, analyst_summary, question, budget=None,
+                          conversation=None, index=None, context=None):
+    """
+    Build the prompt for answering a user's question about the data
+
+    Args:
+        problem_statement (str): The user's problem statement
+        data_profiles (dict): Maps file names to data profiles
+        analyst_summary (str): The Analyst's data summary
+        question (str): The user's question
+        budget (int): The token budget (defaults to PROMPT_TOKEN_BUDGET)
+        conversation: The conversation so far (a ConversationHistory or a list of
+            messages); the parts most relevant to the question are included
+        index (RetrievalIndex): The session's index, kept between prompts so only
+            new messages are indexed (a temporary one is used if not given)
+        context (str): The project context from build_project_context, which
+            replaces the problem statement, data profiles and data summary
+
+    Returns:
+        str: The prompt
+        dict: The token usage report from PromptBuilder.build
+    """
+    builder = PromptBuilder(budget)
+    if context is None:
+        full, compact = _profile_sections(data_profiles)
+        builder.add("problem_statement", f"Problem Statement: {problem_statement}", PRIORITY_PROBLEM, required=True)
+        builder.add("data_profiles", full, PRIORITY_DATA, compact=compact, heading="Data Profile Summary:")
+        builder.add("analyst_summary", analyst_summary, PRIORITY_PLAN, heading="Previous Analysis:")
+    if conversation is not None:
+        index = RetrievalIndex() if index is None else index
+        index.sync_conversation(conversation)
+        builder.add("conversation", index.context(question, RETRIEVAL_CONVERSATION_TOKENS, source="conversation"),
+                    PRIORITY_CONTEXT, heading="Relevant Earlier Conversation:")
+    builder.add("question", question, PRIORITY_INSTRUCTIONS, required=True, heading="User Question:")
+    builder.add("instructions", "Please provide a detailed answer to the user's question about the data.",
+                PRIORITY_INSTRUCTIONS, required=True)
+    return builder.build(context)
+
+# Function to build the Associate's guidance prompt
+def build_associate_prompt(problem_statement, manager_plan, analyst_summary, budget=None, context=None):
+    """
+    Build the prompt for the Associate's hypotheses and next analysis tasks
+
+    Args:
+        problem_statement (str): The user's problem statement
+        manager_plan (str): The Manager's analysis plan
+        analyst_summary (str): The Analyst's data summary
+        budget (int): The token budget (defaults to PROMPT_TOKEN_BUDGET)
+        context (str): The project context from build_project_context, which
+            replaces the problem statement, plan and data summary
+
+    Returns:
+        str: The prompt
+        dict: The token usage report from PromptBuilder.build
+    """
+    builder = PromptBuilder(budget)
+    if context is None:
+        builder.add("problem_statement", f"Problem Statement: {problem_statement}", PRIORITY_PROBLEM, required=True)
+        builder.add("manager_plan", manager_plan, PRIORITY_PLAN, heading="Manager's Analysis Plan:")
+        builder.add("analyst_summary", analyst_summary, PRIORITY_PLAN, heading="Analyst's Data Summary:")
+    builder.add("instructions", """Based on this information, refine the initial steps of the plan. Define specific
+hypotheses to test, identify potential edge cases or data quality issues to check
+based on the summary, and formulate a clear storyline for the initial exploration.
+
+Outline the exact next 2-3 analysis tasks for the Analyst (e.g., 'Calculate correlation
+matrix for numerical columns', 'Generate frequency counts for categorical columns X and Y',
+'Visualize distribution of column Z').""", PRIORITY_INSTRUCTIONS, required=True)
+    return builder.build(context)
+
+# Function to build the Analyst's prompt for one analysis task
+def build_task_prompt(problem_statement, task, file_name, data_sample, row_count, data_profile,
+                      previous_tasks=None, budget=None, sample_description="sampled rows", other_files=None,
+                      join_graph=None, statistics=None, context=None):
+    """
+    Build the prompt asking the Analyst for the approach and code of an analysis task
+
+    Args:
+        problem_statement (str): The user's problem statement
+        task (str): The analysis task to perform
+        file_name (str): The file the task runs on
+        data_sample (str): A sample of rows from the file as JSON lines
+        row_count (int): The number of rows the code will run on
+        data_profile (dict): The profile of the file
+        previous_tasks (list): The tasks already performed, if any
+        budget (int): The token budget (defaults to PROMPT_TOKEN_BUDGET)
+        sample_description (str): How the sample rows were chosen
+        other_files (list): The other uploaded files, as dicts with "name", "rows",
+            "profile", "sample" and "sample_description"
+        join_graph (str): The likely join keys between the files
+        statistics (str): The precomputed statistics of the file relevant to the task
+        context (str): The project context from build_project_context, which
+            replaces the problem statement
+
+    Returns:
+        str: The prompt
+        dict: The token usage report from PromptBuilder.build
+    """
+    builder = PromptBuilder(budget)
+    if context is None:
+        builder.add("problem_statement", f"Problem Statement: {problem_statement}", PRIORITY_PROBLEM, required=True)
+    if previous_tasks:
+        builder.add("previous_tasks", json.dumps(previous_tasks), PRIORITY_CONTEXT,
+                    heading="Previous Analysis Results:")
+    label = "New Analysis Task" if previous_tasks else "Analysis Task"
+    builder.add("task", f"{label}: {task}", PRIORITY_INSTRUCTIONS, required=True)
+    builder.add("data_sample", data_sample, PRIORITY_DATA, heading=f"Data Sample ({sample_description} from {file_name}):")
+    builder.add("columns", compact_column_list(data_profile), PRIORITY_DATA, required=True,
+                heading="Available Columns:")
+    if statistics:
+        builder.add("statistics", statistics, PRIORITY_DATA,
+                    heading=f"Precomputed Statistics (exact, from the full data of {file_name}):")
+    for other in other_files or []:
+        columns = compact_column_list(other["profile"])
+        builder.add(f"file:{other['name']}",
+                    f"{other['rows']} rows\nColumns:\n{columns}\n"
+                    f"Data Sample ({other['sample_description']}):\n{other['sample']}",
+                    PRIORITY_DATA, compact=f"{other['rows']} rows\nColumns:\n{columns}",
+                    heading=f"Other File: {other['name']}")
+    if join_graph:
+        builder.add("join_graph", join_graph, PRIORITY_CONTEXT,
+                    heading="Likely Join Keys Between Files (estimated from value overlap):")
+    combine = "\nTasks may combine files: join them with pd.merge on the keys above." if join_graph else ""
+    exact = "\nThe precomputed statistics above are exact and can guide the approach." if statistics else ""
+    builder.add("instructions", f"""The full data of {file_name} ({row_count} rows) is loaded as a pandas DataFrame
+named `df`, and every uploaded file is in the dict `dfs` keyed by file name.{combine}
+
+Please execute this analysis task. Provide:
+1. A clear explanation of the approach
+2. The Python code to run (using pandas) in a single ```python block. Assign
+   results to variables (DataFrames, Series or numbers) or print them.
+   Matplotlib figures are captured.
+
+Do not guess the results: the code will be run on the full data and you will
+be given its output to interpret.{exact}""", PRIORITY_INSTRUCTIONS, required=True)
+    return builder.build(context)
+
+# Function to build the prompt interpreting the output of executed analysis code
+def build_interpretation_prompt(problem_statement, task, analysis_response, execution_output, budget=None,
+                                context=None):
+    """
+    Build the prompt asking the Analyst to interpret the output of its code
+
+    Args:
+        problem_statement (str): The user's problem statement
+        task (str): The analysis task
+        analysis_response (str): The Analyst's approach and code
+        execution_output (str): The formatted output of running the code
+        budget (int): The token budget (defaults to PROMPT_TOKEN_BUDGET)
+        context (str): The project context from build_project_context, which
+            replaces the problem statement
+
+    Returns:
+        str: The prompt
+        dict: The token usage report from PromptBuilder.build
+    """
+    builder = PromptBuilder(budget)
+    if context is None:
+        builder.add("problem_statement", f"Problem Statement: {problem_statement}", PRIORITY_PROBLEM, required=True)
+    builder.add("task", f"Analysis Task: {task}", PRIORITY_INSTRUCTIONS, required=True)
+    builder.add("analysis_response", analysis_response, PRIORITY_PLAN, heading="Your approach and code:")
+    builder.add("execution_output", execution_output, PRIORITY_PLAN, required=True,
+                heading="Output of running the code on the full data:")
+    builder.add("instructions", """Please provide:
+1. The results of the analysis, using only the computed output above
+2. Key insights derived from the results
+
+If the code failed, explain the likely cause instead of guessing results.""", PRIORITY_INSTRUCTIONS, required=True)
+    return builder.build(context)
+
+# Function to select the passages of the analysis results most relevant to a query
+def _results_context(analysis_results, query, index=None):
+    index = RetrievalIndex() if index is None else index
+    index.sync_results(analysis_results)
+    return index.context(query, RETRIEVAL_RESULTS_TOKENS, source="result")
+
+# Function to build the Associate's review prompt
+def build_review_prompt(problem_statement, associate_guidance, analysis_results, budget=None, index=None,
+                        context=None):
+    """
+    Build the prompt for the Associate's review of the analysis results
+
+    The results are represented by the passages most relevant to the problem
+    statement and guidance, up to RETRIEVAL_RESULTS_TOKENS tokens.
+
+    Args:
+        problem_statement (str): The user's problem statement
+        associate_guidance (str): The Associate's analysis guidance
+        analysis_results (list): The analysis result entries (dicts with "task" and "result")
+        budget (int): The token budget (defaults to PROMPT_TOKEN_BUDGET)
+        index (RetrievalIndex): The session's index, kept between prompts so only
+            new results are indexed (a temporary one is used if not given)
+        context (str): The project context from build_project_context, which
+            replaces the problem statement
+
+    Returns:
+        str: The prompt
+        dict: The token usage report from PromptBuilder.build
+    """
+    builder = PromptBuilder(budget)
+    if context is None:
+        builder.add("problem_statement", f"Problem Statement: {problem_statement}", PRIORITY_PROBLEM, required=True)
+    builder.add("associate_guidance", associate_guidance, PRIORITY_CONTEXT, heading="Original Analysis Guidance:")
+    builder.add("analysis_results",
+                _results_context(analysis_results, f"{problem_statement}\n{associate_guidance or ''}", index),
+                PRIORITY_PLAN, required=True, heading="Analysis Results:")
+    builder.add("instructions", """Please review these analysis results. Provide:
+1. An assessment of how well the analyses address the problem statement
+2. Key insights derived from the combined results
+3. Recommendations for next steps or additional analyses
+4. Any potential issues or limitations in the current analyses""", PRIORITY_INSTRUCTIONS, required=True)
+    return builder.build(context)
+
+# Function to build the Manager's final report prompt
+def build_report_prompt(project_name, problem_statement, manager_plan, analyst_summary, analysis_results,
+                        budget=None, index=None, context=None):
+    """
+    Build the prompt for the Manager's final report
+
+    The results are represented by the passages most relevant to the problem
+    statement and plan, up to RETRIEVAL_RESULTS_TOKENS tokens.
+
+    Args:
+        project_name (str): The project name
+        problem_statement (str): The user's problem statement
+        manager_plan (str): The Manager's analysis plan
+        analyst_summary (str): The Analyst's data summary
+        analysis_results (list): The analysis result entries (dicts with "task" and "result")
+        budget (int): The token budget (defaults to PROMPT_TOKEN_BUDGET)
+        index (RetrievalIndex): The session's index, kept between prompts so only
+            new results are indexed (a temporary one is used if not given)
+        context (str): The project context from build_project_context, which
+            replaces the problem statement, plan and data summary
+
+    Returns:
+        str: The prompt
+        dict: The token usage report from PromptBuilder.build
+    """
+    builder = PromptBuilder(budget)
+    builder.add("project_name", f"Project Name: {project_name}", PRIORITY_PROBLEM, required=True)
+    if context is None:
+        builder.add("problem_statement", f"Problem Statement: {problem_statement}", PRIORITY_PROBLEM, required=True)
+        builder.add("manager_plan", manager_plan, PRIORITY_CONTEXT, heading="Original Analysis Plan:")
+        builder.add("analyst_summary", analyst_summary, PRIORITY_CONTEXT, heading="Data Summary:")
+    builder.add("analysis_results",
+                _results_context(analysis_results, f"{problem_statement}\n{manager_plan or ''}", index),
+                PRIORITY_PLAN, required=True, heading="Analysis Results:")
+    builder.add("instructions", """Synthesize this information into a coherent final report for a business audience.
+The report should be structured with:
+1. Executive Summary
+2. Key Findings/Takeaways (bullet points)
+3. Overview of Analysis Performed
+4. Detailed Findings (referencing specific analyses)
+5. Limitations (if any observed)
+6. Recommendations/Next Steps (if applicable based on findings)
+
+Format the output in Markdown suitable for direct rendering in HTML.""", PRIORITY_INSTRUCTIONS, required=True)
+    return builder.build(context)
+
+# What each kind of feedback revises, and how the revision should look
+FEEDBACK_TARGETS = {
+    "plan": ("Original Analysis Plan", "Please revise the analysis plan based on this feedback.\n"
+             "Keep the same structured format with numbered steps."),
+    "guidance": ("Original Analysis Guidance", "Please revise the analysis guidance based on this feedback.\n"
+                 "Keep the same structured format with specific tasks and hypotheses."),
+    "report": ("Original Report", "Please revise the report based on this feedback.\n"
+               "Keep the same structured format with all the required sections.")
+}
+
+# Function to build the prompt revising a plan, guidance or report after user feedback
+def build_feedback_prompt(target, original, feedback, budget=None):
+    """
+    Build the prompt revising a generated text based on user feedback
+
+    Args:
+        target (str): What is revised: "plan", "guidance" or "report"
+        original (str): The text to revise
+        feedback (str): The user's feedback
+        budget (int): The token budget (defaults to PROMPT_TOKEN_BUDGET)
+
+    Returns:
+        str: The prompt
+        dict: The token usage report from PromptBuilder.build
+    """
+    heading, instructions = FEEDBACK_TARGETS[target]
+    builder = PromptBuilder(budget)
+    builder.add("original", original, PRIORITY_PLAN, required=True, heading=f"{heading}:")
+    builder.add("feedback", feedback, PRIORITY_INSTRUCTIONS, required=True, heading="User Feedback:")
+    builder.add("instructions", instructions, PRIORITY_INSTRUCTIONS, required=True)
+    return builder.build()
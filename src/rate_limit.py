@@ -0,0 +1,221 @@
+import os
+import time
+import random
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# Client-side quota and retry settings for LLM requests. The defaults match
+# the Gemini free tier; set GEMINI_REQUESTS_PER_MINUTE=0 to disable limiting.
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", 15))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", 5))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 4))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", 1.0))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", 30.0))
+LLM_RATE_LIMIT_TIMEOUT = float(os.getenv("LLM_RATE_LIMIT_TIMEOUT", 120.0))
+
+# HTTP status codes worth retrying: rate limited, server error, unavailable, timeout
+_RETRYABLE_CODES = {429, 500, 503, 504}
+_RETRYABLE_NAMES = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+                    "DeadlineExceeded", "GatewayTimeout"}
+
+class RateLimitTimeout(RuntimeError):
+    """Raised when a request waited longer than allowed for a rate-limit slot"""
+
+# Token bucket shared by every session in the process
+class TokenBucket:
+    """
+    Thread-safe token bucket
+
+    Tokens are added at `rate` per second up to `capacity`; each request takes
+    one. A rate of 0 disables limiting.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout=LLM_RATE_LIMIT_TIMEOUT):
+        """
+        Take a token, waiting until one is available
+
+        Args:
+            timeout (float): The longest time to wait in seconds
+
+        Returns:
+            float: The seconds spent waiting
+
+        Raises:
+            RateLimitTimeout: If no token became available in time
+        """
+        if self.rate <= 0:
+            return 0.0
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return now - started
+                wait = (1 - self._tokens) / self.rate
+            if now + wait - started > timeout:
+                raise RateLimitTimeout(f"No LLM request slot became available within {timeout:.0f}s")
+            time.sleep(wait)
+
+# Function to decide whether an LLM error is worth retrying
+def is_retryable(error):
+    """
+    Check whether an error is transient (rate limiting, overload, timeouts)
+
+    Args:
+        error (Exception): The error raised by the API client
+
+    Returns:
+        bool: True if the request should be retried
+    """
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    code = getattr(error, "code", None)
+    if isinstance(code, int) and code in _RETRYABLE_CODES:
+        return True
+    return type(error).__name__ in _RETRYABLE_NAMES
+
+# Function to compute the wait before a retry
+def backoff_delay(attempt):
+    """
+    Exponential backoff with full jitter
+
+    Args:
+        attempt (int): The retry number, starting at 0
+
+    Returns:
+        float: Seconds to wait, uniformly drawn up to the capped exponential delay
+    """
+    return random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+# Process-wide limiter sized to the configured quota
+_limiter = TokenBucket(GEMINI_REQUESTS_PER_MINUTE / 60, GEMINI_BURST)
+
+# Function to get the shared rate limiter
+def get_rate_limiter():
+    return _limiter
+
+# Function to call the LLM API under the rate limit with retries
+def call_with_retries(fn, max_retries=LLM_MAX_RETRIES, limiter=None):
+    """
+    Call a function under the shared rate limit, retrying transient errors
+
+    Every attempt (including retries) takes a token from the limiter, so
+    retries cannot exceed the quota either.
+
+    Args:
+        fn (callable): The request to make, called without arguments
+        max_retries (int): The most retries after the first attempt
+        limiter (TokenBucket): The limiter to use (defaults to the shared one)
+
+    Returns:
+        object: What fn returned
+        int: How many retries were needed
+
+    Raises:
+        Exception: The last error, once it is not retryable or retries are exhausted.
+            It carries the number of retries made in its `retries` attribute.
+    """
+    limiter = limiter or _limiter
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            return fn(), attempt
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                e.retries = attempt
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning("LLM request failed (%s), retrying in %.1fs", e, delay)
+            time.sleep(delay)
+            attempt += 1
+
+# Shares one in-flight request between concurrent callers with the same key
+class RequestCoalescer:
+    """
+    Coalesce identical concurrent requests
+
+    The first caller for a key runs the request; callers that arrive while
+    it is in flight wait for and receive the same result (or exception).
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, fn):
+        """
+        Run fn once per key among concurrent callers
+
+        Args:
+            key (str): Identifies identical requests
+            fn (callable): The request to make, called without arguments
+
+        Returns:
+            object: What fn returned
+            bool: True for the caller that actually ran fn
+        """
+        future, leader = self.lead(key)
+        if not leader:
+            return future.result(), False
+
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            self.done(key)
+        return future.result(), True
+
+    def lead(self, key):
+        """
+        Become the caller that runs the request for a key, unless one is in flight
+
+        For requests that cannot be wrapped in a function, such as a streamed
+        response: the leader resolves the future itself and then calls done.
+
+        Args:
+            key (str): Identifies identical requests
+
+        Returns:
+            Future: The result of the request for this key
+            bool: True if the caller must run the request
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, False
+            future = self._inflight[key] = Future()
+            return future, True
+
+    def done(self, key):
+        """Stop sharing the request for a key; later callers start a new one"""
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._inflight
+
+# Process-wide coalescer for LLM requests
+_coalescer = RequestCoalescer()
+
+# Function to get the shared request coalescer
+def get_coalescer():
+    return _coalescer
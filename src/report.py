@@ -0,0 +1,112 @@
+import os
+import re
+import html
+import hashlib
+import threading
+from collections import OrderedDict
+import markdown
+
+# Rendered reports kept in memory, and whether charts from the executed
+# analyses are embedded by default
+REPORT_CACHE_ENTRIES = int(os.getenv("REPORT_CACHE_ENTRIES", 32))
+REPORT_EMBED_CHARTS = os.getenv("REPORT_EMBED_CHARTS", "true").lower() in ("1", "true", "yes")
+
+# Styled HTML page used for downloaded and batch-generated reports
+_REPORT_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+    <title>{title} - Analysis Report</title>
+    <style>
+        body {{ font-family: Arial, sans-serif; line-height: 1.6; max-width: 800px; margin: 0 auto; padding: 20px; }}
+        h1 {{ color: #2c3e50; }}
+        h2 {{ color: #3498db; border-bottom: 1px solid #eee; padding-bottom: 5px; }}
+        h3 {{ color: #2980b9; }}
+        li {{ margin-bottom: 5px; }}
+        figure {{ margin: 20px 0; }}
+        figure img {{ max-width: 100%; }}
+        figcaption {{ font-size: 0.9em; color: #7f8c8d; }}
+        .footer {{ margin-top: 30px; border-top: 1px solid #eee; padding-top: 10px; font-size: 0.8em; color: #7f8c8d; }}
+    </style>
+</head>
+<body>
+    <h1>{title} - Analysis Report</h1>
+    {content}
+    {charts}
+    <div class="footer">
+        <p>Generated by AI Data Analysis Assistant</p>
+    </div>
+</body>
+</html>
+"""
+
+# Rendered pages by content hash, most recently used last
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+# Function to collect the charts drawn by executed analysis code
+def report_figures(analysis_results):
+    """
+    Get the figures captured when the analyses were executed
+
+    Args:
+        analysis_results (list): The analysis result entries
+
+    Returns:
+        list: (caption, base64 PNG) pairs, in analysis order
+    """
+    figures = []
+    for i, result in enumerate(analysis_results):
+        execution = result.get("execution") or {}
+        for figure in execution.get("figures", []):
+            figures.append((f"Analysis {i+1}: {result['task']}", figure))
+    return figures
+
+# Function to identify a rendered report by everything that goes into it
+def _report_key(project_name, report_markdown, figures):
+    digest = hashlib.sha256()
+    for part in [project_name, report_markdown] + [item for figure in figures for item in figure]:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+# Function to render a Markdown report as a styled HTML page
+def render_report_html(project_name, report_markdown, figures=None):
+    """
+    Render the final report as a standalone HTML document
+
+    Pages are cached in memory by a hash of the project name, report and
+    figures, so rendering the same report again costs only the hash.
+
+    Args:
+        project_name (str): The project name, used in the title
+        report_markdown (str): The report in Markdown
+        figures (list): (caption, base64 PNG) pairs to embed as a Charts section, e.g. from report_figures
+
+    Returns:
+        str: The HTML document
+    """
+    figures = figures or []
+    key = _report_key(project_name, report_markdown, figures)
+    with _lock:
+        page = _cache.get(key)
+        if page is not None:
+            _cache.move_to_end(key)
+            return page
+
+    charts = ""
+    if figures:
+        charts = "<h2>Charts</h2>\n" + "\n".join(
+            f'<figure><img src="data:image/png;base64,{data}" alt="{html.escape(caption)}">'
+            f"<figcaption>{html.escape(caption)}</figcaption></figure>"
+            for caption, data in figures)
+    page = _REPORT_TEMPLATE.format(title=html.escape(project_name), content=markdown.markdown(report_markdown),
+                                   charts=charts)
+    with _lock:
+        _cache[key] = page
+        while len(_cache) > REPORT_CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    return page
+
+# Function to name the downloaded report file after the project
+def report_file_name(project_name):
+    return f"{re.sub(r'[^A-Za-z0-9_-]+', '_', project_name).strip('_') or 'report'}.html"
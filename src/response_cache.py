@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Location, lifetime and size limits of the LLM response cache
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", os.path.join(".cache", "responses.sqlite3"))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 7 * 24 * 60 * 60))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 10_000))
+RESPONSE_CACHE_MEMORY_ENTRIES = int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", 256))
+
+# Function to build the cache key of an LLM request
+def make_cache_key(persona, model, generation_config, prompt):
+    """
+    Build a cache key for an LLM request
+
+    Args:
+        persona (str): The persona the request was sent as
+        model (str): The model name
+        generation_config (dict): The generation settings sent with the request
+        prompt (str): The prompt text
+
+    Returns:
+        str: A hex digest identifying the request
+    """
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    parts = [persona, model, json.dumps(generation_config, sort_keys=True), prompt_hash]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+# Two-tier cache of LLM responses: an in-process LRU in front of SQLite
+class ResponseCache:
+    """
+    Cache LLM responses in memory and on disk
+
+    Entries expire ttl_seconds after they were stored. The memory tier keeps
+    the memory_entries most recently used responses; the disk tier keeps at
+    most max_entries rows and drops the least recently used ones first.
+    Each entry remembers how long the original request took, so hits can
+    report the latency they saved.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+                 max_entries=RESPONSE_CACHE_MAX_ENTRIES, memory_entries=RESPONSE_CACHE_MEMORY_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0,
+                       "stores": 0, "saved_seconds": 0.0}
+
+    def _connection(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, "
+                "accessed_at REAL NOT NULL, latency REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+        return self._conn
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """
+        Look up a cached response
+
+        Args:
+            key (str): The key from make_cache_key
+
+        Returns:
+            str: The cached response, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] <= self.ttl_seconds:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                self._stats["saved_seconds"] += entry[2]
+                return entry[0]
+            self._memory.pop(key, None)
+
+            try:
+                conn = self._connection()
+                row = conn.execute(
+                    "SELECT response, created_at, latency FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] > self.ttl_seconds:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    conn.commit()
+                    row = None
+                if row is not None:
+                    conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                    conn.commit()
+            except sqlite3.Error:
+                row = None
+
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+            self._remember(key, row)
+            self._stats["disk_hits"] += 1
+            self._stats["saved_seconds"] += row[2]
+            return row[0]
+
+    def put(self, key, response, latency=0.0):
+        """
+        Store a response in both tiers
+
+        Args:
+            key (str): The key from make_cache_key
+            response (str): The response text
+            latency (float): How long the request took, in seconds
+        """
+        now = time.time()
+        with self._lock:
+            self._remember(key, (response, now, latency))
+            self._stats["stores"] += 1
+            try:
+                conn = self._connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, created_at, accessed_at, latency) "
+                    "VALUES (?, ?, ?, ?, ?)", (key, response, now, now, latency)
+                )
+                conn.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                    "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,)
+                )
+                conn.commit()
+            except sqlite3.Error:
+                pass
+
+    def record_bypass(self):
+        with self._lock:
+            self._stats["bypassed"] += 1
+
+    def stats(self):
+        """
+        Get hit/miss counters for this process
+
+        Returns:
+            dict: Hits per tier, misses, bypassed lookups, stores, the hit rate
+                and the total latency saved by hits in seconds
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            try:
+                conn = self._connection()
+                conn.execute("DELETE FROM responses")
+                conn.commit()
+            except sqlite3.Error:
+                pass
+
+# Process-wide cache shared by all sessions
+_response_cache = ResponseCache()
+
+# Function to get the shared response cache
+def get_response_cache():
+    return _response_cache
+
+# Function to get the response cache counters
+def get_cache_stats():
+    return _response_cache.stats()
@@ -0,0 +1,221 @@
+import os
+import re
+import math
+import threading
+from collections import Counter, defaultdict
+from src.prompt_builder import count_tokens
+
+# Size of indexed passages, and how many tokens of retrieved context the
+# review/report prompts and the Q&A prompt may use
+RETRIEVAL_PASSAGE_TOKENS = int(os.getenv("RETRIEVAL_PASSAGE_TOKENS", 150))
+RETRIEVAL_RESULTS_TOKENS = int(os.getenv("RETRIEVAL_RESULTS_TOKENS", 4000))
+RETRIEVAL_CONVERSATION_TOKENS = int(os.getenv("RETRIEVAL_CONVERSATION_TOKENS", 1500))
+
+_WORD = re.compile(r"\w+")
+_STOPWORDS = frozenset("""a an and are as at be by for from has have in is it its of on or that the this
+to was were will with which what how why can could should would do does we our you your i""".split())
+
+# Function to split text into the terms that are indexed and searched
+def tokenize(text):
+    return [word for word in _WORD.findall(text.lower()) if word not in _STOPWORDS]
+
+# Function to split a text into passages of roughly max_tokens, on paragraph and line boundaries
+def split_passages(text, max_tokens=RETRIEVAL_PASSAGE_TOKENS):
+    """
+    Split a text into passages for indexing
+
+    Paragraphs are merged until a passage would exceed max_tokens; longer
+    paragraphs are split between lines. A single overlong line stays whole.
+
+    Args:
+        text (str): The text to split
+        max_tokens (int): The target passage size in tokens
+
+    Returns:
+        list: The passages, in text order
+    """
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", text or ""):
+        if not paragraph.strip():
+            continue
+        if count_tokens(paragraph) <= max_tokens:
+            pieces.append(paragraph.strip("\n"))
+        else:
+            pieces.extend(line for line in paragraph.split("\n") if line.strip())
+
+    passages, current, used = [], [], 0
+    for piece in pieces:
+        tokens = count_tokens(piece)
+        if current and used + tokens > max_tokens:
+            passages.append("\n".join(current))
+            current, used = [], 0
+        current.append(piece)
+        used += tokens
+    if current:
+        passages.append("\n".join(current))
+    return passages
+
+# BM25 index over the analysis results and conversation of one session
+class RetrievalIndex:
+    """
+    In-process BM25 index of passages from analysis results and the conversation
+
+    Documents are split into passages of about RETRIEVAL_PASSAGE_TOKENS
+    tokens. sync_results() and sync_conversation() index only the entries
+    added since the last call, so keeping the index current costs time
+    proportional to the new text. context() picks the passages most relevant
+    to a query that fit a token budget.
+    """
+
+    def __init__(self, k1=1.5, b=0.75, passage_tokens=RETRIEVAL_PASSAGE_TOKENS):
+        self.k1 = k1
+        self.b = b
+        self.passage_tokens = passage_tokens
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """Forget everything that was indexed"""
+        with self._lock:
+            self.passages = []
+            self._postings = defaultdict(dict)
+            self._total_length = 0
+            self._synced = {"result": 0, "conversation": 0}
+
+    def __len__(self):
+        return len(self.passages)
+
+    def add(self, source, doc, label, text):
+        """
+        Index a document
+
+        Args:
+            source (str): The kind of document ("result" or "conversation")
+            doc (int): The document's number within its source, which orders the context
+            label (str): The heading shown above the document's passages
+            text (str): The document text
+        """
+        with self._lock:
+            for position, passage in enumerate(split_passages(text, self.passage_tokens)):
+                terms = Counter(tokenize(passage))
+                passage_id = len(self.passages)
+                self.passages.append({"source": source, "doc": doc, "label": label, "position": position,
+                                      "text": passage, "tokens": count_tokens(passage),
+                                      "length": sum(terms.values())})
+                for term, frequency in terms.items():
+                    self._postings[term][passage_id] = frequency
+                self._total_length += self.passages[-1]["length"]
+
+    def sync_results(self, analysis_results):
+        """
+        Index the analysis results added since the last call
+
+        Args:
+            analysis_results (list): The analysis result entries (dicts with "task" and "result")
+        """
+        with self._lock:
+            for i in range(self._synced["result"], len(analysis_results)):
+                result = analysis_results[i]
+                self.add("result", i, f"Analysis {i+1}: {result['task']}", result["result"])
+            self._synced["result"] = max(self._synced["result"], len(analysis_results))
+
+    def sync_conversation(self, history):
+        """
+        Index the conversation messages added since the last call
+
+        Args:
+            history: A ConversationHistory, or a list of message dicts with "role" and "content"
+        """
+        with self._lock:
+            start, stop = self._synced["conversation"], len(history)
+            messages = history.slice(start, stop) if hasattr(history, "slice") else history[start:stop]
+            for i, message in enumerate(messages, start=start):
+                self.add("conversation", i, f"{message['role'].capitalize()} (message {i+1}):", message["content"])
+            self._synced["conversation"] = max(start, stop)
+
+    def search(self, query, source=None):
+        """
+        Rank passages by BM25 relevance to a query
+
+        Args:
+            query (str): The text to match
+            source (str): Only rank passages from this source
+
+        Returns:
+            list: (score, passage id) pairs, best first; passages without a matching term are left out
+        """
+        with self._lock:
+            count = len(self.passages)
+            if not count:
+                return []
+            average = self._total_length / count or 1
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for passage_id, frequency in postings.items():
+                    length = self.passages[passage_id]["length"]
+                    scores[passage_id] += idf * frequency * (self.k1 + 1) / (
+                        frequency + self.k1 * (1 - self.b + self.b * length / average))
+            ranked = [(score, passage_id) for passage_id, score in scores.items()
+                      if source is None or self.passages[passage_id]["source"] == source]
+        return sorted(ranked, key=lambda item: (-item[0], item[1]))
+
+    def context(self, query, max_tokens, source=None):
+        """
+        Assemble the passages most relevant to a query within a token budget
+
+        Every document first gets its best passage (or its first one if no
+        passage matches), so no analysis is left out while the budget allows;
+        the remaining budget goes to the best-scoring passages overall. The
+        chosen passages are shown in document order under their document's
+        label, with "[...]" marking skipped passages.
+
+        Args:
+            query (str): The text the context should be relevant to
+            max_tokens (int): The token budget
+            source (str): Only use passages from this source
+
+        Returns:
+            str: The context text (empty if nothing was indexed)
+        """
+        with self._lock:
+            candidates = [i for i, passage in enumerate(self.passages)
+                          if source is None or passage["source"] == source]
+            scores = dict((passage_id, score) for score, passage_id in self.search(query, source))
+            ranked = sorted(candidates, key=lambda i: (-scores.get(i, 0.0), self.passages[i]["position"], i))
+
+            chosen, docs, used = set(), set(), 0
+            def take(i):
+                nonlocal used
+                passage = self.passages[i]
+                key = (passage["source"], passage["doc"])
+                cost = passage["tokens"] + 2 + (0 if key in docs else count_tokens(passage["label"]) + 1)
+                if used + cost > max_tokens:
+                    return
+                chosen.add(i)
+                docs.add(key)
+                used += cost
+
+            # One passage per document first, most relevant documents first
+            for i in ranked:
+                if (self.passages[i]["source"], self.passages[i]["doc"]) not in docs:
+                    take(i)
+            for i in ranked:
+                if i not in chosen:
+                    take(i)
+
+            sections, previous = [], None
+            for i in sorted(chosen, key=lambda i: (self.passages[i]["source"], self.passages[i]["doc"],
+                                                   self.passages[i]["position"])):
+                passage = self.passages[i]
+                key = (passage["source"], passage["doc"])
+                if previous is None or previous[0] != key:
+                    sections.append([passage["label"]] + (["[...]"] if passage["position"] else []))
+                elif passage["position"] != previous[1] + 1:
+                    sections[-1].append("[...]")
+                sections[-1].append(passage["text"])
+                previous = (key, passage["position"])
+        return "\n\n".join("\n".join(section) for section in sections)
@@ -0,0 +1,302 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+from src.dataset_store import sidecar_path
+
+logger = logging.getLogger(__name__)
+
+# Size of the row sample kept for every dataset, the rows and kind of sample
+# put in prompts, and how many built samples are kept in memory
+SAMPLE_RESERVOIR_ROWS = int(os.getenv("SAMPLE_RESERVOIR_ROWS", 1000))
+PROMPT_SAMPLE_ROWS = int(os.getenv("PROMPT_SAMPLE_ROWS", 5))
+PROMPT_SAMPLE_KIND = os.getenv("PROMPT_SAMPLE_KIND", "representative")
+SAMPLE_CACHE_ENTRIES = int(os.getenv("SAMPLE_CACHE_ENTRIES", 256))
+
+SAMPLE_KINDS = ("uniform", "stratified", "outliers", "representative")
+
+# Bookkeeping columns of a stored sample: the row's position in the file, and
+# whether it was kept as the minimum or maximum of a numeric column
+_ROW_COLUMN = "__row__"
+_EXTREME_COLUMN = "__extreme__"
+
+# Add a bookkeeping column in one concatenation, since assign() on a wide
+# frame built column by column warns about fragmentation on every call
+def _with_column(frame, name, values):
+    column = pd.DataFrame({name: values}, index=frame.index)
+    return pd.concat([frame, column], axis=1)
+
+# Uniform random sample of rows kept in bounded memory while streaming chunks
+class RowReservoir:
+    def __init__(self, size, seed=0):
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.rows = None
+        self.keys = np.empty(0)
+
+    def update(self, chunk):
+        # Bottom-k sampling: every row gets a random key and the k smallest keys win
+        keys = np.concatenate([self.keys, self.rng.random(len(chunk))])
+        rows = chunk if self.rows is None else pd.concat([self.rows, chunk], ignore_index=True)
+        if len(keys) > self.size:
+            keep = np.argpartition(keys, self.size)[:self.size]
+            keys, rows = keys[keep], rows.iloc[keep].reset_index(drop=True)
+        self.keys, self.rows = keys, rows
+
+    def sample(self):
+        # Ordered by key, so the first n rows are themselves a uniform sample of n rows
+        if self.rows is None:
+            return pd.DataFrame()
+        return self.rows.iloc[np.argsort(self.keys, kind="stable")].reset_index(drop=True)
+
+# Collects the row sample of a dataset in the same pass that reads it
+class SampleBuilder:
+    """
+    Build the stored row sample of a dataset one chunk at a time
+
+    Keeps a uniform reservoir of rows plus, for every numeric column, the
+    rows holding its minimum and maximum, so outlier-inclusive samples can be
+    drawn later without reading the data again.
+    """
+
+    def __init__(self, size=SAMPLE_RESERVOIR_ROWS, seed=0):
+        self.reservoir = RowReservoir(size, seed)
+        # (column, "min"/"max") -> (value, position of the row in the file)
+        self.extremes = {}
+        # The rows holding the current extremes, each row once
+        self.extreme_rows = None
+        self.rows = 0
+
+    def update(self, chunk):
+        chunk = chunk.reset_index(drop=True)
+        positions = np.arange(self.rows, self.rows + len(chunk))
+        self.reservoir.update(_with_column(chunk, _ROW_COLUMN, positions))
+        numeric = chunk.select_dtypes(include=["number"])
+        numeric = numeric.loc[:, numeric.notna().any()]
+        if numeric.shape[1]:
+            # One pass over the chunk per statistic, then only scalar comparisons per column
+            found = set()
+            for stat, values, index in (("min", numeric.min(), numeric.idxmin()),
+                                        ("max", numeric.max(), numeric.idxmax())):
+                for col, value, i in zip(numeric.columns, values.to_numpy(), index.to_numpy()):
+                    current = self.extremes.get((col, stat))
+                    if current is None or (value < current[0] if stat == "min" else value > current[0]):
+                        self.extremes[(col, stat)] = (value, self.rows + int(i))
+                        found.add(int(i))
+            if found:
+                taken = sorted(found)
+                rows = _with_column(chunk.iloc[taken], _ROW_COLUMN, positions[taken])
+                if self.extreme_rows is not None:
+                    rows = pd.concat([self.extreme_rows, rows], ignore_index=True)
+                # Drop rows no longer holding any extreme
+                held = {position for _, position in self.extremes.values()}
+                self.extreme_rows = rows[rows[_ROW_COLUMN].isin(held)].reset_index(drop=True)
+        self.rows += len(chunk)
+
+    def finish(self):
+        """
+        Get the collected sample
+
+        Returns:
+            DataFrame: The reservoir rows in random order followed by the extreme rows
+        """
+        sample = self.reservoir.sample()
+        frames = [_with_column(sample, _EXTREME_COLUMN, np.zeros(len(sample), dtype=bool))]
+        if self.extreme_rows is not None:
+            frames.append(_with_column(self.extreme_rows, _EXTREME_COLUMN, np.ones(len(self.extreme_rows), dtype=bool)))
+        return pd.concat([frame for frame in frames if len(frame)], ignore_index=True) if self.rows else frames[0]
+
+# Stored samples and built prompt samples, most recently used last
+_frames = OrderedDict()
+_samples = OrderedDict()
+_lock = threading.Lock()
+
+def _remember(cache, key, value):
+    with _lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > SAMPLE_CACHE_ENTRIES:
+            cache.popitem(last=False)
+
+def _recall(cache, key):
+    with _lock:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+# Function to store the row sample of a dataset next to it in the dataset cache
+def save_sample(key, sample):
+    """
+    Keep the row sample built during ingestion
+
+    The sample is written next to the dataset in the dataset cache, so later
+    sessions and worker processes can use it, and kept in memory.
+
+    Args:
+        key (str): The content hash of the source file
+        sample (DataFrame): The result of SampleBuilder.finish()
+
+    Returns:
+        bool: True if the sample was written to disk
+    """
+    _remember(_frames, key, sample)
+    path = sidecar_path(key, "sample.arrow")
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Columns of mixed Python objects cannot be stored in Arrow
+        stored = sample.astype({col: "string" for col, dtype in sample.dtypes.items() if dtype == object})
+        feather.write_feather(pa.Table.from_pandas(stored, preserve_index=False), tmp_path,
+                              compression="uncompressed")
+        os.replace(tmp_path, path)
+        return True
+    except (pa.ArrowException, ValueError, TypeError, OSError) as e:
+        logger.warning("Not caching the row sample of dataset %s: %s", key, e)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+# Function to get the stored row sample of a dataset, building it if there is none
+def load_sample(key, df=None):
+    """
+    Get the row sample of a dataset
+
+    Args:
+        key (str): The content hash of the source file, or None for data outside the dataset cache
+        df (DataFrame): The data, used to build the sample if none was stored
+
+    Returns:
+        DataFrame: The sample (see SampleBuilder.finish), or None if there is neither a sample nor data
+    """
+    sample = _recall(_frames, key) if key else None
+    if sample is not None:
+        return sample
+    if key:
+        try:
+            # The pandas metadata of Arrow-backed frames does not always read back
+            sample = feather.read_table(sidecar_path(key, "sample.arrow")).to_pandas(ignore_metadata=True)
+            _remember(_frames, key, sample)
+            return sample
+        except (OSError, pa.ArrowException):
+            pass
+    if df is None:
+        return None
+    # Datasets cached before samples were stored: one pass over the data
+    builder = SampleBuilder()
+    builder.update(df)
+    sample = builder.finish()
+    if key:
+        save_sample(key, sample)
+    return sample
+
+# Function to pick the categorical column to stratify a sample on
+def _stratify_column(rows, size):
+    candidates = []
+    for col, dtype in rows.dtypes.items():
+        if col in (_ROW_COLUMN, _EXTREME_COLUMN) or pd.api.types.is_numeric_dtype(dtype) \
+                and not pd.api.types.is_bool_dtype(dtype):
+            continue
+        distinct = rows[col].nunique(dropna=False)
+        if distinct >= 2:
+            candidates.append((distinct, col))
+    if not candidates:
+        return None
+    # The finest grouping in which every category still fits in the sample
+    fitting = [candidate for candidate in candidates if candidate[0] <= size]
+    return max(fitting)[1] if fitting else min(candidates)[1]
+
+# Function to take rows from every category in turn, most common categories first
+def _stratified(rows, size):
+    column = _stratify_column(rows, size)
+    if column is None:
+        return rows.head(size), None
+    groups = rows.groupby(column, sort=False, observed=True, dropna=False)[column]
+    order = pd.DataFrame({"rank": groups.cumcount(), "frequency": -groups.transform("size")}, index=rows.index)
+    return rows.loc[order.sort_values(["rank", "frequency"], kind="stable").index[:size]], column
+
+# Function to pick the extreme rows that lie furthest outside the typical range,
+# measured in interquartile ranges from the median of the random rows
+def _extreme_rows(extremes, rows, size):
+    numeric = [col for col in extremes.select_dtypes(include=["number"]).columns if col != _ROW_COLUMN]
+    values = rows[numeric]
+    spread = (values.quantile(0.75) - values.quantile(0.25)).replace(0, np.nan)
+    score = ((extremes[numeric] - values.median()).abs() / spread).max(axis=1).fillna(0)
+    ranked = _with_column(extremes, "_score", score).sort_values("_score", ascending=False, kind="stable")
+    return ranked.drop_duplicates(_ROW_COLUMN).drop(columns="_score").head(size)
+
+# Function to draw a sample of the given kind from a stored sample
+def draw_sample(sample, size, kind):
+    """
+    Draw rows from a stored sample
+
+    Args:
+        sample (DataFrame): The stored sample (see SampleBuilder.finish)
+        size (int): The number of rows
+        kind (str): "uniform" (random rows), "stratified" (every category of a
+            categorical column represented, rarest last), "outliers" (rows holding
+            the minimum or maximum of numeric columns first, most extreme first) or
+            "representative" (about a third extreme rows, the rest stratified)
+
+    Returns:
+        DataFrame: The rows in file order
+        str: A description of the sample for prompts
+    """
+    if kind not in SAMPLE_KINDS:
+        raise ValueError(f"Unknown sample kind {kind!r}; expected one of {', '.join(SAMPLE_KINDS)}")
+    is_extreme = sample[_EXTREME_COLUMN].astype(bool) if _EXTREME_COLUMN in sample else \
+        pd.Series(False, index=sample.index)
+    rows, extremes = sample[~is_extreme], sample[is_extreme]
+
+    column, chosen = None, extremes.head(0)
+    if kind in ("outliers", "representative"):
+        chosen = _extreme_rows(extremes, rows, size if kind == "outliers" else (size + 1) // 3)
+    rest = rows[~rows[_ROW_COLUMN].isin(chosen[_ROW_COLUMN])]
+    remaining = size - len(chosen)
+    if kind in ("stratified", "representative"):
+        picked, column = _stratified(rest, remaining)
+    else:
+        picked = rest.head(remaining)
+    result = pd.concat([chosen, picked]).sort_values(_ROW_COLUMN, kind="stable")
+
+    description = f"{len(result)} randomly sampled rows"
+    if column is not None:
+        description = f"{len(result)} sampled rows stratified by {column}"
+    if len(chosen):
+        description += ", including the extremes of numeric columns"
+    return result.drop(columns=[_ROW_COLUMN, _EXTREME_COLUMN], errors="ignore").reset_index(drop=True), description
+
+# Function to get the data sample put in analysis prompts
+def get_prompt_sample(df, profile, size=PROMPT_SAMPLE_ROWS, kind=PROMPT_SAMPLE_KIND):
+    """
+    Get a representative sample of a dataset as JSON records
+
+    Samples are drawn from the row sample stored at ingestion and cached per
+    dataset, kind and size, so repeated prompts cost nothing. Each record is
+    on its own line, so a prompt over budget drops rows rather than the
+    whole sample.
+
+    Args:
+        df (DataFrame): The data, used only if no sample was stored
+        profile (dict): The data profile (its dataset_key identifies the data)
+        size (int): The number of rows
+        kind (str): The kind of sample (see draw_sample)
+
+    Returns:
+        str: The rows as JSON lines, one record per line
+        str: A description of the sample
+    """
+    key = (profile or {}).get("dataset_key")
+    cached = _recall(_samples, (key, kind, size)) if key else None
+    if cached is not None:
+        return cached
+    rows, description = draw_sample(load_sample(key, df), size, kind)
+    result = (rows.to_json(orient="records", lines=True, date_format="iso", default_handler=str).rstrip("\n"),
+              description)
+    if key:
+        _remember(_samples, (key, kind, size), result)
+    return result
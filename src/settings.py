@@ -0,0 +1,23 @@
+import os
+from dotenv import load_dotenv
+
+# Load environment variables before any other module reads its settings. This
+# module only depends on the standard library and python-dotenv, so it can be
+# imported at startup without pulling in pandas or the Gemini SDK.
+load_dotenv()
+
+# Which LLM backend to call: "gemini", or "fake" for the deterministic local
+# stand-in used by benchmarks and offline runs
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+
+# Function to check the LLM credentials without importing the SDK
+def get_api_key_error():
+    """
+    Check whether the configured LLM backend has the credentials it needs
+
+    Returns:
+        str: The problem to show the user, or None if the backend can be used
+    """
+    if LLM_BACKEND != "fake" and not os.getenv("GEMINI_API_KEY"):
+        return "Gemini API key not found. Please set the GEMINI_API_KEY environment variable."
+    return None
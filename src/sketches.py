@@ -0,0 +1,417 @@
+import os
+import re
+import json
+import logging
+import itertools
+import threading
+from collections import Counter, OrderedDict
+import numpy as np
+import pandas as pd
+from src.dataset_store import sidecar_path
+
+logger = logging.getLogger(__name__)
+
+# Size of the MinHash sketch kept per column, and when two columns of different
+# files are reported as a likely join: the share of the smaller column's values
+# found in the other, and how unique the key side must be
+SKETCH_SIZE = int(os.getenv("SKETCH_SIZE", 256))
+JOIN_MIN_OVERLAP = float(os.getenv("JOIN_MIN_OVERLAP", 0.5))
+JOIN_KEY_MIN_UNIQUENESS = float(os.getenv("JOIN_KEY_MIN_UNIQUENESS", 0.9))
+JOIN_MAX_EDGES = int(os.getenv("JOIN_MAX_EDGES", 20))
+
+# Distinct values per chunk whose format is recorded in the fingerprint
+_PATTERN_VALUES = 1000
+
+# Function to reduce a value to its format, e.g. "AB-1234" -> "AA-9999"
+def _pattern(value):
+    return re.sub(r"[0-9]", "9", re.sub(r"[^\W\d_]", "A", value))
+
+# Character map used by _patterns, filled in as characters are first seen
+class _PatternTable(dict):
+    def __missing__(self, code):
+        self[code] = ord(_pattern(chr(code)))
+        return self[code]
+
+_PATTERN_TABLE = _PatternTable()
+
+# Strings that pd.to_numeric could read as a number
+_NUMBER = re.compile(r"[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?")
+
+# Function to reduce many strings to their formats with one translate call
+def _patterns(strings):
+    text = "\0".join(strings).translate(_PATTERN_TABLE)
+    patterns = text.split("\0")
+    # A value holding the separator itself falls back to one call per value
+    return patterns if len(patterns) == len(strings) else [_pattern(value) for value in strings]
+
+# Function to hash the distinct non-missing values of a column so equal keys
+# hash the same across files, e.g. 42, 42.0 and "42"
+def _hash_distinct(values):
+    if pd.api.types.is_bool_dtype(values.dtype) or pd.api.types.is_datetime64_any_dtype(values.dtype):
+        return None, None, None, None
+    if pd.api.types.is_float_dtype(values.dtype):
+        # Measurements rarely hold only whole numbers; check a few before finding distinct values
+        head = values.head(_PATTERN_VALUES).to_numpy(dtype="float64")
+        if (head % 1 != 0).any():
+            return "float", None, None, None
+    distinct = pd.Series(pd.unique(values))
+    if pd.api.types.is_integer_dtype(values.dtype):
+        return "integer", pd.util.hash_array(distinct.to_numpy(dtype="int64")), distinct, None
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        numbers = distinct.to_numpy(dtype="float64")
+        if not np.isfinite(numbers).all() or (numbers % 1 != 0).any():
+            return "float", None, distinct, None
+        return "integer", pd.util.hash_array(numbers.astype("int64")), distinct, None
+    strings = distinct.astype(str).str.strip()
+    # Text columns are told apart by their first value without parsing every value as a number
+    if _NUMBER.fullmatch(strings.iloc[0]):
+        numbers = pd.to_numeric(strings, errors="coerce")
+        if numbers.notna().all() and (numbers % 1 == 0).all():
+            return "integer", pd.util.hash_array(numbers.to_numpy(dtype="int64")), distinct, strings
+    return "string", pd.util.hash_array(strings.to_numpy(dtype=object)), distinct, strings
+
+# MinHash sketch and fingerprint of one column
+class ColumnSketch:
+    """
+    Bottom-k MinHash sketch of a column's distinct values
+
+    Keeps the `size` smallest 64-bit hashes of the distinct values, which
+    gives both a distinct-count estimate (k minimum values) and Jaccard and
+    containment estimates against other columns. The fingerprint records the
+    kind of values (integer, float, string) and the formats and lengths of
+    string values. Sketches of chunks merge exactly, so one pass suffices.
+    """
+
+    def __init__(self, size=SKETCH_SIZE):
+        self.size = size
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.rows = 0
+        self.nulls = 0
+        self.kind = None
+        self.patterns = Counter()
+        self.lengths = None
+
+    def update(self, series):
+        self.rows += len(series)
+        values = series.dropna()
+        self.nulls += len(series) - len(values)
+        if not len(values):
+            return
+        kind, hashes, distinct, strings = _hash_distinct(values)
+        self._merge_kind(kind)
+        if hashes is not None:
+            if len(hashes) > self.size:
+                hashes = np.partition(hashes, self.size)[:self.size]
+            self.hashes = np.union1d(self.hashes, hashes)[:self.size]
+        if kind in ("string", "integer"):
+            if strings is None:
+                strings = distinct.head(_PATTERN_VALUES).astype(str).str.strip()
+            self.patterns.update(_patterns(strings.head(_PATTERN_VALUES).tolist()))
+            if pd.api.types.is_numeric_dtype(distinct.dtype):
+                # The shortest and longest numbers are among the smallest and largest
+                ends = [len(str(int(value))) for value in (distinct.min(), distinct.max())]
+                low, high = min(ends), max(ends)
+                if distinct.min() < 0 < distinct.max():
+                    low = 1
+            else:
+                lengths = strings.str.len()
+                low, high = int(lengths.min()), int(lengths.max())
+            self.lengths = (low, high) if self.lengths is None else (min(low, self.lengths[0]),
+                                                                    max(high, self.lengths[1]))
+
+    def update_fractional(self, rows, filled):
+        """Count a chunk of the column already found to hold numbers with a fractional part"""
+        self.rows += rows
+        self.nulls += rows - filled
+        if filled:
+            self._merge_kind("float")
+
+    def _merge_kind(self, kind):
+        # A column whose chunks disagree (e.g. numbers then text) takes the more general kind
+        if self.kind is None:
+            self.kind = kind
+        elif kind is not None and kind != self.kind:
+            kinds = {kind, self.kind}
+            self.kind = "string" if kinds == {"integer", "string"} else "float" if kinds == {"integer", "float"} \
+                else "mixed"
+
+    def distinct(self):
+        """Estimate the number of distinct values (exact below `size` values)"""
+        if len(self.hashes) < self.size:
+            return len(self.hashes)
+        return int((self.size - 1) / (float(self.hashes[self.size - 1]) / 2.0 ** 64))
+
+    def uniqueness(self):
+        """Estimate the share of non-missing rows with a distinct value (1.0 for a key)"""
+        filled = self.rows - self.nulls
+        return min(self.distinct() / filled, 1.0) if filled else 0.0
+
+    def jaccard(self, other):
+        """Estimate the Jaccard similarity of the distinct values of two columns"""
+        union = np.union1d(self.hashes, other.hashes)[:min(self.size, other.size)]
+        if not len(union):
+            return 0.0
+        both = np.isin(union, self.hashes, assume_unique=True) & np.isin(union, other.hashes, assume_unique=True)
+        return float(both.sum()) / len(union)
+
+    def fingerprint(self):
+        """Describe the column's values, e.g. {"kind": "string", "lengths": [7, 7], "patterns": ["AA-9999"]}"""
+        return {"kind": self.kind, "lengths": list(self.lengths) if self.lengths else None,
+                "patterns": [pattern for pattern, _ in self.patterns.most_common(3)]}
+
+    def compatible(self, other):
+        """Check whether two columns could share values: same kind and overlapping value lengths"""
+        if self.kind != other.kind:
+            return False
+        if self.lengths and other.lengths:
+            return self.lengths[0] <= other.lengths[1] and other.lengths[0] <= self.lengths[1]
+        return True
+
+    def to_dict(self):
+        return {"size": self.size, "hashes": self.hashes.tolist(), "rows": self.rows, "nulls": self.nulls,
+                "kind": self.kind, "patterns": dict(self.patterns.most_common(20)), "lengths": self.lengths}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["size"])
+        sketch.hashes = np.array(data["hashes"], dtype=np.uint64)
+        sketch.rows, sketch.nulls, sketch.kind = data["rows"], data["nulls"], data["kind"]
+        sketch.patterns = Counter(data["patterns"])
+        sketch.lengths = tuple(data["lengths"]) if data["lengths"] else None
+        return sketch
+
+# Collects the column sketches of a dataset in the same pass that reads it
+class SketchBuilder:
+    def __init__(self, size=SKETCH_SIZE):
+        self.size = size
+        self.columns = {}
+
+    def update(self, chunk):
+        # Measurements (float columns with a fractional value near the top) are
+        # found for all columns in one pass; only the rest are sketched one by one
+        floats = [col for col, dtype in chunk.dtypes.items() if pd.api.types.is_float_dtype(dtype)]
+        fractional = set()
+        if floats:
+            head = chunk[floats].head(_PATTERN_VALUES).to_numpy(dtype="float64", na_value=np.nan)
+            fractional = {col for col, found in zip(floats, (np.nan_to_num(head) % 1 != 0).any(axis=0)) if found}
+            filled = chunk[list(fractional)].count()
+        for col in chunk.columns:
+            sketch = self.columns.setdefault(col, ColumnSketch(self.size))
+            if col in fractional:
+                sketch.update_fractional(len(chunk), int(filled[col]))
+            else:
+                sketch.update(chunk[col])
+
+    def finish(self):
+        return self.columns
+
+# Column sketches of datasets and computed join graphs, most recently used last
+_sketches = OrderedDict()
+_graphs = OrderedDict()
+_lock = threading.Lock()
+_CACHE_ENTRIES = 256
+
+def _remember(cache, key, value):
+    with _lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > _CACHE_ENTRIES:
+            cache.popitem(last=False)
+
+def _recall(cache, key):
+    with _lock:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+# Function to store the column sketches of a dataset next to it in the dataset cache
+def save_sketches(key, sketches):
+    """
+    Keep the column sketches built during ingestion
+
+    Args:
+        key (str): The content hash of the source file
+        sketches (dict): Maps column names to ColumnSketch objects
+
+    Returns:
+        bool: True if the sketches were written to disk
+    """
+    _remember(_sketches, key, sketches)
+    path = sidecar_path(key, "sketch.json")
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(tmp_path, "w") as f:
+            json.dump({str(col): sketch.to_dict() for col, sketch in sketches.items()}, f)
+        os.replace(tmp_path, path)
+        return True
+    except OSError as e:
+        logger.warning("Not caching the column sketches of dataset %s: %s", key, e)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+# Function to get the column sketches of a dataset, building them if there are none
+def load_sketches(key, df=None):
+    """
+    Get the column sketches of a dataset
+
+    Args:
+        key (str): The content hash of the source file, or None for data outside the dataset cache
+        df (DataFrame): The data, used to build the sketches if none were stored
+
+    Returns:
+        dict: Maps column names to ColumnSketch objects, or None if there are neither sketches nor data
+    """
+    sketches = _recall(_sketches, key) if key else None
+    if sketches is not None:
+        return sketches
+    if key:
+        try:
+            with open(sidecar_path(key, "sketch.json")) as f:
+                sketches = {col: ColumnSketch.from_dict(data) for col, data in json.load(f).items()}
+            _remember(_sketches, key, sketches)
+            return sketches
+        except (OSError, ValueError, KeyError):
+            pass
+    if df is None:
+        return None
+    # Datasets cached before sketches were stored: one pass over the data
+    builder = SketchBuilder()
+    builder.update(df)
+    sketches = builder.finish()
+    if key:
+        save_sketches(key, sketches)
+    return sketches
+
+# Function to normalize a column name for comparison, e.g. "Customer_ID" -> "customerid"
+def _normalize_name(name):
+    return re.sub(r"[^0-9a-z]", "", str(name).lower())
+
+# Function to check whether two columns are named alike, counting "id" in
+# customers.csv as "customer_id"
+def _names_match(file_a, col_a, file_b, col_b):
+    a, b = _normalize_name(col_a), _normalize_name(col_b)
+    if a == b:
+        return True
+    stem_a = _normalize_name(os.path.splitext(file_a)[0]).rstrip("s")
+    stem_b = _normalize_name(os.path.splitext(file_b)[0]).rstrip("s")
+    return stem_a + a == b or stem_b + b == a
+
+# Function to list the column pairs whose sketches share at least one hash. Other
+# pairs have an estimated overlap of zero, so they are never compared.
+def _candidate_pairs(columns):
+    if not columns:
+        return []
+    entries = pd.DataFrame({
+        "hash": np.concatenate([sketch.hashes for _, _, sketch in columns]),
+        "column": np.concatenate([np.full(len(sketch.hashes), i) for i, (_, _, sketch) in enumerate(columns)])
+    })
+    shared = entries[entries.duplicated("hash", keep=False)]
+    pairs = set()
+    for _, group in shared.groupby("hash")["column"]:
+        pairs.update(itertools.combinations(sorted(group.tolist()), 2))
+    return sorted(pairs)
+
+# Function to find likely join keys between files from their column sketches
+def find_join_keys(sketches, min_overlap=JOIN_MIN_OVERLAP, max_edges=JOIN_MAX_EDGES):
+    """
+    Find column pairs of different files that look like join keys
+
+    Only the sketches are compared, never the data. A pair qualifies when the
+    columns hold the same kind of values of overlapping lengths, at least one side is nearly unique
+    (JOIN_KEY_MIN_UNIQUENESS) and at least min_overlap of the smaller side's
+    distinct values are estimated to occur in the other. Integer pairs with
+    unrelated names must overlap by 90%, since small integer ranges overlap
+    by chance.
+
+    Args:
+        sketches (dict): Maps file names to {column name: ColumnSketch}
+        min_overlap (float): The minimum share of shared distinct values
+        max_edges (int): The most pairs returned
+
+    Returns:
+        list: Edges, best first, as dicts with left/right (file, column), the
+            share of each side's distinct values found in the other
+            (left_in_right, right_in_left), jaccard, name_match, kind and
+            relationship ("one-to-one", "many-to-one" or "one-to-many")
+    """
+    columns = [(file_name, col, sketch) for file_name, file_sketches in sketches.items()
+               for col, sketch in file_sketches.items()
+               if sketch.kind in ("integer", "string") and sketch.distinct() >= 2]
+    edges = []
+    for i, j in _candidate_pairs(columns):
+        (file_a, col_a, a), (file_b, col_b, b) = columns[i], columns[j]
+        # The fingerprints rule out most remaining pairs before the sketches are compared
+        if file_a == file_b or not a.compatible(b):
+            continue
+        unique_a, unique_b = a.uniqueness(), b.uniqueness()
+        if max(unique_a, unique_b) < JOIN_KEY_MIN_UNIQUENESS:
+            continue
+        jaccard = a.jaccard(b)
+        if not jaccard:
+            continue
+        shared = jaccard / (1 + jaccard) * (a.distinct() + b.distinct())
+        a_in_b, b_in_a = min(shared / a.distinct(), 1.0), min(shared / b.distinct(), 1.0)
+        name_match = _names_match(file_a, col_a, file_b, col_b)
+        required = min_overlap if name_match or a.kind == "string" else max(min_overlap, 0.9)
+        if max(a_in_b, b_in_a) < required:
+            continue
+        if unique_a >= JOIN_KEY_MIN_UNIQUENESS and unique_b >= JOIN_KEY_MIN_UNIQUENESS:
+            relationship = "one-to-one"
+        else:
+            relationship = "one-to-many" if unique_a >= JOIN_KEY_MIN_UNIQUENESS else "many-to-one"
+        edges.append({"left": (file_a, col_a), "right": (file_b, col_b), "left_in_right": a_in_b,
+                      "right_in_left": b_in_a, "jaccard": jaccard, "name_match": name_match,
+                      "kind": a.kind, "relationship": relationship})
+    edges.sort(key=lambda edge: (edge["name_match"], max(edge["left_in_right"], edge["right_in_left"])),
+               reverse=True)
+    return edges[:max_edges]
+
+# Function to get the join graph of the uploaded files
+def get_join_graph(dataframes, data_profiles):
+    """
+    Find likely join keys across the uploaded files, using the sketches stored at ingestion
+
+    The result is cached per set of datasets.
+
+    Args:
+        dataframes (dict): Maps file names to DataFrames, used only for files without stored sketches
+        data_profiles (dict): Maps file names to data profiles (their dataset_key identifies the data)
+
+    Returns:
+        list: The edges from find_join_keys
+    """
+    if len(data_profiles) < 2:
+        return []
+    keys = tuple((name, profile.get("dataset_key")) for name, profile in data_profiles.items())
+    cacheable = all(key for _, key in keys)
+    edges = _recall(_graphs, keys) if cacheable else None
+    if edges is None:
+        edges = find_join_keys({name: load_sketches(key, dataframes.get(name)) or {} for name, key in keys})
+        if cacheable:
+            _remember(_graphs, keys, edges)
+    return edges
+
+# Function to describe the join graph for prompts
+def describe_join_graph(edges):
+    """
+    Describe join key candidates as text, one line per pair
+
+    Args:
+        edges (list): The edges from find_join_keys
+
+    Returns:
+        str: The description, e.g. "- orders.csv[customer_id] -> customers.csv[id]: many-to-one, ..."
+    """
+    lines = []
+    for edge in edges:
+        (file_a, col_a), (file_b, col_b) = edge["left"], edge["right"]
+        line = (f"- {file_a}[{col_a}] -> {file_b}[{col_b}]: {edge['relationship']} on {edge['kind']} values; "
+                f"{edge['left_in_right']:.0%} of {file_a} values found in {file_b}, "
+                f"{edge['right_in_left']:.0%} of {file_b} values found in {file_a}")
+        if not edge["name_match"]:
+            line += " (column names differ, so check the meaning before joining)"
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,287 @@
+import os
+import json
+import logging
+import threading
+import warnings
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from src.dataset_store import sidecar_path
+
+logger = logging.getLogger(__name__)
+
+# How much is precomputed per dataset: numeric columns in the correlation
+# matrix, most common values per column, histogram bins, the most groups a
+# column may have to be used in group-by summaries, and how many such columns
+STATS_MAX_COLUMNS = int(os.getenv("STATS_MAX_COLUMNS", 30))
+STATS_TOP_VALUES = int(os.getenv("STATS_TOP_VALUES", 10))
+STATS_HISTOGRAM_BINS = int(os.getenv("STATS_HISTOGRAM_BINS", 10))
+STATS_MAX_GROUPS = int(os.getenv("STATS_MAX_GROUPS", 20))
+STATS_GROUP_COLUMNS = int(os.getenv("STATS_GROUP_COLUMNS", 3))
+# Lines per section shown in task prompts and in the data summary prompt, and
+# how many datasets' statistics are kept in memory
+STATS_PROMPT_ITEMS = int(os.getenv("STATS_PROMPT_ITEMS", 15))
+STATS_SUMMARY_ITEMS = int(os.getenv("STATS_SUMMARY_ITEMS", 5))
+STATS_CACHE_ENTRIES = int(os.getenv("STATS_CACHE_ENTRIES", 64))
+
+_QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+# Words in a task that ask for each kind of statistic
+_SECTION_KEYWORDS = {
+    "correlations": ("correlat", "relationship", "associat"),
+    "top_values": ("frequen", "count", "categor", "distinct", "most common", "top ", "value"),
+    "distributions": ("distribut", "histogram", "quantile", "percentile", "outlier", "spread", "skew", "range"),
+    "groups": (" by ", " per ", "group", "segment", "compare", "across", "breakdown")
+}
+
+# Function to split the columns of a dataset into numeric and categorical ones using its profile
+def _column_kinds(df, profile):
+    numeric = [col for col in df.columns if col in profile.get("numeric_summary", {})]
+    categorical = [col for col in df.columns if col not in profile.get("numeric_summary", {})]
+    # The most complete numeric columns first
+    missing = profile.get("missing_values", {})
+    numeric.sort(key=lambda col: missing.get(col, 0))
+    return numeric, categorical
+
+# Function to compute the statistics of a dataset on the full data
+def compute_statistics(df, profile):
+    """
+    Compute correlations, value counts, distributions and group-by summaries
+
+    Numeric statistics are computed in batched NumPy calls over one 2-D array;
+    value counts and group-bys use pandas' vectorized hashing.
+
+    Args:
+        df (DataFrame): The full data
+        profile (dict): The data profile, which tells numeric from categorical columns
+
+    Returns:
+        dict: "rows", "correlations" ({column: {column: r}}), "top_values"
+            ({column: {"distinct", "values": [[value, count], ...]}}),
+            "distributions" ({column: {"quantiles", "min", "max", "histogram"}})
+            and "groups" ({group column: {numeric column: {group: stats}}})
+    """
+    numeric, categorical = _column_kinds(df, profile)
+    stats = {"rows": len(df), "correlations": {}, "top_values": {}, "distributions": {}, "groups": {}}
+    values = df[numeric].to_numpy(dtype="float64", na_value=np.nan) if numeric else np.empty((len(df), 0))
+
+    with warnings.catch_warnings():
+        # Constant and all-missing columns give NaN statistics
+        warnings.simplefilter("ignore", RuntimeWarning)
+        if values.shape[1]:
+            quantiles = np.nanquantile(values, _QUANTILES, axis=0)
+            low, high = np.nanmin(values, axis=0), np.nanmax(values, axis=0)
+            for i, col in enumerate(numeric):
+                column = values[:, i]
+                finite = column[np.isfinite(column)]
+                counts, edges = np.histogram(finite, bins=STATS_HISTOGRAM_BINS) if len(finite) else ([], [])
+                stats["distributions"][str(col)] = {
+                    "quantiles": dict(zip(map(str, _QUANTILES), quantiles[:, i].tolist())),
+                    "min": float(low[i]), "max": float(high[i]),
+                    "histogram": {"counts": list(map(int, counts)), "edges": [float(edge) for edge in edges]}
+                }
+        if values.shape[1] >= 2:
+            columns = numeric[:STATS_MAX_COLUMNS]
+            matrix = pd.DataFrame(values[:, :len(columns)], columns=[str(col) for col in columns]).corr()
+            stats["correlations"] = {col: {other: value for other, value in row.items() if value == value}
+                                     for col, row in matrix.to_dict().items()}
+
+    group_columns = []
+    for col in categorical:
+        counts = df[col].value_counts(dropna=True)
+        # Categorical columns also count categories that never occur
+        counts = counts[counts > 0]
+        stats["top_values"][str(col)] = {
+            "distinct": int(len(counts)),
+            "values": [[str(value), int(count)] for value, count in counts.head(STATS_TOP_VALUES).items()]
+        }
+        if 2 <= len(counts) <= STATS_MAX_GROUPS:
+            group_columns.append((len(counts), col))
+
+    # The coarsest groupings, each summarizing every numeric column in one pass
+    frame = pd.DataFrame(values, columns=[str(col) for col in numeric])
+    for _, col in sorted(group_columns, key=lambda item: item[0])[:STATS_GROUP_COLUMNS] if numeric else []:
+        groups = frame.groupby(df[col].reset_index(drop=True), sort=False, observed=True, dropna=True)
+        summary = groups.agg(["count", "mean", "median", "sum"])
+        stats["groups"][str(col)] = {
+            numeric_col: {str(group): {stat: float(value) for stat, value in entry.items()}
+                          for group, entry in summary[numeric_col].to_dict(orient="index").items()}
+            for numeric_col in frame.columns
+        }
+    return stats
+
+# Computed statistics, most recently used last
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+# Function to get the statistics of a dataset, computing them once per dataset
+def get_statistics(df, profile):
+    """
+    Get the statistics of a dataset, cached per dataset hash
+
+    Statistics are kept in memory and next to the dataset in the dataset
+    cache, so they are computed once per file content. A dataset that is only
+    a preview of its file has no statistics, since they would not be exact.
+
+    Args:
+        df (DataFrame): The full data
+        profile (dict): The data profile (its dataset_key identifies the data)
+
+    Returns:
+        dict: The statistics from compute_statistics, or None for a preview
+    """
+    profile = profile or {}
+    if profile.get("preview_rows") is not None:
+        return None
+    key = profile.get("dataset_key")
+    if key:
+        with _lock:
+            if key in _cache:
+                _cache.move_to_end(key)
+                return _cache[key]
+        try:
+            with open(sidecar_path(key, "stats.json")) as f:
+                stats = json.load(f)
+        except (OSError, ValueError):
+            stats = None
+    else:
+        stats = None
+
+    if stats is None:
+        stats = compute_statistics(df, profile)
+        if key:
+            path = sidecar_path(key, "stats.json")
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                with open(tmp_path, "w") as f:
+                    json.dump(stats, f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning("Not caching the statistics of dataset %s: %s", key, e)
+
+    if key:
+        with _lock:
+            _cache[key] = stats
+            while len(_cache) > STATS_CACHE_ENTRIES:
+                _cache.popitem(last=False)
+    return stats
+
+# Function to format a number compactly
+def _number(value):
+    if value is None or value != value:
+        return "nan"
+    return f"{value:.0f}" if abs(value) >= 1e6 else f"{value:.6g}"
+
+# Function to render each kind of statistic, limited to the given columns
+def _describe_correlations(stats, columns, limit):
+    pairs = []
+    names = list(stats["correlations"])
+    for i, col in enumerate(names):
+        for other in names[i + 1:]:
+            if columns and col not in columns and other not in columns:
+                continue
+            value = stats["correlations"][col].get(other)
+            if value is not None:
+                pairs.append((abs(value), col, other, value))
+    pairs.sort(reverse=True)
+    return [f"- {col} ~ {other}: r={value:.3f}" for _, col, other, value in pairs[:limit]]
+
+def _describe_top_values(stats, columns, limit):
+    lines = []
+    rows = stats["rows"] or 1
+    for col, entry in stats["top_values"].items():
+        if columns and col not in columns:
+            continue
+        shown = ", ".join(f"{value} {count / rows:.1%} ({count})" for value, count in entry["values"])
+        lines.append(f"- {col} ({entry['distinct']} distinct): {shown}")
+    return lines[:limit]
+
+def _describe_distributions(stats, columns, limit):
+    lines = []
+    for col, entry in stats["distributions"].items():
+        if columns and col not in columns:
+            continue
+        quantiles = ", ".join(f"p{float(q) * 100:g}={_number(value)}" for q, value in entry["quantiles"].items())
+        line = f"- {col}: min={_number(entry['min'])}, {quantiles}, max={_number(entry['max'])}"
+        histogram = entry["histogram"]
+        if histogram["counts"]:
+            line += (f"; histogram of {len(histogram['counts'])} equal bins from {_number(histogram['edges'][0])} "
+                     f"to {_number(histogram['edges'][-1])}: {histogram['counts']}")
+        lines.append(line)
+    return lines[:limit]
+
+def _describe_groups(stats, columns, limit):
+    lines = []
+    for group_col, summaries in stats["groups"].items():
+        for numeric_col, groups in summaries.items():
+            named = (group_col in columns) + (numeric_col in columns)
+            if columns and not named:
+                continue
+            shown = "; ".join(f"{group}: n={int(entry['count'])}, mean={_number(entry['mean'])}, "
+                              f"median={_number(entry['median'])}, sum={_number(entry['sum'])}"
+                              for group, entry in groups.items())
+            lines.append((-named, f"- {numeric_col} by {group_col}: {shown}"))
+    # Summaries involving both named columns first
+    lines.sort(key=lambda item: item[0])
+    return [line for _, line in lines[:limit]]
+
+_SECTIONS = (
+    ("correlations", "Correlations (Pearson, strongest first)", _describe_correlations),
+    ("top_values", "Most common values (share of all rows)", _describe_top_values),
+    ("distributions", "Distributions", _describe_distributions),
+    ("groups", "Group-by summaries", _describe_groups)
+)
+
+# Function to describe the statistics relevant to a task for prompts
+def describe_statistics(stats, task=None, limit=STATS_PROMPT_ITEMS):
+    """
+    Describe precomputed statistics compactly, keeping those relevant to a task
+
+    Sections are chosen by the words in the task (e.g. "correlation",
+    "distribution", "by region"); a task that asks for none of them gets every
+    section. When the task names columns, only statistics involving them are kept.
+
+    Args:
+        stats (dict): The statistics from get_statistics
+        task (str): The analysis task, or None for everything
+        limit (int): The most lines per section
+
+    Returns:
+        str: The description (empty if there is nothing to show)
+    """
+    text = f" {(task or '').lower()} "
+    wanted = {name for name, words in _SECTION_KEYWORDS.items() if any(word in text for word in words)}
+    known = set(stats["top_values"]) | set(stats["distributions"])
+    columns = {col for col in known if len(col) >= 3 and col.lower() in text}
+
+    parts = []
+    for name, heading, describe in _SECTIONS:
+        if wanted and name not in wanted:
+            continue
+        lines = describe(stats, columns, limit)
+        if lines:
+            parts.append(f"{heading}:\n" + "\n".join(lines))
+    return "\n\n".join(parts)
+
+# Function to describe the statistics of every uploaded file
+def describe_dataset_statistics(dataframes, data_profiles, task=None, limit=STATS_PROMPT_ITEMS):
+    """
+    Describe the precomputed statistics of several files
+
+    Args:
+        dataframes (dict): Maps file names to DataFrames
+        data_profiles (dict): Maps file names to data profiles
+        task (str): The analysis task the statistics should be relevant to, or None for everything
+        limit (int): The most lines per section and file
+
+    Returns:
+        dict: Maps file names to descriptions, leaving out files without statistics
+    """
+    descriptions = {}
+    for name, profile in data_profiles.items():
+        stats = get_statistics(dataframes[name], profile)
+        description = describe_statistics(stats, task, limit) if stats else ""
+        if description:
+            descriptions[name] = description
+    return descriptions
@@ -1,101 +1,804 @@
 import os
+import time
+import asyncio
+import logging
+import tempfile
+import warnings
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
-import google.generativeai as genai
-from dotenv import load_dotenv
-import streamlit as st
+# Loads environment variables, so it comes before the src modules that read their settings
+from src.settings import LLM_BACKEND, get_api_key_error
+from src.dataset_store import DatasetWriter, compute_content_hash, dataset_path, open_dataset, save_dataset
+from src.dataset_registry import get_dataset_registry
+from src.sampling import RowReservoir, SampleBuilder, save_sample
+from src.sketches import SketchBuilder, save_sketches
+from src.response_cache import get_response_cache, make_cache_key
+from src.fake_llm import FakeGenerativeModel
+from src.metrics import cached_context_tokens, record_llm_call, stage_timer, usage_tokens
+from src.context_cache import CONTEXT_CACHE_ENABLED, get_context_cache
+from src.rate_limit import call_with_retries, get_coalescer
 
-# Load environment variables
-load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Where user-facing error messages go. Headless runs log them; the Streamlit
+# app shows them on the page with set_error_handler(st.error).
+_error_handler = logger.error
+
+# Function to choose where user-facing errors are reported
+def set_error_handler(handler):
+    """
+    Set the function called with user-facing error messages
+    
+    Args:
+        handler (callable): Called with the message (None restores logging)
+    """
+    global _error_handler
+    _error_handler = handler or logger.error
+
+# Function to report a user-facing error
+def report_error(message):
+    _error_handler(message)
+
+# The Gemini SDK takes a noticeable time to import, so it is imported and
+# configured on first use rather than at startup
+_genai = None
+_genai_lock = threading.Lock()
+
+# Function to import and configure the Gemini SDK once
+def _load_genai():
+    global _genai
+    with _genai_lock:
+        if _genai is None:
+            error = get_api_key_error()
+            if error:
+                raise RuntimeError(error)
+            import google.generativeai as genai
+            genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+            _genai = genai
+    return _genai
 
 # Configure Gemini API
 def configure_genai():
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        st.error("Gemini API key not found. Please set the GEMINI_API_KEY environment variable.")
-        st.stop()
-    genai.configure(api_key=api_key)
+    """
+    Configure the Gemini API key
+    
+    This happens automatically before the first request; calling it up front
+    reports a missing key early.
+    
+    Returns:
+        bool: True if the API is ready to use, False if the key is missing
+    """
+    if LLM_BACKEND == "fake":
+        return True
+    try:
+        _load_genai()
+    except RuntimeError as e:
+        report_error(str(e))
+        return False
+    return True
+
+# System instructions and generation settings for each AI persona. Adding a
+# persona only requires a new entry here.
+PERSONAS = {
+    "manager": {
+        "system_instruction": (
+            "You are an AI Data Analysis Manager. Your role is to create structured analytical plans, "
+            "synthesize insights, and provide clear guidance for data analysis projects. Be concise, professional, "
+            "and focus on creating actionable plans that address the business goals."
+        ),
+        "generation_config": {"temperature": 0.2}
+    },
+    "analyst": {
+        "system_instruction": (
+            "You are an AI Data Analyst. Your role is to examine data, perform calculations, "
+            "and provide objective observations about patterns and trends. Be precise, technical, and focus on "
+            "extracting meaningful insights from the data."
+        ),
+        "generation_config": {"temperature": 0.2}
+    },
+    "associate": {
+        "system_instruction": (
+            "You are an AI Senior Data Associate. Your role is to review analysis plans, "
+            "guide execution, define hypotheses, and formulate clear storylines for data exploration. Be strategic, "
+            "detail-oriented, and focus on connecting analysis to business objectives."
+        ),
+        "generation_config": {"temperature": 0.2}
+    },
+    "general": {
+        "system_instruction": "You are an AI assistant helping with data analysis.",
+        "generation_config": {"temperature": 0.2}
+    }
+}
+
+# GenerativeModel instances shared by all sessions, one per (persona, model)
+_models = {}
+_models_lock = threading.Lock()
+
+# Function to get the configuration of a persona
+def get_persona_config(persona):
+    return PERSONAS.get(persona, PERSONAS["general"])
+
+# Function to get the model instance for a persona
+def get_persona_model(persona, model="gemini-1.5-flash"):
+    """
+    Get the GenerativeModel for a persona, building it on first use
+    
+    The persona's system instruction and generation config are set on the model
+    itself, so later requests only need to send the prompt.
+    
+    Args:
+        persona (str): The persona to use (manager, analyst, associate)
+        model (str): The model to use
+    
+    Returns:
+        GenerativeModel: The shared model instance
+    """
+    key = (persona if persona in PERSONAS else "general", model)
+    instance = _models.get(key)
+    if instance is None:
+        with _models_lock:
+            instance = _models.get(key)
+            if instance is None:
+                config = get_persona_config(persona)
+                model_class = FakeGenerativeModel if LLM_BACKEND == "fake" else _load_genai().GenerativeModel
+                instance = model_class(
+                    model,
+                    system_instruction=config["system_instruction"],
+                    generation_config=config["generation_config"]
+                )
+                _models[key] = instance
+    return instance
 
 # Function to generate response from Gemini API
-def get_gemini_response(prompt, persona="general", model="gemini-1.5-flash"):
+def get_gemini_response(prompt, persona="general", model="gemini-1.5-flash", bypass_cache=False, stream=False):
     """
     Get a response from the Gemini API
     
+    Responses are cached per persona, model, generation config and prompt, so
+    repeating a request (e.g. on a Streamlit rerun) does not call the API again.
+    Requests share a process-wide rate limit, transient errors such as 429s are
+    retried with backoff, and identical prompts already in flight (from another
+    session or a background prefetch) wait for that request instead of sending
+    their own.
+    
     Args:
         prompt (str): The prompt to send to the API
         persona (str): The persona to use (manager, analyst, associate)
         model (str): The model to use (defaults to gemini-1.5-flash)
+        bypass_cache (bool): Skip the cache lookup and always call the API, e.g. to regenerate
+        stream (bool): Return an iterator of text chunks as they are generated
     
     Returns:
-        str: The response from the API
+        str: The response from the API (an iterator of str if stream is True)
+    
+    Raises:
+        StreamInterruptedError: From the iterator, if a streamed response fails
+            after some of its text was yielded
     """
+    cache_key = _response_cache_key(prompt, persona, model)
+    if stream:
+        cached = _lookup_cached_response(cache_key, persona, model, bypass_cache, stream=True)
+        if cached is not None:
+            return iter([cached])
+        return _stream_gemini_response(prompt, persona, model, cache_key)
+    
     try:
-        # Configure persona-specific system instructions
-        if persona == "manager":
-            system_instruction = """You are an AI Data Analysis Manager. Your role is to create structured analytical plans, 
-            synthesize insights, and provide clear guidance for data analysis projects. Be concise, professional, and focus 
-            on creating actionable plans that address the business goals."""
-        elif persona == "analyst":
-            system_instruction = """You are an AI Data Analyst. Your role is to examine data, perform calculations, 
-            and provide objective observations about patterns and trends. Be precise, technical, and focus on 
-            extracting meaningful insights from the data."""
-        elif persona == "associate":
-            system_instruction = """You are an AI Senior Data Associate. Your role is to review analysis plans, 
-            guide execution, define hypotheses, and formulate clear storylines for data exploration. Be strategic, 
-            detail-oriented, and focus on connecting analysis to business objectives."""
-        else:
-            system_instruction = """You are an AI assistant helping with data analysis."""
-        
-        # Generate response
-        model = genai.GenerativeModel(model)
-        response = model.generate_content(
-            [system_instruction, prompt],
-            generation_config={"temperature": 0.2}
-        )
-        
-        return response.text
+        text = generate_gemini_response(prompt, persona, model, bypass_cache=bypass_cache)
     except Exception as e:
-        st.error(f"Error generating response: {str(e)}")
+        report_error(f"Error generating response: {str(e)}")
+        return iter(()) if stream else None
+    return iter([text]) if stream else text
+
+# Function to generate a response without any Streamlit calls
+def generate_gemini_response(prompt, persona="general", model="gemini-1.5-flash", bypass_cache=False):
+    """
+    Get a response from the cache or the Gemini API, raising on failure
+    
+    This is the core of get_gemini_response for callers that handle errors
+    themselves, such as background prefetching and the batch pipeline.
+    
+    Args:
+        prompt (str): The prompt to send to the API
+        persona (str): The persona to use (manager, analyst, associate)
+        model (str): The model to use (defaults to gemini-1.5-flash)
+        bypass_cache (bool): Skip the cache lookup and always call the API
+    
+    Returns:
+        str: The response text
+    
+    Raises:
+        Exception: The API error once retries are exhausted
+    """
+    cache_key = _response_cache_key(prompt, persona, model)
+    cached = _lookup_cached_response(cache_key, persona, model, bypass_cache)
+    if cached is not None:
+        return cached
+    
+    started = time.perf_counter()
+    # Concurrent requests for the same prompt share one API call
+    while True:
+        try:
+            text, sent = get_coalescer().run(cache_key, lambda: _generate_response(prompt, persona, model, cache_key))
+            break
+        except _StreamClosedError:
+            # The streamed request this one waited for was abandoned; send it instead
+            continue
+    if not sent:
+        record_llm_call(persona, model, time.perf_counter() - started, coalesced=True)
+    return text
+
+# Function to generate a response from a coroutine without blocking the event loop
+async def generate_gemini_response_async(prompt, persona="general", model="gemini-1.5-flash", bypass_cache=False):
+    """
+    Get a response from the cache or the Gemini API without blocking an asyncio event loop
+    
+    The request runs on a worker thread through generate_gemini_response, so
+    concurrent coroutines still share the response cache, the process-wide
+    rate limit, retries and request coalescing with every other caller.
+    Callers bound how many requests they have in flight themselves, e.g.
+    with an asyncio.Semaphore.
+    
+    Args:
+        prompt (str): The prompt to send to the API
+        persona (str): The persona to use (manager, analyst, associate)
+        model (str): The model to use (defaults to gemini-1.5-flash)
+        bypass_cache (bool): Skip the cache lookup and always call the API
+    
+    Returns:
+        str: The response text
+    
+    Raises:
+        Exception: The API error once retries are exhausted
+    """
+    return await asyncio.to_thread(generate_gemini_response, prompt, persona, model, bypass_cache)
+
+# Identify a response by persona, model, generation config and prompt
+def _response_cache_key(prompt, persona, model):
+    # Keep responses from different backends apart in the cache
+    cache_model = model if LLM_BACKEND == "gemini" else f"{LLM_BACKEND}:{model}"
+    return make_cache_key(persona, cache_model, get_persona_config(persona), prompt)
+
+# Return the cached response, if any, recording the lookup
+def _lookup_cached_response(cache_key, persona, model, bypass_cache, stream=False):
+    cache = get_response_cache()
+    if bypass_cache:
+        cache.record_bypass()
         return None
+    started = time.perf_counter()
+    cached = cache.get(cache_key)
+    if cached is not None:
+        record_llm_call(persona, model, time.perf_counter() - started, cached=True, stream=stream)
+    return cached
+
+# Function to choose the model and text for a request, using a cached context when the prompt has one
+def _request_for(prompt, persona, model):
+    """
+    Get the model to send a prompt to and the text to send
+
+    Prompts built with a shared context (SplitPrompt) send only their suffix
+    to a model bound to the cached context; everything else, and any context
+    that could not be cached, is sent whole to the persona's model.
+
+    Args:
+        prompt (str): The prompt
+        persona (str): The persona to use
+        model (str): The model to use
+
+    Returns:
+        GenerativeModel: The model to call
+        str: The text to send it
+    """
+    context = getattr(prompt, "context", None)
+    if context and CONTEXT_CACHE_ENABLED:
+        if LLM_BACKEND != "fake":
+            _load_genai()
+        cached_model = get_context_cache().model_for(context, persona if persona in PERSONAS else "general",
+                                                     model, get_persona_config(persona))
+        if cached_model is not None:
+            return cached_model, prompt.suffix
+    return get_persona_model(persona, model), str(prompt)
+
+# Send one request under the shared rate limit, then record and cache the response
+def _generate_response(prompt, persona, model, cache_key):
+    started = time.perf_counter()
+    try:
+        instance, request = _request_for(prompt, persona, model)
+        response, retries = call_with_retries(lambda: instance.generate_content(request))
+        text = response.text
+    except Exception as e:
+        record_llm_call(persona, model, time.perf_counter() - started, retries=getattr(e, "retries", 0),
+                        error=str(e))
+        raise
+    
+    latency = time.perf_counter() - started
+    prompt_tokens, output_tokens = usage_tokens(response)
+    record_llm_call(persona, model, latency, prompt_tokens=prompt_tokens, output_tokens=output_tokens,
+                    retries=retries, context_tokens=cached_context_tokens(response))
+    get_response_cache().put(cache_key, text, latency=latency)
+    return text
+
+# Raised by a streamed response that failed after part of it was yielded
+class StreamInterruptedError(RuntimeError):
+    pass
+
+# Passed to requests waiting for a stream whose reader stopped early
+class _StreamClosedError(StreamInterruptedError):
+    pass
+
+# Yield response chunks as they arrive and cache the full text once complete
+def _stream_gemini_response(prompt, persona, model, cache_key):
+    # The stream registers as the request in flight once iteration starts;
+    # identical requests (streamed or not) wait for its full text
+    coalescer = get_coalescer()
+    started = time.perf_counter()
+    while True:
+        future, leader = coalescer.lead(cache_key)
+        if leader:
+            break
+        try:
+            text = future.result()
+        except _StreamClosedError:
+            # Nothing failed; the stream was abandoned, so send the request instead
+            continue
+        except Exception as e:
+            report_error(f"Error generating response: {str(e)}")
+            return
+        record_llm_call(persona, model, time.perf_counter() - started, coalesced=True, stream=True)
+        yield text
+        return
+    
+    # Rate limit errors surface when the first chunk is requested, so retries
+    # cover opening the stream; a stream that fails midway is not restarted
+    def open_stream():
+        response = iter(instance.generate_content(request, stream=True))
+        return next(response, None), response
+    
+    chunks = []
+    first_token_latency = None
+    retries = 0
+    started = time.perf_counter()
+    try:
+        try:
+            instance, request = _request_for(prompt, persona, model)
+            (chunk, response), retries = call_with_retries(open_stream)
+            first_token_latency = time.perf_counter() - started
+            while chunk is not None:
+                chunks.append(chunk.text)
+                yield chunks[-1]
+                last, chunk = chunk, next(response, None)
+        except Exception as e:
+            future.set_exception(e)
+            record_llm_call(persona, model, time.perf_counter() - started, retries=getattr(e, "retries", retries),
+                            stream=True, error=str(e), first_token_latency=first_token_latency)
+            report_error(f"Error generating response: {str(e)}")
+            if chunks:
+                # The text yielded so far is incomplete and must not be kept as the answer
+                raise StreamInterruptedError(f"The response was interrupted after {len(chunks)} chunks") from e
+            return
+        
+        latency = time.perf_counter() - started
+        # The token counts arrive with the last chunk
+        prompt_tokens, output_tokens = usage_tokens(last) if chunks else (None, None)
+        record_llm_call(persona, model, latency, prompt_tokens=prompt_tokens, output_tokens=output_tokens,
+                        retries=retries, stream=True, first_token_latency=first_token_latency,
+                        context_tokens=cached_context_tokens(last) if chunks else None)
+        text = "".join(chunks)
+        get_response_cache().put(cache_key, text, latency=latency)
+        future.set_result(text)
+    finally:
+        # A stream closed early (e.g. by a Streamlit rerun) must not leave waiting requests hanging
+        if not future.done():
+            future.set_exception(_StreamClosedError("The response stream was closed before it finished"))
+        coalescer.done(cache_key)
+
+# Large-file ingestion settings. Files above either threshold are read in
+# bounded-size chunks and profiled in a single pass instead of being loaded whole.
+CHUNKED_INGEST_BYTE_THRESHOLD = int(os.getenv("CHUNKED_INGEST_BYTE_THRESHOLD", 200 * 1024 * 1024))
+CHUNKED_INGEST_ROW_THRESHOLD = int(os.getenv("CHUNKED_INGEST_ROW_THRESHOLD", 2_000_000))
+CSV_CHUNK_BYTES = int(os.getenv("CSV_CHUNK_BYTES", 64 * 1024 * 1024))
+CSV_PREVIEW_ROWS = int(os.getenv("CSV_PREVIEW_ROWS", 1000))
+MEDIAN_SAMPLE_ROWS = int(os.getenv("MEDIAN_SAMPLE_ROWS", 10_000))
+_PEEK_BYTES = 64 * 1024
+
+# Function to get the size in bytes of an uploaded file
+def _get_file_size(uploaded_file):
+    size = getattr(uploaded_file, "size", None)
+    if size is not None:
+        return size
+    position = uploaded_file.tell()
+    uploaded_file.seek(0, os.SEEK_END)
+    size = uploaded_file.tell()
+    uploaded_file.seek(position)
+    return size
+
+# Function to estimate the average row width from the start of a file
+def _estimate_bytes_per_row(uploaded_file):
+    position = uploaded_file.tell()
+    head = uploaded_file.read(_PEEK_BYTES)
+    uploaded_file.seek(position)
+    if isinstance(head, str):
+        head = head.encode("utf-8")
+    lines = head.count(b"\n")
+    return max(len(head) / max(lines, 1), 1.0)
+
+# Function to decide whether a file should be ingested in chunks
+def should_use_chunked_ingest(uploaded_file):
+    """
+    Decide whether a file is large enough to be ingested in chunks
+    
+    Args:
+        uploaded_file: The uploaded file object from Streamlit (or any binary file object)
+    
+    Returns:
+        bool: True if the file exceeds the configured byte or estimated row threshold
+    """
+    size = _get_file_size(uploaded_file)
+    if size >= CHUNKED_INGEST_BYTE_THRESHOLD:
+        return True
+    estimated_rows = size / _estimate_bytes_per_row(uploaded_file)
+    return estimated_rows >= CHUNKED_INGEST_ROW_THRESHOLD
+
+# Merge the dtype seen in a new chunk into the dtype seen so far, mirroring
+# what pd.read_csv would infer for the whole column
+def _merge_dtypes(current, new):
+    if current is None or current == new:
+        return new
+    if pd.api.types.is_numeric_dtype(current) and pd.api.types.is_numeric_dtype(new) \
+            and not pd.api.types.is_bool_dtype(current) and not pd.api.types.is_bool_dtype(new):
+        return np.promote_types(current, new)
+    return np.dtype("object")
+
+# Incrementally built data profile, updated once per chunk
+class _ChunkedProfile:
+    def __init__(self):
+        self.columns = None
+        self.rows = 0
+        self.dtypes = {}
+        self.missing = None
+        self.count = None
+        self.sum = None
+        self.min = None
+        self.max = None
+        self.reservoir = RowReservoir(MEDIAN_SAMPLE_ROWS)
+
+    def update(self, chunk):
+        if self.columns is None:
+            self.columns = list(chunk.columns)
+            self.missing = pd.Series(0, index=chunk.columns, dtype="int64")
+        self.rows += len(chunk)
+        for col, dtype in chunk.dtypes.items():
+            self.dtypes[col] = _merge_dtypes(self.dtypes.get(col), dtype)
+        self.missing = self.missing.add(chunk.isna().sum(), fill_value=0)
+        
+        numeric = chunk.select_dtypes(include=['number'])
+        count, total = numeric.count(), numeric.sum()
+        low, high = numeric.min(), numeric.max()
+        if self.count is None:
+            self.count, self.sum, self.min, self.max = count, total, low, high
+        else:
+            self.count = self.count.add(count, fill_value=0)
+            self.sum = self.sum.add(total, fill_value=0)
+            self.min = pd.concat([self.min, low], axis=1).min(axis=1)
+            self.max = pd.concat([self.max, high], axis=1).max(axis=1)
+        self.reservoir.update(chunk)
+
+    def to_profile(self):
+        dtypes = {col: str(self.dtypes[col]) for col in self.columns}
+        sample = self.reservoir.sample()
+        numeric_summary = {}
+        for col in self.columns:
+            dtype = self.dtypes[col]
+            if not pd.api.types.is_numeric_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+                continue
+            count = self.count.get(col, 0)
+            numeric_summary[col] = {
+                "mean": self.sum[col] / count if count else np.nan,
+                "median": pd.to_numeric(sample[col], errors="coerce").median(),
+                "min": self.min.get(col, np.nan),
+                "max": self.max.get(col, np.nan)
+            }
+        return {
+            "columns": self.columns,
+            "shape": (self.rows, len(self.columns)),
+            "dtypes": dtypes,
+            "missing_values": {col: int(self.missing[col]) for col in self.columns},
+            "numeric_summary": numeric_summary,
+            "ingest_mode": "chunked",
+            "median_sample_rows": len(sample)
+        }
+
+# Function to read a large CSV file in bounded-size chunks
+def _process_csv_in_chunks(uploaded_file, writer):
+    chunk_rows = max(int(CSV_CHUNK_BYTES / _estimate_bytes_per_row(uploaded_file)), 1)
+    profiler = _ChunkedProfile()
+    sampler = SampleBuilder()
+    sketcher = SketchBuilder()
+    preview = []
+    preview_rows = 0
+    
+    for chunk in pd.read_csv(uploaded_file, chunksize=chunk_rows):
+        profiler.update(chunk)
+        sampler.update(chunk)
+        sketcher.update(chunk)
+        writer.write(chunk)
+        if preview_rows < CSV_PREVIEW_ROWS:
+            preview.append(chunk.head(CSV_PREVIEW_ROWS - preview_rows))
+            preview_rows += len(preview[-1])
+    
+    if profiler.columns is None:
+        raise ValueError("No columns to parse from file")
+    
+    df = pd.concat(preview, ignore_index=True)
+    profile = profiler.to_profile()
+    profile["dataset_key"] = writer.key
+    save_sample(writer.key, sampler.finish())
+    save_sketches(writer.key, sketcher.finish())
+    if writer.finish(profile):
+        # The full data is now in the dataset cache and can be memory-mapped
+        return open_dataset(writer.key)
+    profile["preview_rows"] = len(df)
+    logger.warning("Dataset %s could not be cached; only its first %d of %d rows are loaded",
+                   writer.key, len(df), profile["shape"][0])
+    return df, profile
+
+# Object columns with at most this share of distinct values are stored as categories
+CATEGORY_MAX_UNIQUE_RATIO = float(os.getenv("CATEGORY_MAX_UNIQUE_RATIO", 0.5))
+
+# Function to profile a DataFrame
+def profile_dataframe(df):
+    """
+    Build the data profile of a DataFrame
+    
+    All numeric statistics are computed in one batched NumPy pass over a single
+    2-D array instead of one pandas call per column and statistic.
+    
+    Args:
+        df (DataFrame): The data to profile
+    
+    Returns:
+        dict: The profile (columns, shape, dtypes, missing_values, numeric_summary)
+    """
+    numeric = df.select_dtypes(include=['number'])
+    numeric_summary = {}
+    if len(numeric.columns) and len(numeric):
+        values = numeric.to_numpy(dtype="float64", na_value=np.nan)
+        with warnings.catch_warnings():
+            # All-missing columns produce NaN statistics, as in pandas
+            warnings.simplefilter("ignore", RuntimeWarning)
+            stats = np.vstack([
+                np.nanmean(values, axis=0),
+                np.nanmedian(values, axis=0),
+                np.nanmin(values, axis=0),
+                np.nanmax(values, axis=0)
+            ])
+        for i, col in enumerate(numeric.columns):
+            numeric_summary[col] = {
+                "mean": stats[0, i],
+                "median": stats[1, i],
+                "min": stats[2, i],
+                "max": stats[3, i]
+            }
+    
+    return {
+        "columns": list(df.columns),
+        "shape": df.shape,
+        "dtypes": {col: str(dtype) for col, dtype in df.dtypes.items()},
+        "missing_values": dict(zip(df.columns, df.isna().to_numpy().sum(axis=0).tolist())),
+        "numeric_summary": numeric_summary
+    }
+
+# Function to reduce the memory used by a DataFrame
+def optimize_dtypes(df):
+    """
+    Downcast numeric columns and store low-cardinality text columns as categories
+    
+    Integers are downcast to the smallest integer type that holds them and
+    floats to float32. Object/string columns whose share of distinct values is
+    at most CATEGORY_MAX_UNIQUE_RATIO become categoricals.
+    
+    Args:
+        df (DataFrame): The data to optimize
+    
+    Returns:
+        DataFrame: A frame with the same values and smaller dtypes
+    """
+    converted = {}
+    for col, dtype in df.dtypes.items():
+        if pd.api.types.is_bool_dtype(dtype):
+            continue
+        if pd.api.types.is_integer_dtype(dtype):
+            converted[col] = pd.to_numeric(df[col], downcast="integer")
+        elif pd.api.types.is_float_dtype(dtype):
+            converted[col] = pd.to_numeric(df[col], downcast="float")
+        elif pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype):
+            if len(df) and df[col].nunique(dropna=True) <= CATEGORY_MAX_UNIQUE_RATIO * len(df):
+                converted[col] = df[col].astype("category")
+    if not converted:
+        return df
+    df = df.copy(deep=False)
+    for col, series in converted.items():
+        df[col] = series
+    return df
+
+# Function to read and profile a CSV file, raising on errors
+def load_csv_file(uploaded_file, chunked=None):
+    """
+    Read and profile a CSV file
+    
+    Parsed files are stored in the dataset cache keyed by a hash of their
+    content, so uploading the same file again memory-maps the cached copy
+    instead of parsing the CSV. A file already loaded by another session is
+    taken from the shared dataset registry.
+    
+    Files above CHUNKED_INGEST_BYTE_THRESHOLD bytes or CHUNKED_INGEST_ROW_THRESHOLD
+    estimated rows are read in chunks of roughly CSV_CHUNK_BYTES and profiled in a
+    single pass. In that mode medians are estimated from a random sample of rows,
+    and if the file cannot be cached only the first CSV_PREVIEW_ROWS rows are
+    kept in the returned DataFrame.
+    
+    Args:
+        uploaded_file: The uploaded file object from Streamlit (or any binary file object)
+        chunked (bool): Force chunked ingestion on or off (defaults to automatic)
+    
+    Returns:
+        DataFrame: The processed pandas DataFrame
+        dict: A profile of the data
+    
+    Raises:
+        Exception: Any error raised while reading or parsing the file
+    """
+    key = compute_content_hash(uploaded_file)
+    # Another session may already hold this file
+    df, profile = get_dataset_registry().get(key)
+    if df is None:
+        df, profile = open_dataset(key)
+    if df is not None:
+        return df, profile
+    
+    if chunked is None:
+        chunked = should_use_chunked_ingest(uploaded_file)
+    if chunked:
+        return _process_csv_in_chunks(uploaded_file, DatasetWriter(key))
+    
+    # Read the CSV file
+    df = pd.read_csv(uploaded_file)
+    
+    # Keep a row sample and column sketches for prompts while the parsed data is at hand
+    sampler = SampleBuilder()
+    sampler.update(df)
+    save_sample(key, sampler.finish())
+    sketcher = SketchBuilder()
+    sketcher.update(df)
+    save_sketches(key, sketcher.finish())
+    
+    # Profile first so the statistics use the parsed precision, then shrink the frame
+    with stage_timer("profile", rows=len(df), columns=len(df.columns)):
+        profile = profile_dataframe(df)
+        profile["ingest_mode"] = "full"
+        profile["dataset_key"] = key
+        df = optimize_dtypes(df)
+        profile["dtypes"] = {col: str(dtype) for col, dtype in df.dtypes.items()}
+    
+    # Swap the parsed frame for its memory-mapped cached copy
+    if save_dataset(key, df, profile):
+        cached_df, cached_profile = open_dataset(key)
+        if cached_df is not None:
+            return cached_df, cached_profile
+    
+    return df, profile
 
 # Function to read and process CSV files
-def process_csv_file(uploaded_file):
+def process_csv_file(uploaded_file, chunked=None):
     """
     Process an uploaded CSV file
     
+    See load_csv_file for how files are read and cached. Errors are passed to
+    the error handler (shown on the page in the app) instead of being raised.
+    
     Args:
         uploaded_file: The uploaded file object from Streamlit
+        chunked (bool): Force chunked ingestion on or off (defaults to automatic)
     
     Returns:
         DataFrame: The processed pandas DataFrame
         dict: A profile of the data
     """
     try:
-        # Read the CSV file
-        df = pd.read_csv(uploaded_file)
-        
-        # Generate a basic profile of the data
-        profile = {
-            "columns": list(df.columns),
-            "shape": df.shape,
-            "dtypes": {col: str(dtype) for col, dtype in df.dtypes.items()},
-            "missing_values": df.isna().sum().to_dict(),
-            "numeric_summary": {}
-        }
-        
-        # Generate summary statistics for numeric columns
-        for col in df.select_dtypes(include=['number']).columns:
-            profile["numeric_summary"][col] = {
-                "mean": df[col].mean(),
-                "median": df[col].median(),
-                "min": df[col].min(),
-                "max": df[col].max()
-            }
-        
-        return df, profile
+        return load_csv_file(uploaded_file, chunked=chunked)
     except Exception as e:
-        st.error(f"Error processing CSV file: {str(e)}")
+        report_error(f"Error processing CSV file: {str(e)}")
         return None, None
 
+# Number of worker processes used to ingest several files at once
+INGEST_MAX_WORKERS = int(os.getenv("INGEST_MAX_WORKERS", min(os.cpu_count() or 1, 8)))
+
+# Parse one spooled file in a worker process. The data is handed back through
+# the dataset cache, so only the profile has to cross the process boundary.
+def _ingest_file_worker(path):
+    with open(path, "rb") as f:
+        df, profile = load_csv_file(f)
+    cached = os.path.exists(dataset_path(profile["dataset_key"]))
+    return (None if cached else df), profile
+
+# Function to read and process several CSV files in parallel
+def process_csv_files(uploaded_files, max_workers=None, progress_callback=None):
+    """
+    Process several uploaded CSV files concurrently in a process pool
+    
+    Files that are already in the dataset cache are opened directly; the others
+    are parsed and profiled in separate processes. A file that fails to load
+    does not affect the others.
+    
+    Args:
+        uploaded_files (list): The uploaded file objects from Streamlit
+        max_workers (int): The number of worker processes (defaults to INGEST_MAX_WORKERS)
+        progress_callback (callable): Called as progress_callback(file_name, done, total, error)
+            after each file finishes; error is None on success
+    
+    Returns:
+        dict: Maps file names to (DataFrame, profile) tuples for files that loaded
+        dict: Maps file names to error messages for files that failed
+    """
+    max_workers = INGEST_MAX_WORKERS if max_workers is None else max_workers
+    results, errors = {}, {}
+    total = len(uploaded_files)
+    
+    def finished(name, error=None):
+        if error is not None:
+            errors[name] = error
+        if progress_callback is not None:
+            progress_callback(name, len(results) + len(errors), total, error)
+    
+    # Cache hits need no parsing
+    pending = []
+    for uploaded_file in uploaded_files:
+        try:
+            df, profile = open_dataset(compute_content_hash(uploaded_file))
+        except Exception as e:
+            finished(uploaded_file.name, str(e))
+            continue
+        if df is not None:
+            results[uploaded_file.name] = (df, profile)
+            finished(uploaded_file.name)
+        else:
+            pending.append(uploaded_file)
+    
+    if len(pending) <= 1 or max_workers <= 1:
+        for uploaded_file in pending:
+            try:
+                results[uploaded_file.name] = load_csv_file(uploaded_file)
+                finished(uploaded_file.name)
+            except Exception as e:
+                finished(uploaded_file.name, str(e))
+        return results, errors
+    
+    with tempfile.TemporaryDirectory(prefix="ingest-") as spool_dir:
+        # Spool uploads to disk so workers can read them without pickling the bytes
+        paths = {}
+        for i, uploaded_file in enumerate(pending):
+            paths[uploaded_file.name] = os.path.join(spool_dir, f"{i}.csv")
+            with open(paths[uploaded_file.name], "wb") as f:
+                f.write(uploaded_file.getbuffer() if hasattr(uploaded_file, "getbuffer") else uploaded_file.read())
+        
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(pending)), mp_context=context) as pool:
+            futures = {pool.submit(_ingest_file_worker, path): name for name, path in paths.items()}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    df, profile = future.result()
+                    if df is None:
+                        df, profile = open_dataset(profile["dataset_key"])
+                    results[name] = (df, profile)
+                    finished(name)
+                except Exception as e:
+                    finished(name, str(e))
+    
+    return results, errors
+
 # Function to generate a data profile summary for the AI Analyst
 def generate_data_profile_summary(profile):
     """
@@ -114,7 +817,10 @@ def generate_data_profile_summary(profile):
     Data Profile Summary:
     - Dimensions: {profile['shape'][0]} rows × {profile['shape'][1]} columns
     - Columns: {', '.join(profile['columns'])}
-    
+    """
+    if profile.get("preview_rows") is not None:
+        summary += f"- Only the first {profile['preview_rows']} rows are loaded for analysis\n    "
+    summary += """
     Data Types:
     """
     
@@ -130,5 +836,7 @@ def generate_data_profile_summary(profile):
         summary += "\nNumeric Column Statistics:\n"
         for col, stats in profile['numeric_summary'].items():
             summary += f"- {col}: mean={stats['mean']:.2f}, median={stats['median']:.2f}, min={stats['min']:.2f}, max={stats['max']:.2f}\n"
+        if profile.get('ingest_mode') == "chunked":
+            summary += f"(Medians estimated from a random sample of {profile['median_sample_rows']} rows)\n"
     
     return summary